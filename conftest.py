@@ -0,0 +1,3 @@
+#!/usr/bin/env python
+
+# marks the repository root, so pytest puts it on sys.path and the tests import tradingbot from the tree
@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+
+import argparse
+from tradingbot.utils import get_tickers_from_file
+from tradingbot.papertrade import SQLiteReplaySource, PaperBroker, run_paper_trading
+from tradingbot.streaming import warm_start_from_db
+
+
+def main():
+    parser = argparse.ArgumentParser(description="paper trade by replaying stored bars")
+    parser.add_argument('--start', default=None, help="first bar to replay")
+    parser.add_argument('--end', default=None, help="last bar to replay")
+    parser.add_argument('--speed', type=float, default=None,
+                        help="simulated seconds per real second, 3600 plays one hourly bar per second (default: flat out)")
+    parser.add_argument('--queue-size', type=int, default=64, help="bars buffered per ticker before the feed waits")
+    parser.add_argument('--warm-start', default=None, help="replay stored bars from this date up to --start into the indicators first")
+    parser.add_argument('--balance', type=float, default=10000)
+    parser.add_argument('--fill-log', default=None, help="append every fill to this csv file (only the latest are kept in memory)")
+    parser.add_argument('--max-loss-count', type=int, default=15, help="losing exits before no new positions are opened (0: no limit)")
+    args = parser.parse_args()
+
+    tickers = get_tickers_from_file()
+
+    # indicators can be warmed up from earlier bars so tickers don't sit out their first 50 bars
+    bank = None
+    if args.warm_start is not None:
+        bank = warm_start_from_db(tickers, start_date=args.warm_start, end_date=args.start)
+
+    source = SQLiteReplaySource(tickers, start=args.start, end=args.end, speed=args.speed)
+    broker = PaperBroker(initial_balance=args.balance, max_loss_count=args.max_loss_count, fill_log=args.fill_log)
+    run_paper_trading(source, broker, bank, queue_size=args.queue_size)
+
+
+if __name__ == '__main__':
+    main()
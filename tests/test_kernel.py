@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+import numpy as np
+import pytest
+from tradingbot.backtest import backtest, backtest_rowwise
+from tradingbot.compact import bar_arrays
+from tradingbot.kernel import _sweep, _sweep_vectorized, simulate
+from tradingbot.scoring import generate_trade_signals_batch
+from tradingbot.synthetic import generate_bars
+
+REPORTED = ('final_value', 'total_return', 'sharpe_ratio', 'avg_return', 'volatility', 'max_drawdown', 'trades')
+
+
+@pytest.fixture(scope='module')
+def bars():
+    data = generate_bars(3, 300, seed=1)
+    return sorted(data.index.get_level_values('Ticker').unique()), data
+
+
+@pytest.fixture(scope='module')
+def arrays(bars):
+    _, data = bars
+    arrays = bar_arrays(data)
+    indicators = arrays['indicators']
+    return (
+        np.ascontiguousarray(arrays['close']),
+        np.ascontiguousarray(indicators.in_source_order('atr'), dtype=np.float64),
+        np.ascontiguousarray(generate_trade_signals_batch(indicators.as_columns(source_order=True)), dtype=np.int8)
+    )
+
+
+# the kernel against the row-by-row reference it replaced, with and without the loss limit
+@pytest.mark.parametrize('max_loss_count', [0, 1, 2, 15])
+def test_backtest_matches_rowwise(bars, max_loss_count):
+    pytest.importorskip('talib')
+    tickers, data = bars
+    kernel = backtest(tickers, data, max_loss_count=max_loss_count)
+    reference = backtest_rowwise(tickers, data, max_loss_count=max_loss_count)
+
+    assert set(kernel) == set(reference)
+    for name in REPORTED:
+        assert kernel[name] == pytest.approx(reference[name], rel=1e-9), name
+    assert np.allclose(kernel['returns'].to_numpy(), reference['returns'].to_numpy())
+
+
+def test_loss_limit_binds(bars):
+    # the data has to take enough losses for the limit to matter, or the tests above prove nothing
+    tickers, data = bars
+    unlimited = backtest(tickers, data, max_loss_count=0)
+    limited = backtest(tickers, data, max_loss_count=1)
+    assert limited['trades'] < unlimited['trades']
+
+
+def test_bounded_backtest_matches_unbounded(bars):
+    tickers, data = bars
+    full = backtest(tickers, data, max_loss_count=2)
+    bounded = backtest(tickers, data, max_loss_count=2, history_capacity=16)
+    assert set(bounded) == set(full)
+    for name in REPORTED:
+        assert bounded[name] == pytest.approx(full[name], rel=1e-9), name
+
+
+# the compiled sweep against its numpy fallback, and both against single simulate() runs
+def test_sweep_matches_vectorized(arrays):
+    close, atr, signals = arrays
+    stop_loss = np.array([0.05, 0.1356, 0.3, 0.1356, 0.1356, 0.6])
+    take_profit = np.array([0.1, 0.1954, 0.4, 0.1954, 0.1954, 0.05])
+    cooling_off = np.array([0, 18, 5, 18, 18, 2], dtype=np.int64)
+    max_loss_count = np.array([0, 0, 0, 1, 2, 3], dtype=np.int64)
+
+    compiled = np.full((len(stop_loss), 4), np.nan)
+    vectorized = np.full((len(stop_loss), 4), np.nan)
+    for sweep, stats in ((_sweep, compiled), (_sweep_vectorized, vectorized)):
+        sweep(close, atr, signals, 50, 10000.0, stop_loss, take_profit, 0.005, 0.002, cooling_off,
+              max_loss_count, 0.02, stats)
+    assert np.allclose(compiled, vectorized, rtol=1e-9, equal_nan=True)
+
+    for p in range(len(stop_loss)):
+        result = simulate(close, atr, signals, stop_loss_percent=stop_loss[p], take_profit_percent=take_profit[p],
+                          cooling_off_period=cooling_off[p], max_loss_count=max_loss_count[p], history_capacity=0)
+        expected = [result['final_value'], result['return_count'], result['return_mean'], result['return_m2']]
+        assert np.allclose(compiled[p], expected, rtol=1e-9, equal_nan=True)
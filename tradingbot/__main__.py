@@ -0,0 +1,6 @@
+#!/usr/bin/env python
+
+from tradingbot.cli import main
+
+if __name__ == '__main__':
+    raise SystemExit(main())
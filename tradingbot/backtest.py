@@ -1,17 +1,21 @@
 #!/usr/bin/env python
 
+import math
 import pandas as pd
-import matplotlib.pyplot as plt
-import numpy as np
-from tqdm import tqdm
-from tradingbot.scoring import generate_trade_signal
+from tradingbot import instrument
+from tradingbot.scoring import generate_trade_signal, generate_trade_signals_batch
 from tradingbot.indicators import calculate_latest_indicators, precompute_indicators
+from tradingbot.kernel import simulate, simulate_metrics, equity_metrics
+from tradingbot.compact import bar_arrays
+from tradingbot.recorder import EquityRecorder, MetricsAccumulator
 from tradingbot.utils import calculate_position_size
 
 def process_ticker_data(timestamp, ticker, data, indicators_cache, take_profit_percent, stop_loss_percent, 
                         balance, position, position_price, pbar, commission_percent, slippage_percent, 
-                        max_loss_count, cooling_off_period, cooling_off_counter, savings):
-    ticker_data = data.xs(ticker, level='Ticker').loc[:timestamp].tail(50)
+                        max_loss_count, cooling_off_period, cooling_off_counter, savings,
+                        correlation_filter=None, holdings=(), loss_count=0):
+    with instrument.stage('xs_slice'):
+        ticker_data = data.xs(ticker, level='Ticker').loc[:timestamp].tail(50)
 
     # check if the indicators for this ticker and timestamp are already cached
     if (ticker, timestamp) not in indicators_cache:
@@ -24,15 +28,23 @@ def process_ticker_data(timestamp, ticker, data, indicators_cache, take_profit_p
 
     # process trading logic for each tick
     position_data = position
-    portfolio_history = []
 
-    # cooling off period logic (no trades if cooling off is active)
+    # cooling off period logic (no trades and no portfolio value if cooling off is active)
     if cooling_off_counter > 0:
         cooling_off_counter -= 1
-        return portfolio_history, position_data, position_price, balance, savings, cooling_off_counter
+        return None, position_data, position_price, balance, savings, cooling_off_counter
+
+    # shrink or block the entry when it moves with what is already held
+    exposure = 1.0
+    if correlation_filter is not None and position_data is None and signal == "BUY":
+        exposure = correlation_filter.scale([ticker], holdings)[0]
+
+    # no new positions once max_loss_count losing exits were taken (0 disables the limit)
+    if max_loss_count > 0 and loss_count >= max_loss_count:
+        exposure = 0.0
 
     # buying logic: if no position and signal is "BUY"
-    if position_data is None and signal == "BUY":
+    if position_data is None and signal == "BUY" and exposure > 0:
         position_price = ticker_data['Close'].iloc[-1]
 
         # apply slippage and commission to the position price
@@ -43,7 +55,8 @@ def process_ticker_data(timestamp, ticker, data, indicators_cache, take_profit_p
         atr = indicators['atr']
 
         # calculate position size based on risk management (2% of balance risk per trade)
-        max_shares = calculate_position_size(balance, position_price, stop_loss_percent, risk_percent=0.02)
+        max_shares = calculate_position_size(balance, position_price, stop_loss_percent, risk_percent=0.02,
+                                             exposure=exposure)
         
         # update position and balance
         position_data = max_shares
@@ -52,7 +65,7 @@ def process_ticker_data(timestamp, ticker, data, indicators_cache, take_profit_p
         # set cooling off period after buying
         cooling_off_counter = cooling_off_period
 
-        if max_shares != 0:
+        if max_shares != 0 and pbar is not None:
             pbar.set_description(f"[SYSTEM]: {position_data:<3} SHARES OF {ticker:<4}")
 
 
@@ -76,37 +89,142 @@ def process_ticker_data(timestamp, ticker, data, indicators_cache, take_profit_p
             position_data = None
 
     # track portfolio value
-    portfolio_history.append({
-        'timestamp': timestamp,
-        'balance': balance,
-        'savings': savings,
-        'position': position_data,
-        'portfolio_value': balance + savings if position_data is None else position_data * ticker_data['Close'].iloc[-1] + balance + savings
-    })
+    close = ticker_data['Close'].iloc[-1]
+    portfolio_value = balance + savings if position_data is None else position_data * close + balance + savings
+
+    return portfolio_value, position_data, position_price, balance, savings, cooling_off_counter
+
+
+def summarize_backtest(portfolio_value, savings, initial_balance, metrics, plot=False):
+    # portfolio_value is a series of recorded portfolio values indexed by timestamp. metrics is the
+    # MetricsAccumulator the run fed, for the max drawdown and trade count
+    if plot:
+        portfolio_value.plot(title="Portfolio Value Over Time")
+
+    returns = portfolio_value.pct_change().dropna()
+
+    # nothing was recorded (every bar fell in the warm-up or a cooling-off period)
+    if len(portfolio_value) == 0:
+        return 0.0, 0.0, 0.0, returns
+
+    final_value = portfolio_value.iloc[-1]
+    print(f"[SYSTEM]: FINAL VALUE: ${final_value:,.2f}")
+    print(f"[SYSTEM]: FINAL SAVINGS: ${savings:,.2f}")
+    print(f"[SYSTEM]: PERCENT GAINS: {(final_value - initial_balance) / initial_balance * 100 :,.2f}%")
+
+
+    if len(returns) == 0:
+        return 0.0, 0.0, 0.0, returns
+
+    result = equity_metrics(portfolio_value.to_numpy(), initial_balance)
+    result['max_drawdown'] = metrics.max_drawdown
+    result['trades'] = metrics.trades
+    result['returns'] = returns
+    return result
+
+
+def summarize_accumulated(metrics, savings, initial_balance, portfolio_value=None, plot=False):
+    # summarize_backtest's report and return value from a MetricsAccumulator instead of the full
+    # series. 'returns' comes from portfolio_value, the history the recorder kept, when it was read back
+    if plot and portfolio_value is not None:
+        portfolio_value.plot(title="Portfolio Value Over Time")
+    returns = pd.Series(dtype=float) if portfolio_value is None else portfolio_value.pct_change().dropna()
+
+    if not math.isnan(metrics.last_value):
+        print(f"[SYSTEM]: FINAL VALUE: ${metrics.last_value:,.2f}")
+        print(f"[SYSTEM]: FINAL SAVINGS: ${savings:,.2f}")
+        print(f"[SYSTEM]: PERCENT GAINS: {(metrics.last_value - initial_balance) / initial_balance * 100 :,.2f}%")
+
+    result = metrics.metrics(initial_balance)
+    if result is None:
+        return 0.0, 0.0, 0.0, returns
+
+    result['returns'] = returns if portfolio_value is not None else None
+    return result
+
+
+def backtest(tickers, data, initial_balance=10000, stop_loss_percent=0.1356, take_profit_percent=0.1954, commission_percent=0.005, slippage_percent=0.002, max_loss_count=15, cooling_off_period=18, plot=False, history_capacity=None, return_history=False):
+    # precompute all indicators for all tickers, then align everything to the frame's row order.
+    # data is the multi-index frame or CompactBars. with history_capacity the kernel keeps only the
+    # most recent portfolio values and the report comes from its running stats, as in backtest_rowwise
+    arrays = bar_arrays(data, tickers)
+    indicators = arrays['indicators']
+    close = arrays['close']
+    atr = indicators.in_source_order('atr')
+    signals = generate_trade_signals_batch(indicators.as_columns(source_order=True))
+
+    # run the trading state machine over the aligned arrays, skipping the first 50 data points
+    result = simulate(
+        close,
+        atr,
+        signals,
+        start=50,
+        initial_balance=initial_balance,
+        stop_loss_percent=stop_loss_percent,
+        take_profit_percent=take_profit_percent,
+        commission_percent=commission_percent,
+        slippage_percent=slippage_percent,
+        cooling_off_period=cooling_off_period,
+        max_loss_count=max_loss_count,
+        history_capacity=history_capacity
+    )
+
+    balance = result['balance']
 
-    return portfolio_history, position_data, position_price, balance, savings, cooling_off_counter
+    # at the end of the backtest, liquidate any open positions
+    if result['holding']:
+        balance += result['shares'] * close[-1] * (1 - commission_percent)
+        print(f"[SYSTEM]: END OF BACKTEST: SOLD REMAINING POSITION AT {close[-1]}")
+
+    metrics = simulate_metrics(result)
+    history = lambda: pd.Series(
+        result['equity'],
+        index=pd.to_datetime(arrays['timestamps'][result['rows']]),
+        name='portfolio_value'
+    )
+
+    if history_capacity is not None:
+        return summarize_accumulated(metrics, result['savings'], initial_balance,
+                                     history() if return_history or plot else None, plot=plot)
+    return summarize_backtest(history(), result['savings'], initial_balance, metrics, plot=plot)
 
 
-def backtest(tickers, data, initial_balance=10000, stop_loss_percent=0.1356, take_profit_percent=0.1954, commission_percent=0.005, slippage_percent=0.002, max_loss_count=15, cooling_off_period=18):
+# row-by-row reference implementation of backtest(). slow, kept for validating the kernel
+def backtest_rowwise(tickers, data, initial_balance=10000, stop_loss_percent=0.1356, take_profit_percent=0.1954, commission_percent=0.005, slippage_percent=0.002, max_loss_count=15, cooling_off_period=18, plot=False, progress=False, history_capacity=None, spill_path=None, return_history=False):
     balance = initial_balance
     position = None
     position_price = 0
     savings = 0
-    portfolio_history = []
     cooling_off_counter = 0
+    loss_count = 0
+
+    # history goes into a preallocated recorder (bounded when history_capacity is set) and the
+    # headline stats are accumulated as we go
+    recorder = EquityRecorder(history_capacity, spill_path)
+    metrics = MetricsAccumulator()
 
     # precompute all indicators for all tickers
     indicators_cache = precompute_indicators(data, tickers)
-    
-    with tqdm(total=len(data.index), desc="[SYSTEM]: RUNNING BACKTEST", unit=" datapoint") as pbar:
+
+    pbar = None
+    if progress:
+        from tqdm import tqdm
+        pbar = tqdm(total=len(data.index), desc="[SYSTEM]: RUNNING BACKTEST", unit=" datapoint")
+
+    with instrument.stage('backtest_loop', rows=len(data.index)):
         for looper, (timestamp, ticker) in enumerate(data.index):
+            if pbar is not None:
+                with instrument.stage('progress_bar'):
+                    pbar.update(1)
+
             # skip first 50 data points
             if looper < 50:
-                pbar.update(1)
                 continue
 
+            was_open = position is not None
+
             # process each ticker data for each timestamp
-            result, position, position_price, balance, savings, cooling_off_counter = process_ticker_data(
+            portfolio_value, position, position_price, balance, savings, cooling_off_counter = process_ticker_data(
                 timestamp, 
                 ticker, 
                 data, 
@@ -121,43 +239,35 @@ def backtest(tickers, data, initial_balance=10000, stop_loss_percent=0.1356, tak
                 max_loss_count, 
                 cooling_off_period, 
                 cooling_off_counter,
-                savings
+                savings,
+                loss_count=loss_count
             )
 
-            # append results to global portfolio history
-            portfolio_history.extend(result)
-            pbar.update(1)
+            if portfolio_value is None:
+                continue
+
+            if was_open != (position is not None):
+                metrics.record_trade()
+
+            # an exit below the entry price counts towards the loss limit
+            if was_open and position is None and data['Close'].iloc[looper] < position_price:
+                loss_count += 1
+            recorder.append(timestamp.value, balance, savings, position, portfolio_value)
+            metrics.update(portfolio_value)
+
+    if pbar is not None:
+        pbar.close()
 
     # at the end of the backtest, liquidate any open positions
     if position is not None:
         balance += position * data['Close'].iloc[-1] * (1 - commission_percent)
         print(f"[SYSTEM]: END OF BACKTEST: SOLD REMAINING POSITION AT {data['Close'].iloc[-1]}")
 
-    # generate final portfolio report
-    portfolio_history_df = pd.DataFrame(portfolio_history)
-    portfolio_history_df.set_index('timestamp', inplace=True)
-    portfolio_history_df['portfolio_value'].plot(title="Portfolio Value Over Time")
-
-    final_value = portfolio_history_df['portfolio_value'].iloc[-1]
-    returns = portfolio_history_df['portfolio_value'].pct_change().dropna()
-
-    print(f"[SYSTEM]: FINAL VALUE: ${final_value:,.2f}")
-    print(f"[SYSTEM]: FINAL SAVINGS: ${savings:,.2f}")
-    print(f"[SYSTEM]: PERCENT GAINS: {(final_value - initial_balance) / initial_balance * 100 :,.2f}%")
+    # with a bounded recorder (ring or spill file) the report comes from the accumulator, and the
+    # history is only read back into memory when the caller asks for it (or wants the plot)
+    if history_capacity is not None:
+        history = recorder.to_frame()['portfolio_value'] if return_history or plot else None
+        return summarize_accumulated(metrics, savings, initial_balance, history, plot=plot)
 
-
-    if len(returns) == 0:
-        return 0.0, 0.0, 0.0, returns
-
-    avg_return = np.mean(returns)
-    volatility = np.std(returns) / avg_return
-    sharpe = (avg_return - 0.005) / volatility if volatility > 0 else 0.0
-
-    return {
-        'final_value': final_value,
-        'total_return': final_value / initial_balance - 1,
-        'sharpe_ratio': sharpe,
-        'avg_return': avg_return,
-        'volatility': volatility,
-        'returns': returns
-    }
\ No newline at end of file
+    # generate final portfolio report
+    return summarize_backtest(recorder.to_frame()['portfolio_value'], savings, initial_balance, metrics, plot=plot)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+
+import hashlib
+import json
+import os
+import shutil
+import uuid
+import numpy as np
+import pandas as pd
+from tradingbot.compact import PRICE_COLUMNS, volume_array
+from tradingbot.dataloader import DB_PATH, data_version, to_epoch, from_epoch, ticker_chunks
+
+BAR_COLUMNS = PRICE_COLUMNS + ('Volume',)
+
+# bumped whenever the on-disk layout changes, so older caches are rebuilt rather than misread
+CACHE_FORMAT = 3
+
+
+def cache_root(db_path=None):
+    # the cache lives beside the database it mirrors
+    return os.path.join(os.path.dirname(db_path or DB_PATH), 'barcache')
+
+
+class BarCache:
+    # cleaned bars as one memory-mapped .npy per column, ticker-major and time-ascending, so
+    # ticker i owns rows offsets[i]:offsets[i + 1]. the columns are stored in CompactBars' dtypes
+    # (int64 epoch hours, float32 prices, uint32 or int64 volume) so they can be used as they are
+    # mapped. every process that opens the same cache shares the same page-cache pages instead of
+    # holding a private copy
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, 'meta.json')) as file:
+            self.meta = json.load(file)
+        self.tickers = self.meta['tickers']
+        self.ticker_index = {ticker: i for i, ticker in enumerate(self.tickers)}
+        self.offsets = np.load(os.path.join(directory, 'offsets.npy'))
+        self.hours = np.load(os.path.join(directory, 'Hour.npy'), mmap_mode='r')
+        self.columns = {name: np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r') for name in BAR_COLUMNS}
+
+    def __len__(self):
+        return len(self.hours)
+
+    @property
+    def timestamps(self):
+        # epoch seconds. computed, so this one is a copy
+        return self.hours * 3600
+
+    def ticker_slice(self, ticker):
+        i = self.ticker_index[ticker]
+        return slice(int(self.offsets[i]), int(self.offsets[i + 1]))
+
+    def column(self, name, ticker=None):
+        values = self.timestamps if name == 'Timestamp' else self.columns[name]
+        return values if ticker is None else values[self.ticker_slice(ticker)]
+
+    def ticker_codes(self):
+        return np.repeat(np.arange(len(self.tickers), dtype=np.int32), np.diff(self.offsets))
+
+    def to_frame(self):
+        # the (Timestamp, Ticker) multi-index frame the rest of the code expects. this copies
+        index = pd.MultiIndex.from_arrays([
+            from_epoch(self.timestamps),
+            pd.Categorical.from_codes(self.ticker_codes(), categories=self.tickers).astype(str)
+        ], names=['Timestamp', 'Ticker'])
+        data = pd.DataFrame({name: np.asarray(self.columns[name], dtype=np.float64) for name in BAR_COLUMNS}, index=index)
+        return data.sort_index()
+
+
+def _cache_key(tickers, start, end):
+    payload = json.dumps([sorted(tickers), int(start), int(end)])
+    return hashlib.sha1(payload.encode()).hexdigest()[:16]
+
+
+def build_bar_cache(con, tickers, start, end, directory, version):
+    # read the bars in primary key order and write each column once. the files are written to
+    # a temporary directory and swapped in, so readers never see a half-written cache
+    tickers = sorted(tickers)
+    frames = []
+    for chunk in ticker_chunks(tickers):
+        placeholders = ",".join("?" * len(chunk))
+        frames.append(pd.read_sql_query(f"""
+        SELECT Ticker, Timestamp, Open, High, Low, Close, Volume FROM dataloader
+        WHERE Ticker IN ({placeholders}) AND Timestamp BETWEEN ? AND ?
+        ORDER BY Ticker, Timestamp;
+        """, con, params=[*chunk, int(start), int(end)]))
+    bars = pd.concat(frames, ignore_index=True)
+
+    present = [ticker for ticker in tickers if ticker in set(bars['Ticker'])]
+    counts = bars['Ticker'].value_counts().reindex(present).to_numpy()
+    offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+
+    staging = f"{directory}.tmp-{os.getpid()}"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    np.save(os.path.join(staging, 'offsets.npy'), offsets)
+    np.save(os.path.join(staging, 'Hour.npy'), bars['Timestamp'].to_numpy(dtype=np.int64) // 3600)
+    for name in PRICE_COLUMNS:
+        np.save(os.path.join(staging, f'{name}.npy'), bars[name].to_numpy(dtype=np.float32))
+    np.save(os.path.join(staging, 'Volume.npy'), volume_array(bars['Volume'].to_numpy(dtype=np.float64)))
+    with open(os.path.join(staging, 'meta.json'), 'w') as file:
+        # build identifies this copy of the cache, so anything derived from it (the indicator
+        # cache's entries) can't be mistaken for data from another build with the same version
+        json.dump({'format': CACHE_FORMAT, 'build': uuid.uuid4().hex, 'version': version, 'tickers': present,
+                   'start': int(start), 'end': int(end)}, file)
+
+    # swap the new cache in. processes still mapping the old files keep them until they close.
+    # several workers can find the same stale cache at once; if another one swaps its copy in
+    # between our two renames, theirs is as new as ours and ours is dropped
+    retired = f"{directory}.old-{os.getpid()}"
+    try:
+        if os.path.exists(directory):
+            os.replace(directory, retired)
+        os.replace(staging, directory)
+    except OSError:
+        shutil.rmtree(staging, ignore_errors=True)
+    shutil.rmtree(retired, ignore_errors=True)
+
+
+def open_bar_cache(con, tickers, start, end, db_path=None):
+    # open the cached bars for these tickers and window, rebuilding when the table's data
+    # version has moved on since the cache was written
+    start, end = to_epoch([start, end])
+    directory = os.path.join(cache_root(db_path), _cache_key(tickers, start, end))
+    version = data_version(con)
+
+    meta_path = os.path.join(directory, 'meta.json')
+    if os.path.exists(meta_path):
+        with open(meta_path) as file:
+            meta = json.load(file)
+            if meta.get('format') == CACHE_FORMAT and meta.get('version') == version:
+                return BarCache(directory)
+
+    print("[SYSTEM]: BUILDING BAR CACHE.")
+    os.makedirs(cache_root(db_path), exist_ok=True)
+    build_bar_cache(con, tickers, start, end, directory, version)
+    return BarCache(directory)
@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+# universe sizes every benchmark runs at
+SIZES = (10, 100, 1000)
+
+# a benchmark slower than the baseline by more than this fraction is reported as a regression
+REGRESSION_THRESHOLD = 0.10
+
+# filled by the @benchmark decorator, in definition order
+BENCHMARKS = {}
+
+
+def benchmark(function):
+    # a benchmark takes the shared context and does its setup, then returns the callable to time
+    BENCHMARKS[function.__name__] = function
+    return function
+
+
+class Context:
+    # synthetic bars and the things derived from them, built once per universe size and shared by
+    # the benchmarks. derived values are computed on first use so a filtered run only pays for what it needs
+    def __init__(self, ticker_count, bar_count, seed, directory):
+        from tradingbot.synthetic import generate_bars, frames_by_ticker
+
+        self.ticker_count = ticker_count
+        self.bar_count = bar_count
+        self.directory = directory
+        self.data = generate_bars(ticker_count, bar_count, seed=seed)
+        self.tickers = sorted(self.data.index.get_level_values('Ticker').unique())
+        self.timestamps = self.data.index.get_level_values('Timestamp').unique()
+        self.frames = frames_by_ticker(self.data)
+
+        # the same bars with holes in them, what the preprocessor sees from a real download
+        self.raw_frames = frames_by_ticker(generate_bars(ticker_count, bar_count, seed=seed, gap_rate=0.02))
+        self._indicators = None
+        self._inputs = None
+        self._db_path = None
+
+    @property
+    def bars(self):
+        return len(self.data)
+
+    @property
+    def expected_timestamps(self):
+        return self.timestamps.strftime('%Y-%m-%d %H:00:00').tolist()
+
+    @property
+    def indicators(self):
+        if self._indicators is None:
+            from tradingbot.indicators import precompute_indicators
+            self._indicators = precompute_indicators(self.data, self.tickers)
+        return self._indicators
+
+    @property
+    def inputs(self):
+        if self._inputs is None:
+            from tradingbot.optimizer import prepare_inputs
+            self._inputs = prepare_inputs(self.tickers, self.data)
+        return self._inputs
+
+    @property
+    def db_path(self):
+        # a populated dataloader database for the read benchmarks
+        if self._db_path is None:
+            from tradingbot.synthetic import write_synthetic_db
+            self._db_path = os.path.join(self.directory, f'bench-{self.ticker_count}.db')
+            write_synthetic_db(self._db_path, ticker_count=self.ticker_count, bar_count=self.bar_count)
+        return self._db_path
+
+
+@benchmark
+def ingest(context):
+    from tradingbot.dataloader import connect, ensure_schema, insert_data
+    path = os.path.join(context.directory, 'ingest.db')
+
+    def run():
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        con = connect(path)
+        ensure_schema(con)
+        insert_data(con, context.frames)
+        con.close()
+    return run
+
+
+@benchmark
+def load(context):
+    from tradingbot.dataloader import connect, load_bars
+    path = context.db_path
+    first, last = context.timestamps[0], context.timestamps[-1]
+
+    def run():
+        con = connect(path)
+        load_bars(con, context.tickers, first, last)
+        con.close()
+    return run
+
+
+@benchmark
+def preprocess(context):
+    from tradingbot.dataloader import preprocess_batch
+    expected = context.expected_timestamps
+    return lambda: preprocess_batch(context.raw_frames, context.tickers, expected, fill='polynomial', n_jobs=1)
+
+
+@benchmark
+def indicators(context):
+    from tradingbot.indicators import precompute_indicators
+    return lambda: precompute_indicators(context.data, context.tickers)
+
+
+@benchmark
+def indicators_cached(context):
+    # a rerun on unchanged bars: everything comes from a warm on-disk cache
+    from tradingbot.indicatorcache import IndicatorCache
+    cache = IndicatorCache(os.path.join(context.directory, f'indicators-{context.ticker_count}'))
+    cache.indicator_matrix(context.data)
+    return lambda: cache.indicator_matrix(context.data)
+
+
+@benchmark
+def signals(context):
+    from tradingbot.scoring import generate_trade_signals_batch
+    columns = context.indicators.as_columns(source_order=True)
+    return lambda: generate_trade_signals_batch(columns)
+
+
+@benchmark
+def backtest(context):
+    from tradingbot.backtest import backtest as run_backtest
+    return lambda: run_backtest(context.tickers, context.data)
+
+
+@benchmark
+def sweep_grid(context):
+    # one vectorized sweep over a 4x4x4 grid, what sweep and walkforward mode run per window
+    from tradingbot.sweep import parameter_grid, sweep
+    inputs = context.inputs
+    grid = parameter_grid(np.linspace(0.01, 0.5, 4), np.linspace(0.01, 0.5, 4), [0, 6, 12, 18])
+    return lambda: sweep(inputs, grid)
+
+
+@benchmark
+def optimizer_batch(context):
+    # 64 random points through optimize(): the process pool, shared-memory inputs and
+    # _evaluate_batch, without a result store so every point is evaluated
+    from tradingbot.optimizer import optimize
+    inputs = context.inputs
+    return lambda: optimize(inputs, mode='random', n_calls=64, verbose=False)
+
+
+def time_call(function, repeat=3, warmup=1):
+    # warmup calls absorb imports, jit compiles and cold caches; the timed calls report min/median/mean.
+    # anything the benchmarked code prints is swallowed
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(warmup):
+            function()
+        durations = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            function()
+            durations.append(time.perf_counter() - started)
+    return durations
+
+
+def environment():
+    from tradingbot.kernel import HAS_NUMBA
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        'commit': commit,
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'numba': HAS_NUMBA,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count()
+    }
+
+
+def run_benchmarks(sizes=SIZES, names=None, bar_count=1750, repeat=3, warmup=1, seed=0, verbose=True):
+    names = list(names or BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        raise ValueError(f"UNKNOWN BENCHMARKS {unknown}, EXPECTED SOME OF {list(BENCHMARKS)}")
+
+    results = []
+    directory = tempfile.mkdtemp(prefix='tradingbot-bench-')
+    try:
+        for size in sizes:
+            context = Context(size, bar_count, seed, directory)
+            for name in names:
+                durations = time_call(BENCHMARKS[name](context), repeat, warmup)
+                median = float(np.median(durations))
+                results.append({
+                    'benchmark': name,
+                    'tickers': size,
+                    'bars': context.bars,
+                    'repeat': repeat,
+                    'min': float(np.min(durations)),
+                    'median': median,
+                    'mean': float(np.mean(durations)),
+                    'bars_per_second': context.bars / median if median > 0 else None
+                })
+                if verbose:
+                    print(f"[SYSTEM]: {name:<16} {size:>5} TICKERS  {median * 1000:>10,.1f}ms  "
+                          f"{context.bars / median:>14,.0f} BARS/s")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    return {'environment': environment(), 'results': results}
+
+
+def save_results(report, path):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w') as file:
+        json.dump(report, file, indent=2)
+
+
+def load_results(path):
+    with open(path) as file:
+        return json.load(file)
+
+
+def compare_results(baseline, current, threshold=REGRESSION_THRESHOLD):
+    # median time of every benchmark/size pair present in both reports, as a current/baseline ratio
+    key = lambda result: (result['benchmark'], result['tickers'])
+    before = {key(result): result for result in baseline['results']}
+    rows = []
+    for result in current['results']:
+        previous = before.get(key(result))
+        if previous is None:
+            continue
+        ratio = result['median'] / previous['median']
+        rows.append({
+            'benchmark': result['benchmark'],
+            'tickers': result['tickers'],
+            'baseline': previous['median'],
+            'current': result['median'],
+            'ratio': ratio,
+            'regression': ratio > 1 + threshold
+        })
+    return pd.DataFrame(rows, columns=['benchmark', 'tickers', 'baseline', 'current', 'ratio', 'regression'])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="benchmark the pipeline on synthetic bars")
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(SIZES), help="ticker counts to run at")
+    parser.add_argument('--only', nargs='+', default=None, choices=list(BENCHMARKS), help="benchmarks to run")
+    parser.add_argument('--bars', type=int, default=1750, help="bars per ticker (about a year of hourly bars)")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default=None, help="JSON file to write (default: bench-results/<commit>.json)")
+    parser.add_argument('--compare', default=None, help="earlier JSON results to compare against")
+    args = parser.parse_args(argv)
+
+    report = run_benchmarks(args.sizes, args.only, args.bars, args.repeat)
+    output = args.output or os.path.join('bench-results', f"{report['environment']['commit'] or 'results'}.json")
+    save_results(report, output)
+    print(f"[SYSTEM]: RESULTS WRITTEN TO {output}")
+
+    if args.compare:
+        comparison = compare_results(load_results(args.compare), report)
+        if comparison.empty:
+            print(f"[SYSTEM]: NOTHING TO COMPARE, {args.compare} SHARES NO BENCHMARK AND SIZE WITH THIS RUN.")
+            return 0
+        print(comparison.to_string(index=False))
+        regressions = comparison[comparison['regression']]
+        if len(regressions):
+            print(f"[SYSTEM]: {len(regressions)} REGRESSIONS OVER {REGRESSION_THRESHOLD * 100:.0f}%")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
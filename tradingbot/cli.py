@@ -0,0 +1,377 @@
+#!/usr/bin/env python
+
+import argparse
+import sys
+
+# python -m tradingbot <command>. only argparse is imported up front: every command imports what
+# it needs when it runs, so --help and short commands don't pay for pandas, talib, numba or skopt,
+# and neither do spawned workers that import a tradingbot module
+
+DEFAULT_DAYS = 365
+
+
+def _add_universe_arguments(parser):
+    parser.add_argument('--tickers', nargs='+', default=None, help="tickers to use (default: the ticker file)")
+    parser.add_argument('--tickers-file', default=None, help="whitespace-separated ticker file to read instead")
+    parser.add_argument('--start', default=None, help="first day of history (default: --days before --end)")
+    parser.add_argument('--end', default=None, help="last day of history (default: today)")
+    parser.add_argument('--days', type=int, default=DEFAULT_DAYS, help="days of history when --start isn't given")
+
+
+def _add_instrument_arguments(parser):
+    parser.add_argument('--instrument', nargs='?', const='timers', choices=['timers', 'cprofile', 'pyinstrument'],
+                        default=None, help="time each stage (and optionally profile) and write a JSON report")
+    parser.add_argument('--report', default=None, help="where --instrument writes its report")
+
+
+def _add_indicator_cache_arguments(parser):
+    parser.add_argument('--no-indicator-cache', action='store_true', help="recompute every indicator instead of reusing cached ones")
+    parser.add_argument('--indicator-cache-mb', type=int, default=1024, help="size cap of the on-disk indicator cache")
+
+
+def _enable_instrument(args):
+    # same switch as TRADINGBOT_INSTRUMENT; the report is written when the run exits
+    if args.instrument:
+        from tradingbot import instrument
+        instrument.enable(profile=None if args.instrument == 'timers' else args.instrument, report_path=args.report)
+
+
+def _tickers(args):
+    if args.tickers:
+        return sorted({ticker.upper() for ticker in args.tickers})
+
+    from tradingbot.utils import TICKER_FILE, get_tickers_from_file
+    return get_tickers_from_file(args.tickers_file or TICKER_FILE)
+
+
+def _dates(args):
+    # pin --start/--end to make a run reproducible, otherwise fall back to the trailing --days
+    from datetime import datetime, timedelta
+
+    end_date = datetime.fromisoformat(args.end) if args.end else datetime.today()
+    start_date = datetime.fromisoformat(args.start) if args.start else end_date - timedelta(days=args.days)
+    return start_date.isoformat(), end_date.isoformat()
+
+
+def _provider(args):
+    if args.provider == 'local':
+        from tradingbot.fetchers import LocalDirectoryProvider
+        return LocalDirectoryProvider(args.data_directory)
+    # None means the dataloader's default, yahoo
+    return None
+
+
+def _load(args, tickers):
+    from tradingbot.dataloader import bootstrap_dataloader
+
+    start_date, end_date = _dates(args)
+    return bootstrap_dataloader(tickers, start_date, end_date, use_cache=args.cache, fill=args.fill, provider=_provider(args))
+
+
+def _indicator_cache(args):
+    if args.no_indicator_cache:
+        return None
+    from tradingbot.indicatorcache import IndicatorCache
+    return IndicatorCache(max_bytes=args.indicator_cache_mb << 20)
+
+
+def ingest(args):
+    # fetch whatever bars the database is missing for the window and bring the rollups up to date
+    tickers = _tickers(args)
+    data = _load(args, tickers)
+    print(f"[SYSTEM]: {len(data)} BARS FOR {len(tickers)} TICKERS IN THE DATABASE.")
+    return 0
+
+
+def backtest(args):
+    from tradingbot.portfolio import backtest_portfolio
+
+    tickers = _tickers(args)
+    data = _load(args, tickers)
+
+    # one position slot per ticker. indicators of tickers whose bars haven't changed since the
+    # last run come from the on-disk cache
+    backtest_portfolio(
+        tickers,
+        data,
+        initial_balance=args.balance,
+        stop_loss_percent=args.stop_loss,
+        take_profit_percent=args.take_profit,
+        max_loss_count=args.max_loss_count,
+        cooling_off_period=args.cooling_off,
+        correlation_threshold=args.correlation_threshold,
+        plot=args.plot,
+        indicator_cache=_indicator_cache(args),
+        history_capacity=args.history_capacity,
+        spill_path=args.spill_path
+    )
+    return 0
+
+
+def optimize(args):
+    from tradingbot.optimizer import prepare_inputs, default_search_space, grid_points
+
+    tickers = _tickers(args)
+
+    # load the bars and compute indicators and signals once, workers share them
+    data = _load(args, tickers)
+    inputs = prepare_inputs(tickers, data, indicator_cache=_indicator_cache(args))
+
+    # sweep mode evaluates the whole grid in one vectorized pass instead of one backtest per point
+    if args.mode == 'sweep':
+        from tradingbot.sweep import sweep
+
+        results = sweep(inputs, grid_points(default_search_space(), args.grid_size))
+        best = results.sort_values('score').iloc[0]
+        print(results.sort_values('score').head(10).to_string(index=False))
+        print(f"Best parameters: {best[['stop_loss_percent', 'take_profit_percent', 'cooling_off_period', 'max_loss_count']].tolist()}")
+        print(f"Best performance: {-best['score']}")
+        return 0
+
+    # walk-forward optimizes on each train window and reports how the winners did on the next test window
+    if args.mode == 'walkforward':
+        from tradingbot.walkforward import walk_forward
+
+        report = walk_forward(
+            inputs,
+            grid_points(default_search_space(), args.grid_size),
+            args.train_bars,
+            args.test_bars,
+            step=args.step,
+            expanding=args.expanding,
+            n_jobs=args.jobs
+        )
+        print(report['folds'].to_string(index=False))
+        return 0
+
+    # results are memoized in databases/results.db, keyed by the inputs and the rounded parameters
+    from tradingbot.optimizer import optimize as run_optimizer
+    from tradingbot.resultstore import ResultStore
+
+    store = None if args.no_result_store else ResultStore()
+    result = run_optimizer(
+        inputs,
+        mode=args.mode,
+        n_calls=args.calls,
+        n_points=args.points,
+        n_jobs=args.jobs,
+        points_per_dimension=args.grid_size,
+        store=store,
+        warm_start=not args.no_warm_start
+    )
+
+    # print the best parameters and the corresponding performance
+    print(f"Best parameters: {result['x']}")
+    print(f"Best performance: {-result['fun']}")
+    return 0
+
+
+def _print_failures(results):
+    failed = [(job_id, error) for job_id, status, _, error in results if status == 'failed']
+    if failed:
+        job_id, error = failed[0]
+        print(f"[SYSTEM]: {len(failed)} JOBS FAILED. JOB {job_id}: {(error or '').strip().splitlines()[-1:]}")
+
+
+def distribute(args):
+    # split the run into jobs on the queue, then wait for workers to drain it. --workers starts
+    # that many local workers; with 0, workers started elsewhere (python -m tradingbot worker
+    # against the same queue and bar database) do the work
+    import pandas as pd
+    from tradingbot.dataloader import get_trading_hours
+    from tradingbot.jobqueue import JobQueue, start_workers, submit_folds, submit_points, submit_ticker_batches
+
+    tickers = _tickers(args)
+
+    # workers read their bars from the database, through the bar cache, so fetch whatever is
+    # missing first. with --cache the universe's cache is built here, before any worker asks for
+    # it. jobs carry the exact first and last trading hour, the same window the dataloader loads
+    if not args.no_ingest:
+        _load(args, tickers)
+    hours = get_trading_hours(*_dates(args))
+    start, end = hours[0], hours[-1]
+
+    queue = JobQueue(args.queue, lease_seconds=args.lease)
+    if args.split == 'tickers':
+        point = [args.stop_loss, args.take_profit, args.cooling_off, args.max_loss_count]
+        batch = submit_ticker_batches(queue, tickers, start, end, point, args.batch_size, args.max_attempts)
+    else:
+        from tradingbot.optimizer import default_search_space, grid_points
+
+        if args.split == 'folds' or args.mode == 'grid':
+            points = grid_points(default_search_space(), args.grid_size)
+        else:
+            from skopt.space import Space
+            points = Space(default_search_space()).rvs(n_samples=args.calls, random_state=48)
+
+        if args.split == 'points':
+            batch = submit_points(queue, tickers, start, end, points, args.points_per_job, args.max_attempts)
+        else:
+            batch = submit_folds(queue, tickers, start, end, points, args.train_bars, args.test_bars, args.step,
+                                 args.expanding, max_attempts=args.max_attempts)
+    print(f"[SYSTEM]: SUBMITTED {queue.unfinished(batch)} {args.split.upper()} JOBS AS BATCH {batch}")
+
+    # local workers report their stage timers back to this process, merged into its report
+    from tradingbot import instrument
+
+    instrument_spec = instrument.worker_spec() if args.workers else None
+    processes = start_workers(args.workers, queue, instrument_spec=instrument_spec) if args.workers else None
+    try:
+        queue.wait(batch, processes=processes)
+    finally:
+        for process in processes or []:
+            process.join()
+        instrument.collect_workers(instrument_spec)
+
+    results = queue.results(batch)
+    done = [result for _, status, result, _ in results if status == 'done']
+    _print_failures(results)
+    if not done:
+        return 1
+
+    if args.split == 'tickers':
+        rows = [{'first': result['tickers'][0], 'last': result['tickers'][-1], 'tickers': len(result['tickers']),
+                 **(result['metrics'] or {})} for result in done]
+        print(pd.DataFrame(rows).to_string(index=False))
+    elif args.split == 'points':
+        evaluated = sorted((result for chunk in done for result in chunk), key=lambda result: result['score'])
+        print(f"Best parameters: {evaluated[0]['point']}")
+        print(f"Best performance: {-evaluated[0]['score']}")
+    else:
+        from tradingbot.walkforward import summarize_folds
+
+        folds = pd.DataFrame(done)
+        for column in ('train_start', 'train_end', 'test_start', 'test_end'):
+            folds[column] = pd.to_datetime(folds[column])
+        summary = summarize_folds(folds)
+        print(folds.to_string(index=False))
+        print(f"[SYSTEM]: WALK-FORWARD OVER {summary['folds']} FOLDS. "
+              f"MEAN OUT-OF-SAMPLE RETURN {summary['mean_test_return'] * 100:,.2f}%, "
+              f"COMPOUNDED {summary['compounded_test_return'] * 100:,.2f}%")
+    return 0 if len(done) == len(results) else 1
+
+
+def worker(args):
+    from tradingbot.jobqueue import JobQueue, run_worker
+
+    queue = JobQueue(args.queue, lease_seconds=args.lease)
+    completed = run_worker(queue.spec(), db_path=args.db, poll=args.poll, exit_when_empty=args.exit_when_empty,
+                           max_jobs=args.max_jobs, threads=args.threads)
+    queue.close()
+    print(f"[SYSTEM]: WORKER COMPLETED {completed} JOBS.")
+    return 0
+
+
+def bench(args):
+    # the benchmark parses its own options
+    from tradingbot.bench import main as run_benchmarks
+    return run_benchmarks(args.bench_args)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='tradingbot', description="load bars, backtest and search parameters")
+    commands = parser.add_subparsers(dest='command', metavar='command')
+    commands.required = True
+
+    fetch_parser = argparse.ArgumentParser(add_help=False)
+    fetch_parser.add_argument('--fill', choices=['polynomial', 'linear', 'ffill'], default='polynomial',
+                              help="how gaps in fetched bars are filled")
+    fetch_parser.add_argument('--provider', choices=['yahoo', 'local'], default='yahoo', help="where missing bars come from")
+    fetch_parser.add_argument('--data-directory', default='data', help="directory of <TICKER>.csv/.parquet for --provider local")
+    fetch_parser.add_argument('--cache', action='store_true',
+                              help="read the bars through the memory-mapped bar cache beside the database")
+
+    parent = argparse.ArgumentParser(add_help=False)
+    _add_universe_arguments(parent)
+    _add_instrument_arguments(parent)
+
+    ingest_parser = commands.add_parser('ingest', parents=[parent, fetch_parser], help="fetch missing bars into the database")
+    ingest_parser.set_defaults(handler=ingest)
+
+    strategy_parser = argparse.ArgumentParser(add_help=False)
+    strategy_parser.add_argument('--stop-loss', type=float, default=0.1356)
+    strategy_parser.add_argument('--take-profit', type=float, default=0.1954)
+    strategy_parser.add_argument('--max-loss-count', type=int, default=15)
+    strategy_parser.add_argument('--cooling-off', type=int, default=18)
+
+    queue_parser = argparse.ArgumentParser(add_help=False)
+    queue_parser.add_argument('--queue', default=None, help="job queue database (default: databases/jobs.db)")
+    queue_parser.add_argument('--lease', type=float, default=60, help="seconds a claimed job stays leased without a heartbeat")
+
+    backtest_parser = commands.add_parser('backtest', parents=[parent, fetch_parser, strategy_parser],
+                                          help="backtest the portfolio")
+    backtest_parser.add_argument('--balance', type=float, default=10000)
+    backtest_parser.add_argument('--correlation-threshold', type=float, default=None,
+                                 help="skip entries correlated above this with an open position")
+    backtest_parser.add_argument('--plot', action='store_true', help="plot the equity curve")
+    backtest_parser.add_argument('--history-capacity', type=int, default=None,
+                                 help="keep at most this many portfolio values in memory; the report comes from running stats")
+    backtest_parser.add_argument('--spill-path', default=None,
+                                 help="with --history-capacity, spill full history buffers to this file instead of dropping them")
+    _add_indicator_cache_arguments(backtest_parser)
+    backtest_parser.set_defaults(handler=backtest)
+
+    optimize_parser = commands.add_parser('optimize', parents=[parent, fetch_parser], help="search backtest parameters")
+    optimize_parser.add_argument('--mode', choices=['bayes', 'random', 'grid', 'sweep', 'walkforward'], default='bayes')
+    optimize_parser.add_argument('--calls', type=int, default=100)
+    optimize_parser.add_argument('--points', type=int, default=None, help="candidates evaluated per batch")
+    optimize_parser.add_argument('--jobs', type=int, default=None, help="worker processes (default: all cores)")
+    optimize_parser.add_argument('--grid-size', type=int, default=5, help="values per dimension in grid, sweep and walkforward mode")
+    optimize_parser.add_argument('--train-bars', type=int, default=1000, help="bars per walk-forward train window")
+    optimize_parser.add_argument('--test-bars', type=int, default=250, help="bars per walk-forward test window")
+    optimize_parser.add_argument('--step', type=int, default=None, help="bars between folds (default: --test-bars)")
+    optimize_parser.add_argument('--expanding', action='store_true', help="anchor every train window at the first bar")
+    optimize_parser.add_argument('--no-result-store', action='store_true', help="evaluate every point even if an earlier run already did")
+    optimize_parser.add_argument('--no-warm-start', action='store_true', help="don't seed bayes mode with stored results")
+    _add_indicator_cache_arguments(optimize_parser)
+    optimize_parser.set_defaults(handler=optimize)
+
+    distribute_parser = commands.add_parser('distribute', parents=[parent, fetch_parser, strategy_parser, queue_parser],
+                                            help="split a run into jobs on the queue and collect the results")
+    distribute_parser.add_argument('--split', choices=['tickers', 'points', 'folds'], default='points',
+                                   help="ticker batches with the strategy settings, parameter points, or walk-forward folds")
+    distribute_parser.add_argument('--workers', type=int, default=0,
+                                   help="local worker processes to start (default: none, workers run elsewhere)")
+    distribute_parser.add_argument('--batch-size', type=int, default=50, help="tickers per job with --split tickers")
+    distribute_parser.add_argument('--points-per-job', type=int, default=10, help="parameter points per job with --split points")
+    distribute_parser.add_argument('--mode', choices=['grid', 'random'], default='grid', help="how --split points picks points")
+    distribute_parser.add_argument('--calls', type=int, default=100, help="random points with --mode random")
+    distribute_parser.add_argument('--grid-size', type=int, default=5, help="values per dimension for grid points and folds")
+    distribute_parser.add_argument('--train-bars', type=int, default=1000, help="bars per walk-forward train window")
+    distribute_parser.add_argument('--test-bars', type=int, default=250, help="bars per walk-forward test window")
+    distribute_parser.add_argument('--step', type=int, default=None, help="bars between folds (default: --test-bars)")
+    distribute_parser.add_argument('--expanding', action='store_true', help="anchor every train window at the first bar")
+    distribute_parser.add_argument('--max-attempts', type=int, default=3, help="runs of a job before it is marked failed")
+    distribute_parser.add_argument('--no-ingest', action='store_true', help="don't fetch missing bars before submitting")
+    distribute_parser.set_defaults(handler=distribute)
+
+    worker_parser = commands.add_parser('worker', parents=[queue_parser], help="run jobs from the queue")
+    _add_instrument_arguments(worker_parser)
+    worker_parser.add_argument('--db', default=None, help="bar database the jobs read (default: databases/tradingbot.db)")
+    worker_parser.add_argument('--poll', type=float, default=1.0, help="seconds between claims while the queue is empty")
+    worker_parser.add_argument('--exit-when-empty', action='store_true', help="stop once nothing is pending or running")
+    worker_parser.add_argument('--max-jobs', type=int, default=None, help="stop after this many jobs")
+    worker_parser.add_argument('--threads', type=int, default=None, help="numba threads (default: all cores)")
+    worker_parser.set_defaults(handler=worker)
+
+    bench_parser = commands.add_parser('bench', help="benchmark the pipeline on synthetic bars",
+                                       description="everything after bench is passed to the benchmark, see bench --help")
+    bench_parser.add_argument('bench_args', nargs=argparse.REMAINDER)
+    bench_parser.set_defaults(handler=bench)
+    return parser
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+
+    # bench takes its options verbatim, including its own --help
+    if argv and argv[0] == 'bench':
+        return bench(argparse.Namespace(bench_args=argv[1:]))
+
+    args = build_parser().parse_args(argv)
+    _enable_instrument(args)
+    return args.handler(args)
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
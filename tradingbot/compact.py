@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+
+import numpy as np
+import pandas as pd
+from tradingbot.indicators import INDICATOR_COLUMNS, IndicatorMatrix, compute_indicator_values
+
+PRICE_COLUMNS = ('Open', 'High', 'Low', 'Close')
+
+HOUR_NS = 3_600_000_000_000
+
+
+def volume_array(volume):
+    # whole, non-negative volumes that fit go in uint32, anything else keeps full range. a column
+    # that is already uint32 (e.g. mapped from the bar cache) is used as it is, without a scan
+    volume = np.asarray(volume)
+    if len(volume) == 0 or volume.dtype == np.uint32:
+        return volume.astype(np.uint32, copy=False)
+    finite = np.isfinite(volume).all() if volume.dtype.kind == 'f' else True
+    if finite and volume.min() >= 0 and volume.max() <= np.iinfo(np.uint32).max and (volume == np.round(volume)).all():
+        return volume.astype(np.uint32)
+    return volume.astype(np.int64, copy=False) if finite else volume.astype(np.float64, copy=False)
+
+
+class CompactBars:
+    # bars without a pandas index: float32 prices, uint32 (or int64) volume and int64 epoch hours,
+    # ticker-major and time-ascending so ticker i owns rows offsets[i]:offsets[i + 1]. tickers are
+    # stored once; per-row ticker codes are derived from the offsets on demand. about 28 bytes a bar
+    # against ~60 for the multi-index frame, and indicators come out as float32 too
+    def __init__(self, tickers, offsets, hours, columns, volume, source=None):
+        # source names the bar cache build and data version the bars were mapped from, if any
+        self.source = source
+        self.tickers = list(tickers)
+        self.ticker_index = {ticker: i for i, ticker in enumerate(self.tickers)}
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.hours = np.asarray(hours, dtype=np.int64)
+        self.columns = {name: np.asarray(columns[name], dtype=np.float32) for name in PRICE_COLUMNS}
+        self.columns['Volume'] = volume_array(volume)
+        self._frame_order = None
+
+    @classmethod
+    def from_arrays(cls, tickers, codes, timestamps, columns):
+        # rows in any order. timestamps are datetime64 or int64 nanoseconds on whole hours
+        timestamps = np.asarray(timestamps, dtype='datetime64[ns]').view(np.int64)
+        if (timestamps % HOUR_NS).any():
+            raise ValueError("COMPACT BARS NEED TIMESTAMPS ON WHOLE HOURS")
+        codes = np.asarray(codes)
+        order = np.lexsort((timestamps, codes))
+        counts = np.bincount(codes, minlength=len(tickers))
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+        return cls(
+            tickers,
+            offsets,
+            timestamps[order] // HOUR_NS,
+            {name: np.asarray(columns[name])[order] for name in PRICE_COLUMNS},
+            np.asarray(columns['Volume'])[order]
+        )
+
+    @classmethod
+    def from_frame(cls, data):
+        # from the (Timestamp, Ticker) multi-index frame load_bars returns
+        codes, tickers = pd.factorize(data.index.get_level_values('Ticker'), sort=True)
+        timestamps = data.index.get_level_values('Timestamp')
+        columns = {name: data[name].to_numpy() for name in PRICE_COLUMNS + ('Volume',)}
+        return cls.from_arrays(list(tickers), codes, timestamps, columns)
+
+    @classmethod
+    def from_bar_cache(cls, cache):
+        # the bar cache is stored in this layout and these dtypes, so the columns are its
+        # memory maps as they are: nothing is copied and processes share the pages
+        return cls(
+            cache.tickers,
+            cache.offsets,
+            cache.hours,
+            {name: cache.column(name) for name in PRICE_COLUMNS},
+            cache.column('Volume'),
+            source={'build': cache.meta['build'], 'version': cache.meta['version']}
+        )
+
+    @classmethod
+    def from_db(cls, con, tickers, start, end, fetch_size=100000):
+        # read straight from the dataloader table in primary key order (ticker, then time), which
+        # is already the compact layout. only fetch_size rows are held as python objects at a time
+        from tradingbot.dataloader import to_epoch, ticker_chunks
+
+        start, end = to_epoch([start, end])
+        tickers = sorted(tickers)
+        index = {ticker: i for i, ticker in enumerate(tickers)}
+        codes, hours, volume = [], [], []
+        columns = {name: [] for name in PRICE_COLUMNS}
+        for chunk in ticker_chunks(tickers):
+            placeholders = ",".join("?" * len(chunk))
+            cursor = con.execute(f"""
+            SELECT Ticker, Timestamp, Open, High, Low, Close, Volume FROM dataloader
+            WHERE Ticker IN ({placeholders}) AND Timestamp BETWEEN ? AND ?
+            ORDER BY Ticker, Timestamp;
+            """, [*chunk, int(start), int(end)])
+            while True:
+                rows = cursor.fetchmany(fetch_size)
+                if not rows:
+                    break
+                ticker_column, timestamp, *values = zip(*rows)
+                codes.append(np.fromiter((index[ticker] for ticker in ticker_column), dtype=np.int32, count=len(rows)))
+                hours.append(np.asarray(timestamp, dtype=np.int64) // 3600)
+                for name, column in zip(PRICE_COLUMNS, values[:4]):
+                    columns[name].append(np.asarray(column, dtype=np.float32))
+                volume.append(np.asarray(values[4], dtype=np.float64))
+
+        join = lambda parts, dtype: np.concatenate(parts) if parts else np.empty(0, dtype=dtype)
+        counts = np.bincount(join(codes, np.int32), minlength=len(tickers))
+        present = [ticker for ticker, count in zip(tickers, counts) if count > 0]
+        return cls(
+            present,
+            np.concatenate(([0], np.cumsum(counts[counts > 0]))),
+            join(hours, np.int64),
+            {name: join(parts, np.float32) for name, parts in columns.items()},
+            join(volume, np.float64)
+        )
+
+    def __len__(self):
+        return len(self.hours)
+
+    @property
+    def nbytes(self):
+        return self.hours.nbytes + self.offsets.nbytes + sum(column.nbytes for column in self.columns.values())
+
+    def ticker_slice(self, ticker):
+        i = self.ticker_index[ticker]
+        return slice(int(self.offsets[i]), int(self.offsets[i + 1]))
+
+    def column(self, name, ticker=None):
+        values = self.hours if name == 'Timestamp' else self.columns[name]
+        return values if ticker is None else values[self.ticker_slice(ticker)]
+
+    def ticker_codes(self):
+        return np.repeat(np.arange(len(self.tickers), dtype=np.int32), np.diff(self.offsets))
+
+    def timestamps(self):
+        # int64 nanoseconds, the unit IndicatorMatrix and the kernels use
+        return self.hours * HOUR_NS
+
+    def frame_order(self):
+        # the compact rows in the (Timestamp, Ticker) order a sorted frame has, which is the order
+        # the backtest trades bars in
+        if self._frame_order is None:
+            self._frame_order = np.lexsort((self.ticker_codes(), self.hours))
+        return self._frame_order
+
+    def in_frame_order(self, name):
+        return self.column(name)[self.frame_order()]
+
+    def indicator_values(self, dtype=np.float32):
+        print("[SYSTEM]: CALCULATING INDICATORS.")
+        return compute_indicator_values(
+            self.columns['High'], self.columns['Low'], self.columns['Close'], self.columns['Volume'],
+            self.offsets, dtype=dtype
+        )
+
+    def indicator_matrix(self, dtype=np.float32, cache=None):
+        # same indicators compute_indicator_matrix gives for the equivalent frame, stored as dtype.
+        # with an IndicatorCache the values are only computed when it has no entry for these bars
+        values = self.indicator_values(dtype) if cache is None else cache.compact_values(self, dtype)
+        # matrix row i is compact row i; source_index maps it to its position in frame order
+        source_index = np.empty(len(self), dtype=np.int64)
+        source_index[self.frame_order()] = np.arange(len(self))
+        return IndicatorMatrix(values, INDICATOR_COLUMNS, self.tickers, self.offsets, self.timestamps(), source_index)
+
+    def to_frame(self):
+        # back to the multi-index frame, float64 like load_bars. this copies
+        index = pd.MultiIndex.from_arrays([
+            pd.to_datetime(self.timestamps()),
+            pd.Categorical.from_codes(self.ticker_codes(), categories=self.tickers).astype(str)
+        ], names=['Timestamp', 'Ticker'])
+        data = pd.DataFrame({name: self.columns[name].astype(np.float64) for name in PRICE_COLUMNS}, index=index)
+        data['Volume'] = self.columns['Volume'].astype(np.int64 if self.columns['Volume'].dtype.kind in 'iu' else np.float64)
+        return data.sort_index()
+
+
+def bar_arrays(data, tickers=None, indicator_cache=None):
+    # frame-ordered timestamps (int64 ns) and closes plus the indicator matrix, from either a
+    # multi-index frame or CompactBars. this is everything the backtest and optimizer read from the bars.
+    # indicator_cache is an IndicatorCache, used for either
+    if isinstance(data, CompactBars):
+        return {
+            'timestamps': data.timestamps()[data.frame_order()],
+            'close': data.in_frame_order('Close').astype(np.float64),
+            'indicators': data.indicator_matrix(cache=indicator_cache)
+        }
+
+    from tradingbot.indicators import precompute_indicators
+    return {
+        'timestamps': np.asarray(data.index.get_level_values('Timestamp'), dtype='datetime64[ns]').view(np.int64),
+        'close': data['Close'].to_numpy(dtype=np.float64),
+        'indicators': precompute_indicators(data, tickers, cache=indicator_cache)
+    }
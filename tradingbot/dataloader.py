@@ -1,14 +1,124 @@
 #!/usr/bin/env python
 
 import sqlite3 as sq3
+import itertools
+import numpy as np
 import pandas as pd
-import yfinance as yf
 import os
+import time
 from pandas.tseries.holiday import USFederalHolidayCalendar
-from tqdm import tqdm
+from tradingbot import instrument
 
 DB_PATH = "databases/tradingbot.db"
 
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:00:00'
+
+# bars are keyed by ticker and hour. Timestamp holds whole seconds since the epoch of the
+# exchange wall-clock time (naive, stored as if it were UTC)
+DATALOADER_SCHEMA = """
+CREATE TABLE IF NOT EXISTS dataloader (
+    Ticker TEXT NOT NULL,
+    Timestamp INTEGER NOT NULL,
+    Open REAL,
+    High REAL,
+    Low REAL,
+    Close REAL,
+    Volume INTEGER,
+    PRIMARY KEY (Ticker, Timestamp)
+) WITHOUT ROWID;
+"""
+
+# a counter bumped in the same transaction as every write to dataloader, so caches built from
+# the table can tell when they are stale
+META_SCHEMA = """
+CREATE TABLE IF NOT EXISTS dataloader_meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+# the time range of every write to dataloader, per ticker, recorded in the same transaction so
+# tradingbot.pyramid can rebuild just the rollup buckets those bars fall in
+ROLLUP_PENDING_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rollup_pending (
+    Ticker TEXT NOT NULL,
+    First INTEGER NOT NULL,
+    Last INTEGER NOT NULL
+);
+"""
+
+# windows a provider answered with nothing usable for a ticker (it has no bars there), so top_up
+# doesn't ask for them again on every run. Attempted is the unix time of the request
+FETCH_EMPTY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS fetch_empty (
+    Ticker TEXT NOT NULL,
+    First INTEGER NOT NULL,
+    Last INTEGER NOT NULL,
+    Attempted REAL NOT NULL
+);
+"""
+
+# SQLite caps the number of bound parameters, so long ticker lists are queried in chunks
+MAX_QUERY_TICKERS = 900
+
+# open a connection tuned for bulk writes and concurrent readers
+def connect(db_path=None):
+    db_path = db_path or DB_PATH
+    directory = os.path.dirname(db_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    con = sq3.connect(db_path)
+    con.execute("PRAGMA journal_mode=WAL;")
+    con.execute("PRAGMA synchronous=NORMAL;")
+    con.execute("PRAGMA cache_size=-65536;")
+    con.execute("PRAGMA temp_store=MEMORY;")
+    return con
+
+# naive timestamps -> integer epoch seconds, the Timestamp column's format
+def to_epoch(timestamps):
+    index = pd.DatetimeIndex(pd.to_datetime(timestamps))
+    return np.asarray((index - pd.Timestamp(0)) // pd.Timedelta(seconds=1), dtype=np.int64)
+
+# integer epoch seconds -> naive timestamps
+def from_epoch(seconds):
+    return pd.to_datetime(np.asarray(seconds, dtype=np.int64), unit='s')
+
+def bump_data_version(con):
+    con.execute("""
+    INSERT INTO dataloader_meta (key, value) VALUES ('version', 1)
+    ON CONFLICT (key) DO UPDATE SET value = value + 1;
+    """)
+
+def data_version(con):
+    row = con.execute("SELECT value FROM dataloader_meta WHERE key = 'version';").fetchone()
+    return 0 if row is None else row[0]
+
+# create the dataloader table, migrating the older layouts (TEXT timestamps, with or without
+# a UNIQUE constraint) to the typed, primary-keyed one
+def ensure_schema(con):
+    con.execute(META_SCHEMA)
+    con.execute(ROLLUP_PENDING_SCHEMA)
+    con.execute(FETCH_EMPTY_SCHEMA)
+    columns = {row[1]: row[2].upper() for row in con.execute("PRAGMA table_info(dataloader);")}
+    if columns and columns.get('Timestamp') != 'INTEGER':
+        print("[SYSTEM]: MIGRATING DATALOADER TABLE TO (Ticker, Timestamp) PRIMARY KEY WITH EPOCH TIMESTAMPS.")
+        with con:
+            con.execute("ALTER TABLE dataloader RENAME TO dataloader_legacy;")
+            con.execute(DATALOADER_SCHEMA)
+            # later duplicates win, same as an upsert would
+            con.execute("""
+            INSERT OR REPLACE INTO dataloader (Ticker, Timestamp, Open, High, Low, Close, Volume)
+            SELECT Ticker, CAST(strftime('%s', Timestamp) AS INTEGER), Open, High, Low, Close, Volume
+            FROM dataloader_legacy
+            WHERE Ticker IS NOT NULL AND Timestamp IS NOT NULL
+            ORDER BY rowid;
+            """)
+            con.execute("DROP TABLE dataloader_legacy;")
+            bump_data_version(con)
+    else:
+        con.execute(DATALOADER_SCHEMA)
+        con.commit()
+
 # function to get timestamps during trading hours with format "y-m-d h"
 def get_trading_hours(start,end):
     # generate hourly timestamps
@@ -22,166 +132,371 @@ def get_trading_hours(start,end):
     holidays = cal.holidays(start=start, end=end)
     trading_hours = trading_hours[~trading_hours.normalize().isin(holidays)]
 
-    return trading_hours.strftime('%Y-%m-%d %H:00:00').tolist()
+    return trading_hours.strftime(TIMESTAMP_FORMAT).tolist()
 
-# function to fetch all data for given list of tickers
-def fetch_data(tickers):
+# function to fetch all data for given list of tickers, optionally limited to a time window
+def fetch_data(tickers, start=None, end=None, provider=None):
     print("[SYSTEM]: FETCHING DATA.")
-    data = yf.download(tickers, period='1y', interval='1h', group_by='ticker', auto_adjust=True)
-    return data
-
-# function to insert data into database
-def insert_data(ticker, df):
-    # ensure timestamp is in pseudo-ISO format
-    df.index = df.index.strftime('%Y-%m-%d %H:00:00')
-
-    # set up tuple
-    rows = [
-        (ticker, idx, row['Open'], row['High'], row['Low'], row['Close'], row['Volume'])
-        for idx, row in df.iterrows()
-    ]
-
-    # pythonic!
-    with sq3.connect(DB_PATH) as con:
-        cur = con.cursor()
-        # insert data into sql database
-        cur.executemany("""
-
-        INSERT INTO dataloader (Ticker, Timestamp, Open, High, Low, Close, Volume)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, rows)
-        con.commit()
+    from tradingbot.fetchers import fetch_chunks
 
-# function to preprocess data
-def preprocessor(ticker, data, expected_timestamps):
+    with instrument.stage('fetch_data') as stage:
+        frames = [data for _, data in fetch_chunks(tickers, start, end, provider=provider) if data is not None]
+        data = pd.concat(frames, axis=1) if frames else pd.DataFrame()
+        stage.add(len(data) * data.columns.get_level_values(0).nunique())
+    return data
 
+# function to upsert preprocessed frames ({ticker: dataframe}) into the database in one transaction
+def insert_data(con, frames):
+    columns = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+    with instrument.stage('insert_data', rows=sum(len(df) for df in frames.values())), con:
+        for ticker, df in frames.items():
+            # epoch timestamps, then build the rows column-wise
+            timestamps = to_epoch(df.index).tolist()
+            values = df[columns].to_numpy(dtype=np.float64).T.tolist()
+            rows = zip(itertools.repeat(ticker), timestamps, *values)
+
+            # re-running a load replaces the rows it already wrote
+            con.executemany("""
+            INSERT INTO dataloader (Ticker, Timestamp, Open, High, Low, Close, Volume)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (Ticker, Timestamp) DO UPDATE SET
+                Open = excluded.Open,
+                High = excluded.High,
+                Low = excluded.Low,
+                Close = excluded.Close,
+                Volume = excluded.Volume;
+            """, rows)
+
+            if timestamps:
+                con.execute("INSERT INTO rollup_pending (Ticker, First, Last) VALUES (?, ?, ?);",
+                            (ticker, min(timestamps), max(timestamps)))
+
+        if frames:
+            bump_data_version(con)
+
+BAR_FIELDS = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+FILL_STRATEGIES = ('ffill', 'linear', 'polynomial')
+
+HOUR_NS = 3_600_000_000_000
+
+# turn a yfinance download (columns = (ticker, field)) or a {ticker: dataframe} dict into one
+# wide float frame with columns ordered (ticker, field)
+def _to_wide(data, tickers):
+    if isinstance(data, dict):
+        data = pd.concat(data, axis=1)
+    elif not isinstance(data.columns, pd.MultiIndex):
+        data = pd.concat({tickers[0]: data}, axis=1)
+
+    present = [ticker for ticker in tickers if ticker in data.columns.get_level_values(0)]
+    columns = pd.MultiIndex.from_product([present, BAR_FIELDS])
+    return data.reindex(columns=columns).astype(np.float64), present
+
+# longest run of consecutive True values in each column of a 2-D mask
+def _longest_runs(mask):
+    run = np.zeros(mask.shape[1], dtype=np.int64)
+    longest = np.zeros(mask.shape[1], dtype=np.int64)
+    for row in mask:
+        run = (run + 1) * row
+        np.maximum(longest, run, out=longest)
+    return longest
+
+def _interpolate_polynomial(chunk):
+    # fifth-order polynomial interpolation of a block of tickers. a ticker that can't be fitted
+    # is returned as all NaN so the caller drops it
     try:
-        # create copy of dataframe to prevent copy error
-        data = data.copy()
-
-        # convert timestamps in data to datetime and normalize (strip timezone)
-        data.index = pd.to_datetime(data.index).tz_localize(None)
-
-        # change the timestamps to ISO format and keep only the date + hour part
-        data.index = data.index.strftime('%Y-%m-%d %H:00:00')
-
-        # convert back to datetime after formatting
-        data.index = pd.to_datetime(data.index)
-
-        # sort data by timestamp
-        data.sort_index(inplace=True)
-
-        # drop invalid data points (NaN, Infinity, None)
-        data.replace([None, float('inf'), -float('inf')], pd.NA, inplace=True)
-        data['Close'] = data['Close'].replace([None, float('inf'), -float('inf'), 0], pd.NA)
-
-        data.dropna(how='any', inplace=True)
-
-        # make sure the expected_timestamps is in the same format and reindex to the expected range
-        expected_timestamps = pd.to_datetime(expected_timestamps)
-
-        # reindex to expected timestamps
-        data = data.reindex(expected_timestamps)
-
-        # fill missing data points: 
-        # if the first row is NaN, fill with the next available row
-        if data.iloc[0].isna().any():
-            next_valid_index = data.dropna().index.min()
-            if pd.notna(next_valid_index):
-                data.iloc[0] = data.loc[next_valid_index]
-
-        # interpolate missing data using fifth-order polynomial interpolation
-        data.interpolate(method='polynomial', order=5, limit_direction='both', inplace=True)
-
-
-#        print(data)
-        # return the processed data
-        return data
+        return chunk.interpolate(method='polynomial', order=5, limit_direction='both')
+    except Exception:
+        pass
+
+    filled = []
+    for ticker in chunk.columns.get_level_values(0).unique():
+        try:
+            filled.append(chunk[[ticker]].interpolate(method='polynomial', order=5, limit_direction='both'))
+        except Exception as ex:
+            print(f"[{ticker:<4}]: ERROR DURING PREPROCESSING. {ex}")
+            filled.append(chunk[[ticker]] * np.nan)
+    return pd.concat(filled, axis=1)
+
+# function to preprocess many tickers at once. returns the cleaned wide frame (index = expected
+# timestamps, columns = (ticker, field)) and a frame of per-ticker gap statistics
+@instrument.timed('preprocess', rows=lambda result: result[0].size // len(BAR_FIELDS))
+def preprocess_batch(data, tickers, expected_timestamps, fill='polynomial', n_jobs=None, chunk_size=50):
+    if fill not in FILL_STRATEGIES:
+        raise ValueError(f"UNKNOWN FILL STRATEGY: {fill}")
+
+    wide, present = _to_wide(data, tickers)
+
+    # strip the timezone and truncate to the hour with integer arithmetic
+    index = pd.DatetimeIndex(wide.index)
+    if index.tz is not None:
+        index = index.tz_localize(None)
+    nanoseconds = index.as_unit('ns').asi8
+    hours = pd.DatetimeIndex(nanoseconds - nanoseconds % HOUR_NS).as_unit('ns')
+
+    # (rows, tickers, fields) view for the cleaning steps
+    values = wide.to_numpy(copy=True).reshape(len(wide), len(present), len(BAR_FIELDS))
+
+    # drop invalid data points (NaN, Infinity, zero close). a bar with any bad field is dropped whole
+    invalid = ~np.isfinite(values).all(axis=2) | (values[:, :, BAR_FIELDS.index('Close')] == 0)
+    values[invalid] = np.nan
+
+    # keep the last bar of each hour, then align every ticker to the expected grid in one take
+    keep = ~hours.duplicated(keep='last')
+    hours, values = hours[keep], values[keep]
+    order = np.argsort(hours.asi8, kind='stable')
+    hours, values = hours[order], values[order]
+
+    expected = pd.DatetimeIndex(pd.to_datetime(expected_timestamps)).as_unit('ns')
+    positions = hours.get_indexer(expected)
+    aligned = values[np.maximum(positions, 0)]
+    aligned[positions < 0] = np.nan
+
+    # gap statistics, measured before filling
+    missing = np.isnan(aligned).any(axis=2)
+    valid_rows = (~missing).sum(axis=0)
+    stats = pd.DataFrame({
+        'missing': missing.sum(axis=0),
+        'coverage': valid_rows / max(len(expected), 1),
+        'longest_gap': _longest_runs(missing),
+        'leading_gap': np.where(valid_rows > 0, np.argmax(~missing, axis=0), len(expected))
+    }, index=pd.Index(present, name='Ticker'))
+
+    # tickers without a single valid bar can't be filled
+    usable = valid_rows > 0
+    tickers_kept = [ticker for ticker, ok in zip(present, usable) if ok]
+    aligned = aligned[:, usable]
+    columns = pd.MultiIndex.from_product([tickers_kept, BAR_FIELDS])
+    frame = pd.DataFrame(aligned.reshape(len(expected), -1), index=expected, columns=columns)
+
+    # if the first row is NaN, fill with the next available row
+    frame.iloc[0] = frame.iloc[0].fillna(frame.bfill().iloc[0])
+
+    # fill the remaining gaps
+    if fill == 'linear':
+        frame = frame.interpolate(method='linear', limit_direction='both')
+    elif fill == 'polynomial':
+        chunks = [frame[tickers_kept[i:i + chunk_size]] for i in range(0, len(tickers_kept), chunk_size)]
+        if len(chunks) > 1 and n_jobs != 1:
+            # polynomial fits are the slow part, spread blocks of tickers over processes
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+                chunks = list(pool.map(_interpolate_polynomial, chunks))
+        else:
+            chunks = [_interpolate_polynomial(chunk) for chunk in chunks]
+        frame = pd.concat(chunks, axis=1) if chunks else frame
+
+    # polynomial interpolation doesn't extrapolate, so carry the edge bars out to the ends of the grid
+    frame = frame.ffill().bfill()
+
+    # a ticker the fit blew up on comes back all NaN and is dropped
+    failed = frame.isna().T.groupby(level=0).any().any(axis=1)
+    failed = failed[failed].index.tolist()
+    if failed:
+        frame = frame.drop(columns=failed, level=0)
+    stats['loaded'] = stats.index.isin(frame.columns.get_level_values(0))
+
+    # tickers that weren't downloaded at all
+    absent = [ticker for ticker in tickers if ticker not in present]
+    if absent:
+        stats = pd.concat([stats, pd.DataFrame({
+            'missing': len(expected),
+            'coverage': 0.0,
+            'longest_gap': len(expected),
+            'leading_gap': len(expected),
+            'loaded': False
+        }, index=pd.Index(absent, name='Ticker'))])
+
+    return frame, stats
+
+# function to preprocess data for a single ticker
+def preprocessor(ticker, data, expected_timestamps, fill='polynomial'):
+    try:
+        frame, _ = preprocess_batch({ticker: data}, [ticker], expected_timestamps, fill=fill, n_jobs=1)
+        if ticker not in frame.columns.get_level_values(0):
+            return None
+        return frame[ticker]
 
     except Exception as ex:
         print(f"[{ticker:<4}]: ERROR DURING PREPROCESSING. {ex}")
         return None
 
-def dataloader(tickers, expected_timestamps):
-    data = fetch_data(tickers)
-
-    with tqdm(total=len(tickers), desc="[SYSTEM]: INSERTING DATA",unit=" ticker") as pbar:
-        # preprocess data for each ticker
-        for ticker in tickers:
-            # for every ticker's data in the list, run the preprocessor on it
-            df = data[ticker] if isinstance(data.columns, pd.MultiIndex) else data
-            preprocessed_df = preprocessor(ticker, df, expected_timestamps)
-
-            if preprocessed_df is not None:
-            # after the data is preprocessed, insert it into the database
-                insert_data(ticker, preprocessed_df)
-        #            print(f"[{ticker:<4}]: Loaded preprocessed data into the database.")
-        #        else:
-        #            print(f"[{ticker:<4}]: Failed to preprocess data.")
-        # return data, where data is a multi-index dataframe
-            pbar.update(1)
-    print(f"[SYSTEM]: ALL DATA LOADED.")
+def dataloader(tickers, expected_timestamps, con, fill='polynomial', provider=None):
+    from tradingbot.fetchers import fetch_chunks
+
+    # each chunk is preprocessed and inserted as soon as it arrives, while the other downloads
+    # are still waiting on the network. returns the tickers loaded and the tickers the provider
+    # answered for with nothing usable; a chunk whose download failed is in neither
+    loaded, empty = [], []
+    for chunk, data in fetch_chunks(tickers, expected_timestamps[0], expected_timestamps[-1], provider=provider):
+        if data is None:
+            continue
+        if data.empty:
+            empty += chunk
+            continue
+
+        frame, stats = preprocess_batch(data, chunk, expected_timestamps, fill=fill)
+        for ticker in stats.index[~stats['loaded'].astype(bool)]:
+            print(f"[{ticker:<4}]: NO USABLE DATA.")
+            empty.append(ticker)
+
+        frames = {ticker: frame[ticker] for ticker in frame.columns.get_level_values(0).unique()}
+        insert_data(con, frames)
+        loaded += frames
+
+    print(f"[SYSTEM]: LOADED {len(loaded)} TICKERS.")
+    return loaded, empty
+
+def ticker_chunks(tickers):
+    for i in range(0, len(tickers), MAX_QUERY_TICKERS):
+        yield tickers[i:i + MAX_QUERY_TICKERS]
+
+# bar counts per ticker inside [start, end] (epoch seconds) from one grouped query per chunk
+def count_bars(con, tickers, start, end):
+    counts = dict.fromkeys(tickers, 0)
+    for chunk in ticker_chunks(tickers):
+        placeholders = ",".join("?" * len(chunk))
+        counts.update(con.execute(f"""
+        SELECT Ticker, COUNT(*) FROM dataloader
+        WHERE Ticker IN ({placeholders}) AND Timestamp BETWEEN ? AND ?
+        GROUP BY Ticker;
+        """, [*chunk, int(start), int(end)]).fetchall())
+    return counts
+
+# find which expected timestamps each ticker is missing. returns {ticker: [epoch seconds]}
+def find_missing_timestamps(con, tickers, expected_timestamps):
+    expected = to_epoch(expected_timestamps)
+    # a window without trading hours (a weekend, a holiday, start after end) has nothing to miss
+    if len(expected) == 0:
+        return {}
+    counts = count_bars(con, tickers, expected[0], expected[-1])
+
+    missing = {}
+    for ticker in tickers:
+        # complete tickers are settled by the grouped count. only short ones read their timestamps
+        if counts[ticker] >= len(expected):
+            continue
+        have = np.fromiter((row[0] for row in con.execute("""
+        SELECT Timestamp FROM dataloader WHERE Ticker = ? AND Timestamp BETWEEN ? AND ?;
+        """, (ticker, int(expected[0]), int(expected[-1])))), dtype=np.int64)
+        gaps = expected[~np.isin(expected, have)]
+        if len(gaps) > 0:
+            missing[ticker] = gaps.tolist()
+    return missing
+
+# split a ticker's missing timestamps (epoch seconds, a subset of expected) into (first, last)
+# runs. gaps at most merge_within expected bars apart share a run, so hours missing across one
+# trading day are one download rather than one each
+def gap_runs(expected, gaps, merge_within=7):
+    positions = np.searchsorted(expected, gaps)
+    breaks = np.flatnonzero(np.diff(positions) > merge_within + 1) + 1
+    starts = np.concatenate(([0], breaks))
+    ends = np.concatenate((breaks, [len(positions)])) - 1
+    return [(int(expected[positions[a]]), int(expected[positions[b]])) for a, b in zip(starts, ends)]
+
+# download only what is missing. each ticker's gaps are split into runs and tickers missing the
+# same run share one download. a run the provider had nothing usable for is recorded, and not
+# asked for again until the record is retry_after seconds old
+def top_up(con, tickers, expected_timestamps, fill='polynomial', provider=None, merge_within=7, retry_after=86400):
+    missing = find_missing_timestamps(con, tickers, expected_timestamps)
+    if not missing:
+        return 0
+
+    now = time.time()
+    with con:
+        con.execute("DELETE FROM fetch_empty WHERE Attempted < ?;", (now - retry_after,))
+    empty = {}
+    for ticker, first, last in con.execute("SELECT Ticker, First, Last FROM fetch_empty;"):
+        empty.setdefault(ticker, []).append((first, last))
+
+    expected = to_epoch(expected_timestamps)
+    windows = {}
+    skipped = 0
+    for ticker, gaps in missing.items():
+        gaps = np.asarray(gaps, dtype=np.int64)
+        for first, last in empty.get(ticker, ()):
+            gaps = gaps[(gaps < first) | (gaps > last)]
+        if len(gaps) == 0:
+            skipped += 1
+            continue
+        print(f"[SYSTEM]: DATA MISSING FROM {ticker:<4}: {len(gaps)} OF {len(expected_timestamps)} DATAPOINTS")
+        for run in gap_runs(expected, gaps, merge_within):
+            windows.setdefault(run, []).append(ticker)
+    if skipped:
+        print(f"[SYSTEM]: {skipped} TICKERS ONLY MISSING BARS THE PROVIDER RECENTLY HAD NONE FOR. NOT FETCHING THEM.")
+
+    loaded = 0
+    for (first, last), window_tickers in windows.items():
+        in_window = (expected >= first) & (expected <= last)
+        window = [ts for ts, keep in zip(expected_timestamps, in_window) if keep]
+        window_loaded, window_empty = dataloader(window_tickers, window, con, fill=fill, provider=provider)
+        loaded += len(window_loaded)
+        if window_empty:
+            with con:
+                con.executemany("INSERT INTO fetch_empty (Ticker, First, Last, Attempted) VALUES (?, ?, ?, ?);",
+                                [(ticker, first, last, now) for ticker in window_empty])
+    return loaded
+
+# read only the requested tickers inside [start, end] as a (Timestamp, Ticker) multi-index frame
+@instrument.timed('load_bars', rows=len)
+def load_bars(con, tickers, start, end):
+    start, end = to_epoch([start, end])
+    frames = []
+    for chunk in ticker_chunks(tickers):
+        placeholders = ",".join("?" * len(chunk))
+        frames.append(pd.read_sql_query(f"""
+        SELECT Timestamp, Ticker, Open, High, Low, Close, Volume FROM dataloader
+        WHERE Ticker IN ({placeholders}) AND Timestamp BETWEEN ? AND ?;
+        """, con, params=[*chunk, int(start), int(end)]))
+
+    data = pd.concat(frames, ignore_index=True)
+    data['Timestamp'] = from_epoch(data['Timestamp'])
+    data.set_index(['Timestamp', 'Ticker'], inplace=True)
+    data.sort_index(inplace=True)
     return data
 
-def bootstrap_dataloader(tickers, start_date, end_date):
+def bootstrap_dataloader(tickers, start_date, end_date, use_cache=False, fill='polynomial', provider=None):
     # if tickers is a string, turn it into a list
     if isinstance(tickers, str):
         tickers = [tickers]
     
     tickers.sort()
 
-    # ensure database exists
-    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-    con = sq3.connect(DB_PATH)
-    cur = con.cursor()
-
-    # check if table exists
-    cur.execute("""
-    SELECT name FROM sqlite_master WHERE type='table' AND name='dataloader';
-    """)
-
-    table_exists = cur.fetchone() is not None
+    # ensure database exists and has the current schema
+    con = connect()
+    ensure_schema(con)
     expected_timestamps = get_trading_hours(start_date, end_date)
 
-    # if we have a table, check to see if it's complete
-    if table_exists:
-        all_data_present = True
-
-        for ticker in tickers:
-            cur.execute("""
-            SELECT COUNT(DISTINCT Timestamp) FROM dataloader
-            WHERE Ticker = ? and Timestamp between ? and ?;
-            """, (ticker, start_date, end_date))
-            count = cur.fetchone()[0]
-            if count < len(expected_timestamps):
-                all_data_present = False
-                print(f"[SYSTEM]: DATA MISSING FROM {ticker:<4}: {len(expected_timestamps)} DATAPOINTS EXPECTED BUT ONLY {count} IN DATABASE")
-                # we can break here because we don't care if other people have data 
-                break
-
-    # if the table doesn't exist or we don't have all our data, rebuild
-    if not table_exists or not all_data_present:
-        print("[SYSTEM]: MISSING OR INCOMPLETE DATA. REBUILDING TABLE.")
-        cur.execute("DROP TABLE IF EXISTS dataloader;")
-        cur.execute("""
-        CREATE TABLE dataloader (
-            Ticker TEXT,
-            Timestamp TEXT,
-            Open REAL,
-            High REAL,
-            Low REAL,
-            Close REAL,
-            Volume INTEGER
-        );
-        """)
-        con.commit()
-        # download, preprocess, insert
-        data = dataloader(tickers, expected_timestamps)
+    # nothing to fetch or load, so hand back empty bars of the kind the caller asked for
+    if len(expected_timestamps) == 0:
+        print(f"[SYSTEM]: NO TRADING HOURS BETWEEN {start_date} AND {end_date}.")
+        con.close()
+        if use_cache:
+            from tradingbot.compact import PRICE_COLUMNS, CompactBars
+            return CompactBars([], [0], [], {name: [] for name in PRICE_COLUMNS}, [])
+        return pd.DataFrame(
+            {name: pd.Series(dtype=np.float64) for name in BAR_FIELDS},
+            index=pd.MultiIndex.from_arrays([pd.DatetimeIndex([]), pd.Index([], dtype=object)], names=['Timestamp', 'Ticker'])
+        )
+
+    # fetch and upsert only the bars each ticker is missing, then bring the 4h/1d/1w rollups up to date
+    top_up(con, tickers, expected_timestamps, fill=fill, provider=provider)
+    from tradingbot.pyramid import update_rollups
+    update_rollups(con)
+
+    if use_cache:
+        # serve the bars from the memory-mapped column cache, rebuilding it if the table changed.
+        # this returns CompactBars over the mapped columns rather than a frame, so nothing is copied
+        from tradingbot.barcache import open_bar_cache
+        from tradingbot.compact import CompactBars
+        print("[SYSTEM]: ALL DATA PRESENT. READING FROM BAR CACHE.")
+        data = CompactBars.from_bar_cache(open_bar_cache(con, tickers, expected_timestamps[0], expected_timestamps[-1]))
+        con.close()
+        return data
 
     print("[SYSTEM]: ALL DATA PRESENT. READING FROM DATABASE.")
-    data = pd.read_sql_query("SELECT * FROM dataloader;", con, parse_dates=["Timestamp"])
+    data = load_bars(con, tickers, expected_timestamps[0], expected_timestamps[-1])
     con.close()
-    data.set_index(['Timestamp', 'Ticker'], inplace=True)
-    data.sort_index(inplace=True)
 
-    return data
\ No newline at end of file
+    return data
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+
+import os
+import threading
+import time
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from tradingbot import instrument
+
+BAR_FIELDS = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+# timestamps written with varying UTC offsets (daylight saving) are read back in exchange time
+EXCHANGE_TIMEZONE = 'America/New_York'
+
+
+class DataProvider:
+    # a source of hourly OHLCV bars. fetch returns a frame indexed by timestamp with
+    # (ticker, field) columns, the same layout yf.download(group_by='ticker') produces
+    name = "provider"
+
+    def fetch(self, tickers, start, end):
+        raise NotImplementedError
+
+
+class YahooProvider(DataProvider):
+    name = "yahoo"
+
+    def fetch(self, tickers, start, end):
+        import yfinance as yf
+
+        if start is None:
+            return yf.download(tickers, period='1y', interval='1h', group_by='ticker',
+                               auto_adjust=True, threads=False, progress=False)
+
+        # yfinance treats end as exclusive, so reach one hour past the last bar we want
+        end = pd.Timestamp(end) + pd.Timedelta(hours=1)
+        return yf.download(tickers, start=pd.Timestamp(start), end=end, interval='1h', group_by='ticker',
+                           auto_adjust=True, threads=False, progress=False)
+
+
+class LocalDirectoryProvider(DataProvider):
+    # reads <TICKER>.parquet or <TICKER>.csv from a directory, for offline runs and benchmarks.
+    # files need a timestamp column (Timestamp, Datetime or Date) or a datetime index, plus OHLCV
+    name = "local"
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _read(self, ticker):
+        parquet = os.path.join(self.directory, f"{ticker}.parquet")
+        csv = os.path.join(self.directory, f"{ticker}.csv")
+        if os.path.exists(parquet):
+            df = pd.read_parquet(parquet)
+        elif os.path.exists(csv):
+            df = pd.read_csv(csv)
+        else:
+            return None
+
+        for column in ('Timestamp', 'Datetime', 'Date'):
+            if column in df.columns:
+                df = df.set_index(column)
+                break
+        try:
+            df.index = pd.to_datetime(df.index)
+        except ValueError:
+            df.index = pd.to_datetime(df.index, utc=True).tz_convert(EXCHANGE_TIMEZONE)
+        return df[BAR_FIELDS]
+
+    def fetch(self, tickers, start, end):
+        frames = {}
+        for ticker in tickers:
+            df = self._read(ticker)
+            if df is None:
+                continue
+            if start is not None:
+                index = df.index.tz_localize(None) if df.index.tz is not None else df.index
+                df = df[(index >= pd.Timestamp(start)) & (index < pd.Timestamp(end) + pd.Timedelta(hours=1))]
+            frames[ticker] = df
+
+        if not frames:
+            return pd.DataFrame(columns=pd.MultiIndex.from_product([[], BAR_FIELDS]))
+        return pd.concat(frames, axis=1)
+
+
+class RateLimiter:
+    # spaces out calls across threads so they start at most `rate` times per second
+    def __init__(self, rate=None):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.lock = threading.Lock()
+        self.next_time = 0.0
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_time)
+            self.next_time = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+@instrument.timed('fetch_chunk')
+def _fetch_chunk(provider, tickers, start, end, limiter, retries, backoff):
+    for attempt in range(retries + 1):
+        limiter.wait()
+        try:
+            return provider.fetch(tickers, start, end)
+        except Exception as ex:
+            if attempt == retries:
+                print(f"[SYSTEM]: CHUNK {tickers[0]}..{tickers[-1]} FAILED AFTER {retries + 1} ATTEMPTS. {ex}")
+                return None
+            # polite exponential backoff before trying again
+            time.sleep(backoff * 2 ** attempt)
+
+
+def fetch_chunks(tickers, start=None, end=None, provider=None, chunk_size=50, max_workers=4, retries=3,
+                 backoff=1.0, rate=2.0, progress=True):
+    # download tickers in chunks on a bounded thread pool, yielding (tickers, frame) as each
+    # chunk finishes so the caller can preprocess and insert while the rest are in flight.
+    # a chunk that keeps failing is yielded with frame None
+    provider = provider or YahooProvider()
+    limiter = RateLimiter(rate)
+    chunks = [tickers[i:i + chunk_size] for i in range(0, len(tickers), chunk_size)]
+
+    pbar = None
+    if progress:
+        from tqdm import tqdm
+        pbar = tqdm(total=len(chunks), desc=f"[SYSTEM]: DOWNLOADING FROM {provider.name.upper()}", unit=" chunk")
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = {
+                pool.submit(_fetch_chunk, provider, chunk, start, end, limiter, retries, backoff): chunk
+                for chunk in chunks
+            }
+            for future in as_completed(futures):
+                if pbar is not None:
+                    pbar.update(1)
+                yield futures[future], future.result()
+    finally:
+        if pbar is not None:
+            pbar.close()
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+
+import hashlib
+import json
+import os
+import numpy as np
+from tradingbot import instrument
+from tradingbot.dataloader import DB_PATH
+from tradingbot.indicators import (INDICATOR_COLUMNS, INDICATOR_VERSION, IndicatorMatrix, compute_indicator_values,
+                                   ticker_major)
+
+# the bar columns the indicators read. a change to any other column doesn't invalidate anything
+INPUT_COLUMNS = ('High', 'Low', 'Close', 'Volume')
+
+DEFAULT_MAX_BYTES = 1 << 30
+
+
+def cache_root(db_path=None):
+    # the cache lives beside the database it mirrors, like the bar cache
+    return os.path.join(os.path.dirname(db_path or DB_PATH), 'indicatorcache')
+
+
+def _digest(*parts):
+    # sha256 rather than blake2b: with the cpu's sha extensions it hashes bars about twice as fast
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else memoryview(np.ascontiguousarray(part)).cast('B'))
+    return digest.hexdigest()[:32]
+
+
+def bar_checksum(timestamps, columns, block):
+    # content hash of one ticker's bars: its timestamps and every input column over block
+    return _digest(timestamps[block], *(columns[name][block] for name in INPUT_COLUMNS))
+
+
+def entry_key(ticker, checksum, name='indicator_matrix', parameters=None):
+    # content address of a cached array. the parameters default to what the values depend on
+    # besides the bars: the columns and the version of the code that computed them
+    if parameters is None:
+        parameters = {'columns': INDICATOR_COLUMNS, 'version': INDICATOR_VERSION, 'dtype': 'float64'}
+    payload = json.dumps([ticker, checksum, name, parameters], sort_keys=True)
+    return _digest(payload.encode())
+
+
+class IndicatorCache:
+    # indicator values on disk as one .npy per key, served memory-mapped. keys are content
+    # hashes, so an entry never goes stale; entries nobody asks for any more just age out. the
+    # least recently used ones are deleted once the directory is over max_bytes
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES, db_path=None):
+        self.directory = directory or cache_root(db_path)
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, f'{key}.npy')
+
+    def get(self, key, rows=None):
+        # the cached array mapped read-only, or None. a hit counts as a use for the LRU order
+        path = self.path(key)
+        try:
+            values = np.load(path, mmap_mode='r')
+            os.utime(path)
+        except (FileNotFoundError, ValueError, OSError):
+            return None
+        if values.ndim != 2 or values.shape[1] != len(INDICATOR_COLUMNS) or (rows is not None and len(values) != rows):
+            return None
+        return values
+
+    def put(self, key, values, dtype=np.float64):
+        # written beside the entry and renamed into place, so readers never map a partial file
+        path = self.path(key)
+        staging = f'{path}.tmp-{os.getpid()}'
+        with open(staging, 'wb') as file:
+            np.save(file, np.ascontiguousarray(values, dtype=dtype))
+        os.replace(staging, path)
+
+    def entries(self):
+        # (mtime, size, path) for every entry, oldest first
+        found = []
+        with os.scandir(self.directory) as scan:
+            for entry in scan:
+                if entry.name.endswith('.npy'):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    found.append((stat.st_mtime, stat.st_size, entry.path))
+        found.sort()
+        return found
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self, max_bytes=None):
+        # drop least recently used entries until the cache fits. processes still mapping a
+        # deleted file keep reading it until they let go
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in entries:
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        return removed
+
+    def clear(self):
+        return self.evict(0)
+
+    def compact_values(self, bars, dtype=np.float32):
+        # the indicator values for CompactBars, cached as one entry for the whole universe. bars
+        # mapped from the bar cache are keyed on its build, data version and ticker offsets, so a
+        # hit reads none of the bars; any other bars are keyed on their content
+        if bars.source is not None:
+            checksum = _digest(json.dumps([bars.tickers, bars.source]).encode(), bars.offsets)
+        else:
+            checksum = _digest(json.dumps(bars.tickers).encode(), bars.offsets, bars.hours,
+                               *(bars.columns[name] for name in INPUT_COLUMNS))
+        parameters = {'columns': INDICATOR_COLUMNS, 'version': INDICATOR_VERSION, 'dtype': np.dtype(dtype).name}
+        key = entry_key(None, checksum, name='compact_matrix', parameters=parameters)
+
+        values = self.get(key, rows=len(bars))
+        if values is not None and values.dtype == dtype:
+            instrument.count('indicator_cache_hits', len(bars.tickers))
+            return values
+
+        instrument.count('indicator_cache_misses', len(bars.tickers))
+        values = bars.indicator_values(dtype)
+        self.put(key, values, dtype=dtype)
+        self.evict()
+        return values
+
+    def indicator_matrix(self, data):
+        # the same matrix compute_indicator_matrix builds, computing only the tickers whose bars
+        # have no cached entry. a universe seen before in full is one mapped file
+        tickers, offsets, timestamps, order = ticker_major(data)
+        columns = {name: data[name].to_numpy(dtype=np.float64)[order] for name in INPUT_COLUMNS}
+        blocks = [slice(int(offsets[i]), int(offsets[i + 1])) for i in range(len(tickers))]
+        keys = [entry_key(ticker, bar_checksum(timestamps, columns, block)) for ticker, block in zip(tickers, blocks)]
+
+        universe_key = entry_key(None, _digest(json.dumps(keys).encode()), name='universe')
+        values = self.get(universe_key, rows=len(order))
+        if values is not None:
+            instrument.count('indicator_cache_hits', len(tickers))
+            return IndicatorMatrix(values, INDICATOR_COLUMNS, tickers, offsets, timestamps, order)
+
+        values = np.empty((len(order), len(INDICATOR_COLUMNS)))
+        missing = []
+        for i, (key, block) in enumerate(zip(keys, blocks)):
+            cached = self.get(key, rows=block.stop - block.start)
+            if cached is None:
+                missing.append(i)
+            else:
+                values[block] = cached
+        instrument.count('indicator_cache_hits', len(tickers) - len(missing))
+        instrument.count('indicator_cache_misses', len(missing))
+
+        if missing:
+            # compute the missing tickers together, laid out back to back
+            print(f"[SYSTEM]: CALCULATING INDICATORS FOR {len(missing)} OF {len(tickers)} TICKERS.")
+            rows = np.concatenate([np.arange(blocks[i].start, blocks[i].stop) for i in missing])
+            counts = [blocks[i].stop - blocks[i].start for i in missing]
+            computed = compute_indicator_values(
+                *(columns[name][rows] for name in INPUT_COLUMNS), np.concatenate(([0], np.cumsum(counts)))
+            )
+            start = 0
+            for i, count in zip(missing, counts):
+                values[blocks[i]] = computed[start:start + count]
+                self.put(keys[i], computed[start:start + count])
+                start += count
+
+        self.put(universe_key, values)
+        self.evict()
+        return IndicatorMatrix(values, INDICATOR_COLUMNS, tickers, offsets, timestamps, order)
@@ -2,86 +2,275 @@
 
 import pandas as pd
 import numpy as np
-import talib
-from tqdm import tqdm
+from tradingbot import instrument
 
-def precompute_indicators(data, tickers):
-    indicators_cache = {}
+# column order of the indicator matrix
+INDICATOR_COLUMNS = (
+    'relative_volume_20',
+    'bb_width_20',
+    'upperband',
+    'middleband',
+    'lowerband',
+    'zscore_20',
+    'rsi_14',
+    'macd',
+    'macd_signal',
+    'macd_hist',
+    'sma_10',
+    'sma_50',
+    'atr'
+)
 
-    # extract necessary columns (Close, High, Low, Volume) for all tickers
-    close = data['Close']
-    high = data['High']
-    low = data['Low']
-    volume = data['Volume']
+# bump when the indicator math changes so values cached under the old code are recomputed
+INDICATOR_VERSION = 1
 
-    # compute rolling indicators across the entire DataFrame at once
-    close_rolling_20 = close.rolling(window=20)
-    volume_rolling_20 = volume.rolling(window=20)
 
-    # compute relative volume (20)
-    relative_volume_20 = volume / volume_rolling_20.mean()
+class IndicatorMatrix:
+    # every indicator for every bar in one float64 array. rows are grouped by ticker
+    # (ticker-major, time-ascending) so each ticker owns the contiguous block
+    # values[offsets[i]:offsets[i + 1]]
+    def __init__(self, values, columns, tickers, offsets, timestamps, source_index):
+        self.values = values
+        self.columns = tuple(columns)
+        self.column_index = {name: i for i, name in enumerate(self.columns)}
+        self.tickers = list(tickers)
+        self.ticker_index = {ticker: i for i, ticker in enumerate(self.tickers)}
+        self.offsets = offsets
+        self.timestamps = timestamps
+        # row i of the matrix came from row source_index[i] of the input frame
+        self.source_index = source_index
 
-    # bollinger bands (20)
-    upperband, middleband, lowerband = talib.BBANDS(close, timeperiod=20)
-    bb_width_20 = (upperband - lowerband) / middleband
+    def __len__(self):
+        return len(self.values)
 
-    # z-score (20)
-    close_rolling_mean = close_rolling_20.mean()
-    close_rolling_std = close_rolling_20.std()
-    zscore_20 = (close - close_rolling_mean) / close_rolling_std
+    def bar_count(self, ticker):
+        i = self.ticker_index[ticker]
+        return int(self.offsets[i + 1] - self.offsets[i])
 
-    # rsi (14)
-    delta = close.diff()
-    gain = delta.where(delta > 0, 0).rolling(window=14).mean()
-    loss = -delta.where(delta < 0, 0).rolling(window=14).mean()
-    rsi_14 = 100 - (100 / (1 + (gain / loss)))
+    def row(self, ticker, bar):
+        # O(1) lookup of the matrix row for the n-th bar of a ticker
+        i = self.ticker_index[ticker]
+        if bar < 0:
+            bar += self.offsets[i + 1] - self.offsets[i]
+        if not 0 <= bar < self.offsets[i + 1] - self.offsets[i]:
+            raise IndexError(f"BAR {bar} OUT OF RANGE FOR {ticker}")
+        return int(self.offsets[i] + bar)
 
-    # macd (12, 26, 9)
-    macd, macdsignal, macdhist = talib.MACD(close, fastperiod=12, slowperiod=26, signalperiod=9)
+    def get(self, ticker, bar, name):
+        return self.values[self.row(ticker, bar), self.column_index[name]]
 
-    # sma 10 and 50
-    sma_10 = close.rolling(window=10).mean()
-    sma_50 = close.rolling(window=50).mean()
+    def column(self, name):
+        return self.values[:, self.column_index[name]]
 
-    # atr (14)
-    tr = pd.concat([
-        high - low,
-        (high - close.shift()).abs(),
-        (low - close.shift()).abs()
-    ], axis=1).max(axis=1)
-    atr_14 = tr.rolling(window=14).mean()
-
-    with tqdm(total=len(data.index), desc="[SYSTEM]: CALCULATING INDICATORS", unit=" datapoint") as pbar:
-        # store all indicators in the cache for each ticker and timestamp
-        for ticker in tickers:
-            ticker_data = data.xs(ticker, level='Ticker')
-            pbar.set_description(f"[SYSTEM]: CALCULATING INDICATORS FOR {ticker:<4}")
-            
-            # ensure that the indicators are calculated for each timestamp up to that point
-            for idx, timestamp in enumerate(ticker_data.index):
-                # use .iloc and index sorcery to get the data up to and including this timestamp
-                indicator_data = {
-                    'relative_volume_20': relative_volume_20.iloc[:idx + 1].iloc[-1],
-                    'bb_width_20': bb_width_20.iloc[:idx + 1].iloc[-1],
-                    'upperband': upperband.iloc[:idx + 1].iloc[-1],
-                    'middleband': middleband.iloc[:idx + 1].iloc[-1],
-                    'lowerband': lowerband.iloc[:idx + 1].iloc[-1],
-                    'zscore_20': zscore_20.iloc[:idx + 1].iloc[-1],
-                    'rsi_14': rsi_14.iloc[:idx + 1].iloc[-1],
-                    'macd': macd.iloc[:idx + 1].iloc[-1],
-                    'macd_signal': macdsignal.iloc[:idx + 1].iloc[-1],
-                    'macd_hist': macdhist.iloc[:idx + 1].iloc[-1],
-                    'sma_10': sma_10.iloc[:idx + 1].iloc[-1],
-                    'sma_50': sma_50.iloc[:idx + 1].iloc[-1],
-                    'atr': ticker_data['Close'].iloc[:idx + 1].iloc[-1] - atr_14.iloc[:idx + 1].iloc[-1]
-                }
-                pbar.update(1)
-                indicators_cache[(ticker, timestamp)] = indicator_data
-
-    return indicators_cache
+    def ticker_block(self, ticker):
+        i = self.ticker_index[ticker]
+        return self.values[self.offsets[i]:self.offsets[i + 1]]
+
+    def bar_index(self, ticker, timestamp):
+        # binary search inside the ticker's block, returns None if the timestamp is absent
+        i = self.ticker_index[ticker]
+        block = self.timestamps[self.offsets[i]:self.offsets[i + 1]]
+        value = pd.Timestamp(timestamp).value
+        bar = int(np.searchsorted(block, value))
+        if bar < len(block) and block[bar] == value:
+            return bar
+        return None
+
+    def in_source_order(self, name=None):
+        # realign rows (or a single column) to the row order of the frame the matrix was built from
+        values = self.values if name is None else self.column(name)
+        aligned = np.empty_like(values)
+        aligned[self.source_index] = values
+        return aligned
+
+    def as_columns(self, source_order=False):
+        # column name -> 1-D array, the layout generate_trade_signals_batch takes
+        values = self.in_source_order() if source_order else self.values
+        return {name: values[:, i] for i, name in enumerate(self.columns)}
+
+    def as_dict(self, row):
+        return dict(zip(self.columns, self.values[row].tolist()))
+
+    # dict-style access by (ticker, timestamp) so older callers keep working
+    def __contains__(self, key):
+        ticker, timestamp = key
+        return ticker in self.ticker_index and self.bar_index(ticker, timestamp) is not None
+
+    def __getitem__(self, key):
+        ticker, timestamp = key
+        bar = self.bar_index(ticker, timestamp) if ticker in self.ticker_index else None
+        if bar is None:
+            raise KeyError(key)
+        return self.as_dict(self.row(ticker, bar))
+
+
+def _block_cumsum(x, position):
+    # running sum that restarts at every ticker's first bar, so a ticker's values don't depend on
+    # (or lose precision to) whichever tickers come before it in the array
+    out = np.empty_like(x)
+    starts = np.flatnonzero(position == 0).tolist() + [len(x)]
+    for start, stop in zip(starts[:-1], starts[1:]):
+        np.cumsum(x[start:stop], out=out[start:stop])
+    return out
+
+
+def _rolling_mean(x, window, position):
+    # rolling mean over contiguous per-ticker blocks using per-block cumulative sums.
+    # windows that reach past the start of a ticker's block or contain NaN come back as NaN
+    n = len(x)
+    out = np.full(n, np.nan)
+    if n < window:
+        return out
+
+    valid = np.isfinite(x)
+    csum = _block_cumsum(np.where(valid, x, 0.0), position)
+
+    # the window ending at row i is csum[i] minus csum[i - window], unless it starts on the block's first bar
+    sums = csum[window - 1:].copy()
+    inner = np.flatnonzero(position[window - 1:] >= window)
+    sums[inner] -= csum[inner - 1]
+    out[window - 1:] = sums / window
+
+    # NaN counts the same way, only when there are any
+    if not valid.all():
+        cbad = _block_cumsum((~valid).astype(np.int64), position)
+        bad = cbad[window - 1:].copy()
+        bad[inner] -= cbad[inner - 1]
+        out[window - 1:][bad > 0] = np.nan
+    out[position < window - 1] = np.nan
+    return out
+
+
+def _shift(x, position):
+    # previous bar of the same ticker, NaN on each ticker's first bar
+    shifted = np.empty_like(x)
+    shifted[0] = np.nan
+    shifted[1:] = x[:-1]
+    shifted[position == 0] = np.nan
+    return shifted
+
+
+def compute_indicator_values(high, low, close, volume, offsets, dtype=np.float64):
+    # the indicator columns for bars laid out ticker-major and time-ascending, ticker i owning rows
+    # offsets[i]:offsets[i + 1]. inputs may be float32; the arithmetic is always float64 and only
+    # the stored matrix takes dtype
+    counts = np.diff(offsets)
+    position = np.arange(offsets[-1]) - np.repeat(offsets[:-1], counts)
+
+    close = np.asarray(close, dtype=np.float64)
+    high = np.asarray(high, dtype=np.float64)
+    low = np.asarray(low, dtype=np.float64)
+    volume = np.asarray(volume, dtype=np.float64)
+
+    values = np.full((len(close), len(INDICATOR_COLUMNS)), np.nan, dtype=dtype)
+    col = {name: i for i, name in enumerate(INDICATOR_COLUMNS)}
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # relative volume (20)
+        values[:, col['relative_volume_20']] = volume / _rolling_mean(volume, 20, position)
+
+        # rolling mean and standard deviation (20). prices are shifted by each ticker's first
+        # close so the running sums stay small and the variance doesn't lose precision
+        reference = np.repeat(close[offsets[:-1]], counts)
+        shifted = close - reference
+        mean_20 = _rolling_mean(shifted, 20, position)
+        variance_20 = np.maximum(_rolling_mean(shifted * shifted, 20, position) - mean_20 * mean_20, 0.0)
+        std_20 = np.sqrt(variance_20)
+        sample_std_20 = np.sqrt(variance_20 * 20 / 19)
+        middleband = mean_20 + reference
+
+        # bollinger bands (20, 2 population standard deviations like talib.BBANDS)
+        upperband = middleband + 2 * std_20
+        lowerband = middleband - 2 * std_20
+        values[:, col['upperband']] = upperband
+        values[:, col['middleband']] = middleband
+        values[:, col['lowerband']] = lowerband
+        values[:, col['bb_width_20']] = (upperband - lowerband) / middleband
+
+        # z-score (20)
+        zscore_20 = (shifted - mean_20) / sample_std_20
+        values[:, col['zscore_20']] = np.where(sample_std_20 == 0, 0.0, zscore_20)
+
+        # rsi (14)
+        delta = close - _shift(close, position)
+        gain = _rolling_mean(np.clip(delta, 0, None), 14, position)
+        loss = _rolling_mean(np.clip(-delta, 0, None), 14, position)
+        rsi_14 = 100 - (100 / (1 + (gain / loss)))
+        values[:, col['rsi_14']] = np.where(loss == 0, 100.0, rsi_14)
+
+        # sma 10 and 50
+        values[:, col['sma_10']] = _rolling_mean(close, 10, position)
+        values[:, col['sma_50']] = _rolling_mean(close, 50, position)
+
+        # atr (14)
+        previous_close = _shift(close, position)
+        tr = np.fmax(high - low, np.fmax(np.abs(high - previous_close), np.abs(low - previous_close)))
+        values[:, col['atr']] = _rolling_mean(tr, 14, position)
+
+    # macd (12, 26, 9) is recursive, so run talib over each ticker's contiguous block. talib takes
+    # longer to import than numpy and pandas together, so it is only imported when it's used
+    import talib
+    for i in range(len(counts)):
+        block = slice(offsets[i], offsets[i + 1])
+        macd, macdsignal, macdhist = talib.MACD(close[block], fastperiod=12, slowperiod=26, signalperiod=9)
+        values[block, col['macd']] = macd
+        values[block, col['macd_signal']] = macdsignal
+        values[block, col['macd_hist']] = macdhist
+
+    return values
+
+
+def ticker_major(data):
+    # tickers, offsets, timestamps and the frame rows that put the bars ticker-major and
+    # time-ascending, the layout the matrix is built in
+    # the index already holds integer ticker codes; they only need renumbering so unused levels
+    # drop out and codes follow sorted ticker order, which is much cheaper than factorizing the strings
+    level = data.index.names.index('Ticker')
+    levels = data.index.levels[level]
+    used = np.flatnonzero(np.bincount(data.index.codes[level], minlength=len(levels)))
+    names = levels[used]
+    ranks = np.argsort(names)
+    remap = np.full(len(levels), -1, dtype=np.int64)
+    remap[used[ranks]] = np.arange(len(used))
+    codes = remap[data.index.codes[level]]
+    tickers = names[ranks]
+
+    timestamps = np.asarray(data.index.get_level_values('Timestamp'), dtype='datetime64[ns]').view(np.int64)
+    order = np.lexsort((timestamps, codes))
+
+    counts = np.bincount(codes, minlength=len(tickers))
+    offsets = np.concatenate(([0], np.cumsum(counts)))
+    return list(tickers), offsets, timestamps[order], order
+
+
+def compute_indicator_matrix(data):
+    print("[SYSTEM]: CALCULATING INDICATORS.")
+
+    # group rows by ticker, keeping time order inside each group
+    tickers, offsets, timestamps, order = ticker_major(data)
+    values = compute_indicator_values(
+        data['High'].to_numpy(dtype=np.float64)[order],
+        data['Low'].to_numpy(dtype=np.float64)[order],
+        data['Close'].to_numpy(dtype=np.float64)[order],
+        data['Volume'].to_numpy(dtype=np.float64)[order],
+        offsets
+    )
+    return IndicatorMatrix(values, INDICATOR_COLUMNS, tickers, offsets, timestamps, order)
+
+
+@instrument.timed('precompute_indicators', rows=len)
+def precompute_indicators(data, tickers=None, cache=None):
+    # kept for existing callers. the matrix covers every ticker in the frame and supports
+    # lookups by (ticker, timestamp), so `tickers` is no longer needed. with an IndicatorCache
+    # only tickers whose bars aren't cached yet are computed
+    if cache is not None:
+        return cache.indicator_matrix(data)
+    return compute_indicator_matrix(data)
 
 
 def calculate_latest_indicators(data):
+    import talib
+
     indicators = {}
 
     # ensure enough data is available to calculate indicators
@@ -0,0 +1,320 @@
+#!/usr/bin/env python
+
+import atexit
+import functools
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# TRADINGBOT_INSTRUMENT=1 turns the stage timers on for a run, =cprofile or =pyinstrument also
+# profiles it. the report goes to TRADINGBOT_REPORT (default instrument-report.json) when the process exits
+ENV_SWITCH = 'TRADINGBOT_INSTRUMENT'
+ENV_REPORT = 'TRADINGBOT_REPORT'
+DEFAULT_REPORT = 'instrument-report.json'
+
+PROFILERS = ('cprofile', 'pyinstrument')
+
+
+class _State:
+    # everything is module level so the disabled check in stage()/timed() is one attribute read
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.counters = {}
+        self.started_wall = time.perf_counter()
+        self.started_cpu = time.process_time()
+        self.profile = None
+        self.profiler = None
+        self.report_path = None
+        self.worker_directory = None
+        self.workers = []
+        self.reported = False
+
+
+_state = _State()
+
+
+class _NullStage:
+    # shared no-op returned by stage() while instrumentation is off
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def add(self, rows):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    __slots__ = ('name', 'rows', 'wall', 'cpu')
+
+    def __init__(self, name, rows):
+        self.name = name
+        self.rows = rows
+
+    def __enter__(self):
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self.wall
+        cpu = time.process_time() - self.cpu
+        with _state.lock:
+            totals = _state.stages.get(self.name)
+            if totals is None:
+                totals = _state.stages[self.name] = {'calls': 0, 'wall': 0.0, 'cpu': 0.0, 'rows': 0}
+            totals['calls'] += 1
+            totals['wall'] += wall
+            totals['cpu'] += cpu
+            totals['rows'] += self.rows
+        return False
+
+    def add(self, rows):
+        self.rows += int(rows)
+
+
+def enabled():
+    return _state.enabled
+
+
+def stage(name, rows=0):
+    # time a block: with stage('insert_data', rows=n): ... or call .add(n) on the result once the row
+    # count is known. cpu time is process-wide, so threads running in parallel all count towards it
+    if not _state.enabled:
+        return _NULL_STAGE
+    return _Stage(name, int(rows))
+
+
+def timed(name, rows=None):
+    # decorator form of stage(). rows, if given, is called on the return value to count rows
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _state.enabled:
+                return function(*args, **kwargs)
+            with _Stage(name, 0) as stage:
+                result = function(*args, **kwargs)
+                if rows is not None:
+                    stage.add(rows(result))
+            return result
+        return wrapper
+    return decorate
+
+
+def count(name, n=1):
+    if _state.enabled:
+        with _state.lock:
+            _state.counters[name] = _state.counters.get(name, 0) + n
+
+
+def peak_rss_mb():
+    # ru_maxrss is kilobytes on linux and bytes on macos
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if os.uname().sysname == 'Darwin' else peak / 1024
+
+
+def reset():
+    with _state.lock:
+        _state.stages = {}
+        _state.counters = {}
+        _state.workers = []
+        _state.started_wall = time.perf_counter()
+        _state.started_cpu = time.process_time()
+
+
+def enable(profile=None, report_path=None):
+    if profile is not None and profile not in PROFILERS:
+        raise ValueError(f"UNKNOWN PROFILER {profile}, EXPECTED ONE OF {PROFILERS}")
+
+    reset()
+    _state.enabled = True
+    _state.reported = False
+    _state.report_path = report_path
+    _state.profile = profile
+    if profile == 'cprofile':
+        import cProfile
+        _state.profiler = cProfile.Profile()
+        _state.profiler.enable()
+    elif profile == 'pyinstrument':
+        from pyinstrument import Profiler
+        _state.profiler = Profiler()
+        _state.profiler.start()
+
+
+def disable():
+    _state.enabled = False
+    _stop_profiler()
+
+
+def _stop_profiler():
+    profiler, _state.profiler = _state.profiler, None
+    if profiler is None:
+        return None
+    if _state.profile == 'cprofile':
+        profiler.disable()
+    else:
+        profiler.stop()
+    return profiler
+
+
+def _add_rates(stages):
+    for totals in stages.values():
+        totals['rows_per_second'] = totals['rows'] / totals['wall'] if totals['rows'] and totals['wall'] > 0 else None
+
+
+def snapshot():
+    # this process's numbers, in the shape the report and merge() use
+    with _state.lock:
+        stages = {name: dict(totals) for name, totals in _state.stages.items()}
+        counters = dict(_state.counters)
+    _add_rates(stages)
+    return {
+        'pid': os.getpid(),
+        'wall': time.perf_counter() - _state.started_wall,
+        'cpu': time.process_time() - _state.started_cpu,
+        'peak_rss_mb': peak_rss_mb(),
+        'stages': stages,
+        'counters': counters
+    }
+
+
+def merge(snapshots):
+    # add up stages and counters across processes. wall and peak rss are the largest of any process
+    stages, counters = {}, {}
+    for report in snapshots:
+        for name, totals in report['stages'].items():
+            merged = stages.setdefault(name, {'calls': 0, 'wall': 0.0, 'cpu': 0.0, 'rows': 0})
+            for key in ('calls', 'wall', 'cpu', 'rows'):
+                merged[key] += totals[key]
+        for name, value in report['counters'].items():
+            counters[name] = counters.get(name, 0) + value
+    _add_rates(stages)
+
+    peaks = [report['peak_rss_mb'] for report in snapshots if report['peak_rss_mb'] is not None]
+    return {
+        'processes': len(snapshots),
+        'wall': max((report['wall'] for report in snapshots), default=0.0),
+        'cpu': sum(report['cpu'] for report in snapshots),
+        'peak_rss_mb': max(peaks) if peaks else None,
+        'stages': stages,
+        'counters': counters
+    }
+
+
+def worker_spec():
+    # handed to pool initializers so workers instrument themselves and leave their numbers where
+    # collect_workers() finds them. None while instrumentation is off
+    if not _state.enabled:
+        return None
+    return {'directory': tempfile.mkdtemp(prefix='tradingbot-instrument-')}
+
+
+def init_worker(spec):
+    # forked workers inherit the parent's totals (and spawned ones may have enabled themselves from
+    # the environment), so start from zero either way. workers don't run the profiler
+    _stop_profiler()
+    if spec is None:
+        _state.enabled = False
+        return
+    reset()
+    _state.enabled = True
+    _state.worker_directory = spec['directory']
+
+
+def flush():
+    # called by a worker at the end of each task. pool workers exit without running atexit hooks,
+    # so the latest totals are rewritten after every task instead
+    if not _state.enabled or _state.worker_directory is None:
+        return
+    path = os.path.join(_state.worker_directory, f'worker-{os.getpid()}.json')
+    with open(path + '.tmp', 'w') as file:
+        json.dump(snapshot(), file)
+    os.replace(path + '.tmp', path)
+
+
+def collect_workers(spec):
+    # read back and keep the reports of every worker that ran under spec, then clean up
+    if spec is None:
+        return []
+    reports = []
+    for name in sorted(os.listdir(spec['directory'])):
+        if name.endswith('.json'):
+            with open(os.path.join(spec['directory'], name)) as file:
+                reports.append(json.load(file))
+    shutil.rmtree(spec['directory'], ignore_errors=True)
+    with _state.lock:
+        _state.workers.extend(reports)
+    return reports
+
+
+def report():
+    main = snapshot()
+    return {
+        'main': main,
+        'workers': list(_state.workers),
+        'merged': merge([main] + _state.workers)
+    }
+
+
+def write_report(path=None):
+    path = path or _state.report_path or os.environ.get(ENV_REPORT) or DEFAULT_REPORT
+    result = report()
+
+    # the profile is dumped beside the report, and the top of a cProfile run goes into the report itself
+    profiler = _stop_profiler()
+    if profiler is not None:
+        base = os.path.splitext(path)[0]
+        if _state.profile == 'cprofile':
+            import io
+            import pstats
+            profiler.dump_stats(base + '.prof')
+            text = io.StringIO()
+            pstats.Stats(profiler, stream=text).sort_stats('cumulative').print_stats(25)
+            result['profile'] = {'path': base + '.prof', 'top': text.getvalue().splitlines()}
+        else:
+            with open(base + '.html', 'w') as file:
+                file.write(profiler.output_html())
+            result['profile'] = {'path': base + '.html'}
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w') as file:
+        json.dump(result, file, indent=2)
+    _state.reported = True
+    print(f"[SYSTEM]: INSTRUMENTATION REPORT WRITTEN TO {path}")
+    return result
+
+
+def _write_report_at_exit():
+    # only the main process writes, and only if nobody wrote the report explicitly
+    if _state.enabled and not _state.reported and _state.worker_directory is None:
+        write_report()
+
+
+def enable_from_env():
+    value = os.environ.get(ENV_SWITCH, '').strip().lower()
+    if value in ('', '0', 'false', 'no', 'off'):
+        return False
+    enable(profile=value if value in PROFILERS else None)
+    return True
+
+
+atexit.register(_write_report_at_exit)
+enable_from_env()
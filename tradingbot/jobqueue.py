@@ -0,0 +1,439 @@
+#!/usr/bin/env python
+
+import json
+import os
+import socket
+import sqlite3 as sq3
+import threading
+import time
+import traceback
+import uuid
+import numpy as np
+from tradingbot import instrument
+
+# a durable job queue in SQLite, standing in for a real broker. a coordinator splits a run into
+# jobs (ticker batches, parameter points or walk-forward folds) and any number of workers, on
+# this machine or on others sharing the file, claim them one at a time. a claim is a lease:
+# the worker heartbeats to extend it, and a job whose lease runs out (the worker crashed or
+# hung) goes to the next worker that asks. failed jobs are retried up to max_attempts times
+QUEUE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    batch TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    available_at REAL NOT NULL,
+    worker TEXT,
+    lease_expires REAL,
+    heartbeat REAL,
+    result TEXT,
+    error TEXT,
+    created REAL NOT NULL,
+    finished REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, available_at);
+CREATE INDEX IF NOT EXISTS jobs_batch ON jobs (batch, status);
+"""
+
+STATUSES = ('pending', 'running', 'done', 'failed')
+
+DEFAULT_LEASE_SECONDS = 60
+DEFAULT_MAX_ATTEMPTS = 3
+
+# a failed job waits retry_delay * 2 ** (attempts - 1) seconds before it can be claimed again
+DEFAULT_RETRY_DELAY = 5
+
+# filled by the @handler decorator: job kind -> function(payload, db_path) returning the result
+HANDLERS = {}
+
+# inputs a worker has loaded, so consecutive jobs over the same bars only read them once
+MAX_CACHED_INPUTS = 4
+_cached_inputs = {}
+
+
+def queue_path(db_path=None):
+    # beside the bar database, like the result store
+    from tradingbot.dataloader import DB_PATH
+    return os.path.join(os.path.dirname(db_path or DB_PATH), 'jobs.db')
+
+
+def _plain(value):
+    # numpy scalars and arrays in results as json numbers and lists
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"CAN'T STORE {type(value).__name__} IN A JOB")
+
+
+def _encode(value):
+    return json.dumps(value, default=_plain)
+
+
+class JobQueue:
+    # every process (and every heartbeat thread) opens its own connection. claims, completions
+    # and retries are each one short BEGIN IMMEDIATE transaction, so workers queue for the write
+    # lock instead of double-claiming a job
+    def __init__(self, path=None, lease_seconds=DEFAULT_LEASE_SECONDS, retry_delay=DEFAULT_RETRY_DELAY, timeout=60):
+        self.path = path or queue_path()
+        self.lease_seconds = lease_seconds
+        self.retry_delay = retry_delay
+        self.timeout = timeout
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.con = sq3.connect(self.path, timeout=timeout, isolation_level=None)
+        self.con.execute("PRAGMA journal_mode=WAL;")
+        self.con.execute("PRAGMA synchronous=NORMAL;")
+        self.con.executescript(QUEUE_SCHEMA)
+
+    def spec(self):
+        # enough to reopen the queue in another process or thread
+        return {'path': self.path, 'lease_seconds': self.lease_seconds, 'retry_delay': self.retry_delay,
+                'timeout': self.timeout}
+
+    @classmethod
+    def from_spec(cls, spec):
+        return cls(**spec)
+
+    def close(self):
+        self.con.close()
+
+    def submit(self, batch, kind, payloads, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        # one job per payload, all in one transaction. returns the job ids in order
+        if kind not in HANDLERS:
+            raise ValueError(f"UNKNOWN JOB KIND {kind}, EXPECTED ONE OF {tuple(HANDLERS)}")
+        now = time.time()
+        with self.con:
+            self.con.execute("BEGIN IMMEDIATE;")
+            first = self.con.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM jobs;").fetchone()[0]
+            self.con.executemany("""
+            INSERT INTO jobs (id, batch, kind, payload, max_attempts, available_at, created)
+            VALUES (?, ?, ?, ?, ?, ?, ?);
+            """, [(first + i, batch, kind, _encode(payload), max_attempts, now, now) for i, payload in enumerate(payloads)])
+        return list(range(first, first + len(payloads)))
+
+    def claim(self, worker):
+        # lease the oldest job that is ready: pending and past its retry delay, or running on a
+        # lease that ran out. returns (id, kind, payload, attempt) or None when nothing is ready
+        now = time.time()
+        with self.con:
+            self.con.execute("BEGIN IMMEDIATE;")
+            # a lapsed lease counts as a failed attempt, so a job that keeps killing its workers stops
+            self.con.execute("""
+            UPDATE jobs SET status = 'failed', error = 'lease expired', finished = ?
+            WHERE status = 'running' AND lease_expires < ? AND attempts >= max_attempts;
+            """, (now, now))
+            row = self.con.execute("""
+            SELECT id, kind, payload, attempts FROM jobs
+            WHERE (status = 'pending' AND available_at <= ?) OR (status = 'running' AND lease_expires < ?)
+            ORDER BY id LIMIT 1;
+            """, (now, now)).fetchone()
+            if row is None:
+                return None
+            self.con.execute("""
+            UPDATE jobs SET status = 'running', worker = ?, attempts = attempts + 1, lease_expires = ?, heartbeat = ?
+            WHERE id = ?;
+            """, (worker, now + self.lease_seconds, now, row[0]))
+        job_id, kind, payload, attempts = row
+        return job_id, kind, json.loads(payload), attempts + 1
+
+    def heartbeat(self, job_id, worker):
+        # extend the lease. False once the job is no longer this worker's to finish
+        now = time.time()
+        updated = self.con.execute("""
+        UPDATE jobs SET lease_expires = ?, heartbeat = ?
+        WHERE id = ? AND worker = ? AND status = 'running';
+        """, (now + self.lease_seconds, now, job_id, worker)).rowcount
+        return updated == 1
+
+    def complete(self, job_id, worker, result):
+        # store the result. False (and nothing stored) if the job was reassigned meanwhile
+        updated = self.con.execute("""
+        UPDATE jobs SET status = 'done', result = ?, error = NULL, finished = ?, lease_expires = NULL
+        WHERE id = ? AND worker = ? AND status = 'running';
+        """, (_encode(result), time.time(), job_id, worker)).rowcount
+        return updated == 1
+
+    def fail(self, job_id, worker, error):
+        # back to pending after the retry delay, or failed for good on the last attempt
+        now = time.time()
+        with self.con:
+            self.con.execute("BEGIN IMMEDIATE;")
+            row = self.con.execute("""
+            SELECT attempts, max_attempts FROM jobs WHERE id = ? AND worker = ? AND status = 'running';
+            """, (job_id, worker)).fetchone()
+            if row is None:
+                return False
+            attempts, max_attempts = row
+            if attempts >= max_attempts:
+                self.con.execute("""
+                UPDATE jobs SET status = 'failed', error = ?, finished = ?, lease_expires = NULL WHERE id = ?;
+                """, (error, now, job_id))
+            else:
+                self.con.execute("""
+                UPDATE jobs SET status = 'pending', error = ?, worker = NULL, lease_expires = NULL, available_at = ?
+                WHERE id = ?;
+                """, (error, now + self.retry_delay * 2 ** (attempts - 1), job_id))
+        return True
+
+    def counts(self, batch=None):
+        # {status: jobs} for one batch or the whole queue
+        if batch is None:
+            rows = self.con.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status;")
+        else:
+            rows = self.con.execute("SELECT status, COUNT(*) FROM jobs WHERE batch = ? GROUP BY status;", (batch,))
+        counts = dict.fromkeys(STATUSES, 0)
+        counts.update(rows)
+        return counts
+
+    def unfinished(self, batch=None):
+        counts = self.counts(batch)
+        return counts['pending'] + counts['running']
+
+    def results(self, batch):
+        # [(id, status, result, error)] in submission order
+        rows = self.con.execute("SELECT id, status, result, error FROM jobs WHERE batch = ? ORDER BY id;", (batch,))
+        return [(job_id, status, None if result is None else json.loads(result), error)
+                for job_id, status, result, error in rows]
+
+    def wait(self, batch, poll=1.0, timeout=None, processes=None, verbose=True):
+        # block until every job in batch is done or failed. processes are the local workers, if
+        # any: when they have all exited there is nobody left to finish the batch
+        started = time.monotonic()
+        last = None
+        while True:
+            counts = self.counts(batch)
+            if counts != last and verbose:
+                print(f"[SYSTEM]: {counts['done']} DONE, {counts['running']} RUNNING, "
+                      f"{counts['pending']} PENDING, {counts['failed']} FAILED")
+                last = counts
+            if counts['pending'] + counts['running'] == 0:
+                return counts
+            if processes is not None and not any(process.is_alive() for process in processes):
+                raise RuntimeError(f"ALL LOCAL WORKERS EXITED WITH {counts['pending'] + counts['running']} JOBS LEFT")
+            if timeout is not None and time.monotonic() - started > timeout:
+                raise TimeoutError(f"BATCH {batch} STILL HAS {counts['pending'] + counts['running']} JOBS AFTER {timeout}S")
+            time.sleep(poll)
+
+
+def handler(kind):
+    def register(function):
+        HANDLERS[kind] = function
+        return function
+    return register
+
+
+def load_inputs(db_path, tickers, start, end):
+    # optimizer inputs for the bars in [start, end], as CompactBars over the memory-mapped bar
+    # cache, so workers on one machine share the bars' pages and only the first to find the cache
+    # missing or stale reads the table. the last few are kept, since a worker usually gets many
+    # jobs over the same bars in a row
+    name = (db_path, tuple(tickers), start, end)
+    if name in _cached_inputs:
+        return _cached_inputs[name]
+
+    from tradingbot.barcache import open_bar_cache
+    from tradingbot.compact import CompactBars
+    from tradingbot.dataloader import connect
+    from tradingbot.optimizer import prepare_inputs
+
+    con = connect(db_path)
+    try:
+        with instrument.stage('job_load_bars') as stage:
+            bars = CompactBars.from_bar_cache(open_bar_cache(con, tickers, start, end, db_path))
+            stage.add(len(bars))
+    finally:
+        con.close()
+    if len(bars) == 0:
+        raise ValueError(f"NO BARS FOR {len(tickers)} TICKERS BETWEEN {start} AND {end}")
+
+    inputs = prepare_inputs(bars.tickers, bars)
+    while len(_cached_inputs) >= MAX_CACHED_INPUTS:
+        _cached_inputs.pop(next(iter(_cached_inputs)))
+    _cached_inputs[name] = inputs
+    return inputs
+
+
+@handler('tickers')
+def run_ticker_batch(payload, db_path=None):
+    # one backtest over a slice of the universe
+    from tradingbot.optimizer import EVALUATION_SETTINGS, evaluate, score
+
+    inputs = load_inputs(db_path, payload['tickers'], payload['start'], payload['end'])
+    metrics = evaluate(inputs, payload['point'], **EVALUATION_SETTINGS)
+    return {'tickers': payload['tickers'], 'metrics': metrics, 'score': score(metrics)}
+
+
+@handler('points')
+def run_points(payload, db_path=None):
+    # a chunk of parameter points over the whole universe
+    from tradingbot.optimizer import EVALUATION_SETTINGS, evaluate, score
+
+    inputs = load_inputs(db_path, payload['tickers'], payload['start'], payload['end'])
+    results = []
+    for point in payload['points']:
+        metrics = evaluate(inputs, point, **EVALUATION_SETTINGS)
+        results.append({'point': point, 'metrics': metrics, 'score': score(metrics)})
+    return results
+
+
+@handler('fold')
+def run_fold_job(payload, db_path=None):
+    # one walk-forward fold: sweep the train window, score the winner on the test window
+    from tradingbot.walkforward import run_fold
+
+    inputs = load_inputs(db_path, payload['tickers'], payload['start'], payload['end'])
+    return run_fold(inputs, payload['fold'], payload['grid'])
+
+
+class _Heartbeat(threading.Thread):
+    # extends the lease every lease_seconds / 3 on its own connection. the kernels hold the GIL,
+    # so a beat can be late by one kernel call; jobs should stay well under the lease
+    def __init__(self, spec, job_id, worker):
+        super().__init__(daemon=True)
+        self.spec = spec
+        self.job_id = job_id
+        self.worker = worker
+        self.stopped = threading.Event()
+        self.lost = False
+
+    def run(self):
+        queue = JobQueue.from_spec(self.spec)
+        try:
+            while not self.stopped.wait(self.spec['lease_seconds'] / 3):
+                if not queue.heartbeat(self.job_id, self.worker):
+                    self.lost = True
+                    return
+        finally:
+            queue.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def run_worker(spec, db_path=None, poll=1.0, exit_when_empty=False, max_jobs=None, threads=None, verbose=True):
+    # claim and run jobs until stopped. exit_when_empty stops once nothing in the queue is pending
+    # or running (leased jobs of a crashed worker still count, so they get picked up); otherwise
+    # the worker polls forever. returns how many jobs it completed
+    if threads is not None:
+        from tradingbot.kernel import HAS_NUMBA
+        if HAS_NUMBA:
+            import numba
+            numba.set_num_threads(threads)
+
+    queue = JobQueue.from_spec(spec)
+    worker = worker_name()
+    completed = 0
+    try:
+        while max_jobs is None or completed < max_jobs:
+            job = queue.claim(worker)
+            if job is None:
+                if exit_when_empty and queue.unfinished() == 0:
+                    break
+                time.sleep(poll)
+                continue
+
+            job_id, kind, payload, attempt = job
+            if verbose:
+                print(f"[SYSTEM]: {worker} RUNNING {kind.upper()} JOB {job_id} (ATTEMPT {attempt})")
+            heartbeat = _Heartbeat(queue.spec(), job_id, worker)
+            heartbeat.start()
+            try:
+                with instrument.stage(f'job_{kind}'):
+                    result = HANDLERS[kind](payload, db_path)
+            except Exception:
+                heartbeat.stop()
+                queue.fail(job_id, worker, traceback.format_exc(limit=5))
+                instrument.count('jobs_failed')
+                continue
+            heartbeat.stop()
+
+            # a job that lost its lease was handed to someone else; their result is the one kept
+            if heartbeat.lost or not queue.complete(job_id, worker, result):
+                instrument.count('jobs_lost')
+                continue
+            completed += 1
+            instrument.count('jobs_completed')
+            instrument.flush()
+    finally:
+        queue.close()
+        instrument.flush()
+    return completed
+
+
+def _run_local_worker(instrument_spec, spec, db_path, **kwargs):
+    # like the pool initializers: the child reports through instrument_spec (from
+    # instrument.worker_spec(), None while instrumentation is off) instead of writing its own report
+    instrument.init_worker(instrument_spec)
+    return run_worker(spec, db_path, **kwargs)
+
+
+def start_workers(n, queue, db_path=None, poll=0.5, instrument_spec=None):
+    # n local worker processes that exit once the queue is drained. spawned rather than forked for
+    # the same reason as walk-forward: numba's thread pool isn't fork-safe. pass instrument_spec
+    # to collect_workers() once they are joined
+    import multiprocessing
+
+    context = multiprocessing.get_context('spawn')
+    processes = []
+    for _ in range(n):
+        process = context.Process(
+            target=_run_local_worker,
+            args=(instrument_spec, queue.spec(), db_path),
+            kwargs={'poll': poll, 'exit_when_empty': True, 'threads': 1 if n > 1 else None, 'verbose': False}
+        )
+        process.start()
+        processes.append(process)
+    return processes
+
+
+def new_batch():
+    return uuid.uuid4().hex[:12]
+
+
+def submit_ticker_batches(queue, tickers, start, end, point, batch_size=50, max_attempts=DEFAULT_MAX_ATTEMPTS):
+    # the same backtest on consecutive slices of batch_size tickers
+    tickers = sorted(tickers)
+    batch = new_batch()
+    payloads = [{'tickers': tickers[i:i + batch_size], 'start': start, 'end': end, 'point': list(point)}
+                for i in range(0, len(tickers), batch_size)]
+    queue.submit(batch, 'tickers', payloads, max_attempts)
+    return batch
+
+
+def submit_points(queue, tickers, start, end, points, points_per_job=10, max_attempts=DEFAULT_MAX_ATTEMPTS):
+    # parameter points in chunks, so loading the bars is amortized over several backtests
+    tickers = sorted(tickers)
+    batch = new_batch()
+    payloads = [{'tickers': tickers, 'start': start, 'end': end, 'points': [list(point) for point in points[i:i + points_per_job]]}
+                for i in range(0, len(points), points_per_job)]
+    queue.submit(batch, 'points', payloads, max_attempts)
+    return batch
+
+
+def submit_folds(queue, tickers, start, end, grid, train_bars, test_bars, step=None, expanding=False, db_path=None,
+                 max_attempts=DEFAULT_MAX_ATTEMPTS):
+    # one job per walk-forward fold. the folds are cut from the bars' timestamps, read once here
+    from tradingbot.walkforward import make_folds
+
+    tickers = sorted(tickers)
+    timestamps = load_inputs(db_path, tickers, start, end)['timestamps']
+    folds = make_folds(timestamps, train_bars, test_bars, step, expanding)
+    if not folds:
+        raise ValueError("NOT ENOUGH BARS FOR A SINGLE TRAIN/TEST FOLD")
+
+    batch = new_batch()
+    payloads = [{'tickers': tickers, 'start': start, 'end': end, 'fold': fold, 'grid': [list(point) for point in grid]}
+                for fold in folds]
+    queue.submit(batch, 'fold', payloads, max_attempts)
+    return batch
@@ -0,0 +1,328 @@
+#!/usr/bin/env python
+
+import numpy as np
+from tradingbot import instrument
+from tradingbot.recorder import MetricsAccumulator
+from tradingbot.scoring import BUY, SELL
+
+# numba is optional. without it the same loop runs as plain python over numpy arrays
+try:
+    from numba import njit, prange
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+    prange = range
+
+# bump when the trading rules in _simulate change, so stored backtest results from the old rules
+# are no longer served. 2: max_loss_count is enforced
+STRATEGY_VERSION = 2
+
+
+def _simulate(close, atr, signals, equity, rows, start, balance, stop_loss_percent, take_profit_percent,
+              commission_percent, slippage_percent, cooling_off_period, max_loss_count, risk_percent):
+    # recorded portfolio values go into equity, with their row index in rows, as a ring: once it is
+    # full the oldest value is overwritten. both may be empty arrays, in which case only the running
+    # stats are kept. like run_portfolio, an exit below the entry price counts as a loss, and once max_loss_count
+    # losses are taken no new positions are opened (0 disables the limit)
+    write_history = len(equity) > 0
+    savings = 0.0
+    holding = False
+    shares = 0.0
+    position_price = 0.0
+    cooling_off_counter = 0
+    loss_count = 0
+
+    # running count/mean/sum of squared deviations (welford) of the recorded returns, plus the
+    # peak, max drawdown and trade count MetricsAccumulator keeps
+    last_value = np.nan
+    return_count = 0
+    return_mean = 0.0
+    return_m2 = 0.0
+    written = 0
+    peak = -np.inf
+    max_drawdown = 0.0
+    trades = 0
+
+    for i in range(start, len(close)):
+        # cooling off period logic (no trades and nothing recorded while it runs)
+        if cooling_off_counter > 0:
+            cooling_off_counter -= 1
+            continue
+
+        price = close[i]
+
+        # buying logic: if no position and signal is BUY, and the loss limit isn't reached
+        if not holding and signals[i] == BUY and (max_loss_count <= 0 or loss_count < max_loss_count):
+            # apply slippage and commission to the position price
+            position_price = price * (1 + slippage_percent / 100)
+            position_price = position_price * (1 + commission_percent / 100)
+
+            # same sizing as calculate_position_size, with the stop loss percent as the distance
+            risk_amount = balance * risk_percent
+            denominator = stop_loss_percent * position_price
+            if denominator > 0:
+                shares = float(min(max(np.trunc(risk_amount / denominator), 0.0), 100.0))
+            else:
+                shares = 100.0 if risk_amount > 0 else 0.0
+
+            holding = True
+            balance -= shares * position_price
+            cooling_off_counter = cooling_off_period
+            trades += 1
+
+        # selling logic: take-profit, stop-loss, then SELL signal
+        elif holding:
+            if price >= position_price + (take_profit_percent * atr[i]):
+                balance += shares * price * 0.5
+                savings += shares * price * 0.5
+                holding = False
+
+            elif price <= position_price - (stop_loss_percent * atr[i]):
+                balance += shares * price * 0.5
+                savings += shares * price * 0.5
+                holding = False
+
+            elif signals[i] == SELL:
+                balance += shares * price
+                savings += shares * price * 0.5
+                holding = False
+
+            # an exit below the entry price counts towards the loss limit
+            if not holding:
+                trades += 1
+                if price < position_price:
+                    loss_count += 1
+
+        # track portfolio value
+        if holding:
+            value = shares * price + balance + savings
+        else:
+            value = balance + savings
+        if write_history:
+            slot = written % len(equity)
+            equity[slot] = value
+            rows[slot] = i
+        written += 1
+        peak = max(peak, value)
+        if peak > 0:
+            max_drawdown = max(max_drawdown, 1 - value / peak)
+
+        # same returns as pct_change().dropna() over the recorded values
+        if not np.isnan(last_value) and last_value != 0:
+            change = value / last_value - 1
+            if not np.isnan(change):
+                return_count += 1
+                delta = change - return_mean
+                return_mean += delta / return_count
+                return_m2 += delta * (change - return_mean)
+        last_value = value
+
+    return (balance, savings, holding, shares, last_value, return_count, return_mean, return_m2, written, peak,
+            max_drawdown, trades)
+
+
+def _sweep(close, atr, signals, start, initial_balance, stop_loss_percent, take_profit_percent,
+           commission_percent, slippage_percent, cooling_off_period, max_loss_count, risk_percent, stats):
+    # one independent state machine per parameter set, spread over cores by numba
+    no_history = np.empty(0, dtype=np.float64)
+    no_rows = np.empty(0, dtype=np.int64)
+    for p in prange(len(stop_loss_percent)):
+        result = _simulate(
+            close, atr, signals, no_history, no_rows, start, initial_balance, stop_loss_percent[p],
+            take_profit_percent[p], commission_percent, slippage_percent, cooling_off_period[p], max_loss_count[p],
+            risk_percent
+        )
+        stats[p, 0] = result[4]
+        stats[p, 1] = result[5]
+        stats[p, 2] = result[6]
+        stats[p, 3] = result[7]
+
+
+def _sweep_vectorized(close, atr, signals, start, initial_balance, stop_loss_percent, take_profit_percent,
+                      commission_percent, slippage_percent, cooling_off_period, max_loss_count, risk_percent, stats):
+    # numpy fallback for _sweep: the same state machine, with the parameter sets as a vector
+    # dimension so each bar costs a handful of array operations instead of a python loop per set
+    count = len(stop_loss_percent)
+    balance = np.full(count, initial_balance)
+    savings = np.zeros(count)
+    holding = np.zeros(count, dtype=np.bool_)
+    shares = np.zeros(count)
+    position_price = np.zeros(count)
+    cooling_off_counter = np.zeros(count, dtype=np.int64)
+    loss_count = np.zeros(count, dtype=np.int64)
+    last_value = np.full(count, np.nan)
+    return_count = np.zeros(count)
+    return_mean = np.zeros(count)
+    return_m2 = np.zeros(count)
+
+    for i in range(start, len(close)):
+        # cooling off period logic (no trades and nothing recorded while it runs)
+        active = cooling_off_counter <= 0
+        cooling_off_counter[~active] -= 1
+        price = close[i]
+
+        # buying logic
+        if signals[i] == BUY:
+            buy = active & ~holding & ((max_loss_count <= 0) | (loss_count < max_loss_count))
+            entry = price * (1 + slippage_percent / 100)
+            entry = entry * (1 + commission_percent / 100)
+            risk_amount = balance[buy] * risk_percent
+            denominator = stop_loss_percent[buy] * entry
+            with np.errstate(divide='ignore', invalid='ignore'):
+                sized = np.clip(np.trunc(risk_amount / denominator), 0.0, 100.0)
+            sized = np.where(denominator > 0, sized, np.where(risk_amount > 0, 100.0, 0.0))
+            shares[buy] = sized
+            position_price[buy] = entry
+            balance[buy] -= sized * entry
+            cooling_off_counter[buy] = cooling_off_period[buy]
+        else:
+            buy = np.zeros(count, dtype=np.bool_)
+
+        # selling logic: take-profit, stop-loss, then SELL signal
+        open_positions = active & holding
+        take_profit = open_positions & (price >= position_price + take_profit_percent * atr[i])
+        stop_loss = open_positions & ~take_profit & (price <= position_price - stop_loss_percent * atr[i])
+        split = take_profit | stop_loss
+        balance[split] += shares[split] * price * 0.5
+        savings[split] += shares[split] * price * 0.5
+        if signals[i] == SELL:
+            sell = open_positions & ~split
+            balance[sell] += shares[sell] * price
+            savings[sell] += shares[sell] * price * 0.5
+            split |= sell
+        loss_count[split & (price < position_price)] += 1
+        holding = (holding | buy) & ~split
+
+        # track portfolio value and the running return stats
+        value = np.where(holding, shares * price + balance + savings, balance + savings)
+        update = active & ~np.isnan(last_value) & (last_value != 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            change = value / last_value - 1
+        update &= ~np.isnan(change)
+        return_count[update] += 1
+        delta = change[update] - return_mean[update]
+        return_mean[update] += delta / return_count[update]
+        return_m2[update] += delta * (change[update] - return_mean[update])
+        last_value[active] = value[active]
+
+    stats[:, 0] = last_value
+    stats[:, 1] = return_count
+    stats[:, 2] = return_mean
+    stats[:, 3] = return_m2
+
+
+if HAS_NUMBA:
+    _simulate = njit(cache=True)(_simulate)
+    _sweep = njit(cache=True, parallel=True)(_sweep)
+else:
+    _sweep = _sweep_vectorized
+
+
+def simulate(close, atr, signals, start=50, initial_balance=10000, stop_loss_percent=0.1356,
+             take_profit_percent=0.1954, commission_percent=0.005, slippage_percent=0.002,
+             cooling_off_period=18, max_loss_count=15, risk_percent=0.02, history_capacity=None):
+    # close, atr and signals must be aligned row for row in the order the bars are traded.
+    # history_capacity bounds the equity history: None keeps every recorded value, n keeps the most
+    # recent n and 0 keeps none. the running stats cover the whole run either way
+    close = np.ascontiguousarray(close, dtype=np.float64)
+    atr = np.ascontiguousarray(atr, dtype=np.float64)
+    signals = np.ascontiguousarray(signals, dtype=np.int8)
+
+    # preallocated outputs, filled in place by the loop
+    capacity = len(close) if history_capacity is None else int(history_capacity)
+    equity = np.empty(capacity)
+    rows = np.empty(capacity, dtype=np.int64)
+
+    with instrument.stage('simulate', rows=len(close)):
+        (balance, savings, holding, shares, final_value, return_count, return_mean, return_m2, written, peak,
+         max_drawdown, trades) = _simulate(
+            close, atr, signals, equity, rows, int(start), float(initial_balance),
+            float(stop_loss_percent), float(take_profit_percent), float(commission_percent),
+            float(slippage_percent), int(cooling_off_period), int(max_loss_count), float(risk_percent)
+        )
+
+    # the kept values in time order. once the ring wrapped, the oldest kept value is the next slot
+    if written > capacity > 0:
+        first = written % capacity
+        equity = np.concatenate((equity[first:], equity[:first]))
+        rows = np.concatenate((rows[first:], rows[:first]))
+    else:
+        equity = equity[:written]
+        rows = rows[:written]
+
+    return {
+        'equity': equity,
+        'rows': rows,
+        'balance': balance,
+        'savings': savings,
+        'holding': holding,
+        'shares': shares,
+        'final_value': final_value,
+        'return_count': return_count,
+        'return_mean': return_mean,
+        'return_m2': return_m2,
+        'written': written,
+        'peak': peak,
+        'max_drawdown': max_drawdown,
+        'trades': trades
+    }
+
+
+def simulate_metrics(result):
+    # simulate()'s running stats as a MetricsAccumulator, so kernel runs are summarized exactly
+    # like the row-wise and portfolio loops that feed one value at a time
+    return MetricsAccumulator.from_state(
+        result['return_count'], result['return_mean'], result['return_m2'], result['final_value'],
+        result['peak'], result['max_drawdown'], result['trades']
+    )
+
+
+def equity_metrics(portfolio_value, initial_balance=10000):
+    # the stats summarize_backtest reports, computed straight from the recorded portfolio values
+    portfolio_value = np.asarray(portfolio_value, dtype=np.float64)
+    if len(portfolio_value) < 2:
+        return None
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns = portfolio_value[1:] / portfolio_value[:-1] - 1
+        returns = returns[~np.isnan(returns)]
+        if len(returns) == 0:
+            return None
+
+        final_value = portfolio_value[-1]
+        avg_return = np.mean(returns)
+        volatility = np.std(returns) / avg_return
+        sharpe = (avg_return - 0.005) / volatility if volatility > 0 else 0.0
+
+    return {
+        'final_value': final_value,
+        'total_return': final_value / initial_balance - 1,
+        'sharpe_ratio': sharpe,
+        'avg_return': avg_return,
+        'volatility': volatility
+    }
+
+
+def sweep_stats(close, atr, signals, stop_loss_percent, take_profit_percent, cooling_off_period, max_loss_count=None,
+                start=50, initial_balance=10000, commission_percent=0.005, slippage_percent=0.002, risk_percent=0.02):
+    # run the state machine for many parameter sets over the same arrays. parameters are 1-D arrays
+    # of equal length (max_loss_count defaults to no limit); returns (final value, return count, mean
+    # return, sum of squared deviations) per set
+    stop_loss_percent = np.ascontiguousarray(stop_loss_percent, dtype=np.float64)
+    take_profit_percent = np.ascontiguousarray(take_profit_percent, dtype=np.float64)
+    cooling_off_period = np.ascontiguousarray(cooling_off_period, dtype=np.int64)
+    if max_loss_count is None:
+        max_loss_count = np.zeros(len(stop_loss_percent), dtype=np.int64)
+    max_loss_count = np.ascontiguousarray(max_loss_count, dtype=np.int64)
+    stats = np.full((len(stop_loss_percent), 4), np.nan)
+
+    with instrument.stage('sweep', rows=len(close) * len(stop_loss_percent)):
+        _sweep(
+            np.ascontiguousarray(close, dtype=np.float64),
+            np.ascontiguousarray(atr, dtype=np.float64),
+            np.ascontiguousarray(signals, dtype=np.int8),
+            int(start), float(initial_balance), stop_loss_percent, take_profit_percent,
+            float(commission_percent), float(slippage_percent), cooling_off_period, max_loss_count,
+            float(risk_percent), stats
+        )
+    return stats
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+import os
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+METHODS = ('bootstrap', 'gbm')
+PERCENTILES = (5, 25, 50, 75, 95)
+
+
+def clean_returns(returns):
+    # accepts the 'returns' series from backtest()/backtest_portfolio() or any 1-D array of simple returns
+    returns = np.asarray(returns, dtype=np.float64).ravel()
+    returns = returns[np.isfinite(returns)]
+    if len(returns) < 2:
+        raise ValueError("NEED AT LEAST TWO FINITE RETURNS TO RESAMPLE")
+    return returns
+
+
+def bar_returns(data, ticker):
+    # per-bar close to close returns of one ticker from the multiindex frame
+    close = data.xs(ticker, level='Ticker')['Close'].to_numpy(dtype=np.float64)
+    return close[1:] / close[:-1] - 1
+
+
+def block_bootstrap(returns, n_paths, n_steps, block_size, rng):
+    # circular block bootstrap: each path is stitched from blocks of consecutive historical returns,
+    # which keeps short-range autocorrelation and volatility clustering inside a block
+    n_blocks = -(-n_steps // block_size)
+    starts = rng.integers(0, len(returns), size=(n_paths, n_blocks, 1))
+    index = (starts + np.arange(block_size)) % len(returns)
+    return returns[index.reshape(n_paths, -1)[:, :n_steps]]
+
+
+def gbm(returns, n_paths, n_steps, rng):
+    # geometric brownian motion with drift and volatility fitted to the historical log returns,
+    # sampled exactly on the bar grid
+    log_returns = np.log1p(returns)
+    mu = log_returns.mean()
+    sigma = log_returns.std(ddof=1)
+    return np.expm1(rng.normal(mu, sigma, size=(n_paths, n_steps)))
+
+
+def path_metrics(paths, initial_value=10000):
+    # replay the equity curve over every path at once: paths is (paths, steps) of simple returns
+    equity = initial_value * np.cumprod(1 + paths, axis=1)
+    peak = np.maximum(np.maximum.accumulate(equity, axis=1), initial_value)
+    max_drawdown = np.max(1 - equity / peak, axis=1)
+
+    # same sharpe/volatility definitions as equity_metrics so the numbers compare with a backtest
+    avg_return = paths.mean(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        volatility = paths.std(axis=1) / avg_return
+        sharpe = np.where(volatility > 0, (avg_return - 0.005) / volatility, 0.0)
+
+    return {
+        'final_value': equity[:, -1],
+        'max_drawdown': max_drawdown,
+        'sharpe_ratio': sharpe
+    }
+
+
+def simulate_chunk(returns, n_paths, n_steps, method, block_size, initial_value, seed):
+    rng = np.random.default_rng(seed)
+    if method == 'bootstrap':
+        paths = block_bootstrap(returns, n_paths, n_steps, block_size, rng)
+    else:
+        paths = gbm(returns, n_paths, n_steps, rng)
+    return path_metrics(paths, initial_value)
+
+
+def _simulate_chunk_in_worker(args):
+    return simulate_chunk(*args)
+
+
+def summarize_paths(results, initial_value=10000):
+    summary = {}
+    for name, values in results.items():
+        summary[name] = {'mean': float(np.mean(values))}
+        summary[name].update({f'p{q}': float(v) for q, v in zip(PERCENTILES, np.percentile(values, PERCENTILES))})
+    summary['probability_of_loss'] = float(np.mean(results['final_value'] < initial_value))
+    return summary
+
+
+def monte_carlo(returns, n_paths=10000, n_steps=None, method='bootstrap', block_size=24, initial_value=10000,
+                chunk_size=4096, n_jobs=1, random_state=48, verbose=True):
+    # resample the returns into n_paths paths of n_steps bars (default: as long as the history) and
+    # report the distribution of final value, max drawdown and sharpe. paths are generated in chunks
+    # of chunk_size so memory stays at a few (chunk_size, n_steps) arrays, and chunks are spread over
+    # n_jobs processes. every chunk has its own seed, so results don't depend on n_jobs
+    if method not in METHODS:
+        raise ValueError(f"UNKNOWN METHOD {method}, EXPECTED ONE OF {METHODS}")
+
+    returns = clean_returns(returns)
+    n_steps = n_steps or len(returns)
+    block_size = max(1, min(block_size, len(returns)))
+
+    sizes = [min(chunk_size, n_paths - first) for first in range(0, n_paths, chunk_size)]
+    seeds = np.random.SeedSequence(random_state).spawn(len(sizes))
+    tasks = [(returns, size, n_steps, method, block_size, initial_value, seed) for size, seed in zip(sizes, seeds)]
+
+    n_jobs = min(n_jobs or os.cpu_count() or 1, len(tasks))
+    if n_jobs == 1:
+        chunks = [simulate_chunk(*task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            chunks = list(pool.map(_simulate_chunk_in_worker, tasks))
+
+    results = {name: np.concatenate([chunk[name] for chunk in chunks]) for name in chunks[0]}
+    summary = summarize_paths(results, initial_value)
+
+    if verbose:
+        final_value = summary['final_value']
+        print(f"[SYSTEM]: {n_paths:,} {method.upper()} PATHS OVER {n_steps:,} BARS. "
+              f"FINAL VALUE P5 ${final_value['p5']:,.2f}, MEDIAN ${final_value['p50']:,.2f}, "
+              f"P95 ${final_value['p95']:,.2f}")
+        print(f"[SYSTEM]: MEDIAN MAX DRAWDOWN {summary['max_drawdown']['p50'] * 100:,.2f}%, "
+              f"PROBABILITY OF LOSS {summary['probability_of_loss'] * 100:,.2f}%")
+
+    return {'paths': pd.DataFrame(results), 'summary': summary}
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+
+import itertools
+import multiprocessing
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from tradingbot import instrument
+from tradingbot.kernel import simulate, simulate_metrics
+from tradingbot.resultstore import ResultStore, canonical_point, fingerprint, key
+from tradingbot.shared import publish_arrays, attach_arrays, release_arrays
+
+# order of the values in every candidate point
+PARAMETER_NAMES = ('stop_loss_percent', 'take_profit_percent', 'cooling_off_period', 'max_loss_count')
+
+# settings every optimizer evaluation runs with (evaluate()'s defaults), part of the result store fingerprint
+EVALUATION_SETTINGS = {'initial_balance': 10000, 'start': 50}
+
+# a bayes warm start tells the optimizer at most this many stored results, the best ones
+MAX_WARM_START = 500
+
+# arrays mapped by each worker process, set once by _init_worker, and where it records results
+_worker_segments = None
+_worker_inputs = None
+_worker_store = None
+_worker_fingerprint = None
+
+
+def default_search_space():
+    from skopt.space import Real, Integer
+
+    return [
+        Real(0.0, 0.3, name='stop_loss_percent'),
+        Real(0.0, 0.3, name='take_profit_percent'),
+        Integer(0, 20, name='cooling_off_period'),
+        Integer(0, 20, name='max_loss_count')
+    ]
+
+
+def prepare_inputs(tickers, data, indicator_cache=None):
+    # everything the kernel needs that doesn't depend on the searched parameters, computed once.
+    # data is the multi-index frame or CompactBars; indicators come from indicator_cache if given.
+    # the bar and indicator code (and pandas with it) is only imported here, never by the workers
+    from tradingbot.compact import bar_arrays
+    from tradingbot.scoring import generate_trade_signals_batch
+
+    arrays = bar_arrays(data, tickers, indicator_cache)
+    indicators = arrays['indicators']
+    return {
+        'timestamps': arrays['timestamps'],
+        'close': arrays['close'],
+        'atr': indicators.in_source_order('atr').astype(np.float64),
+        'signals': generate_trade_signals_batch(indicators.as_columns(source_order=True))
+    }
+
+
+def score(metrics):
+    # same objective optimization.py has always used, negated because the optimizers minimize
+    if metrics is None:
+        return 0.0
+    return -(metrics['sharpe_ratio'] + 0.5 * metrics['final_value'] - 0.5 * metrics['volatility'])
+
+
+def evaluate(inputs, point, initial_balance=10000, start=50):
+    params = dict(zip(PARAMETER_NAMES, point))
+    result = simulate(
+        inputs['close'],
+        inputs['atr'],
+        inputs['signals'],
+        start=start,
+        initial_balance=initial_balance,
+        stop_loss_percent=params['stop_loss_percent'],
+        take_profit_percent=params['take_profit_percent'],
+        cooling_off_period=params['cooling_off_period'],
+        max_loss_count=params['max_loss_count'],
+        history_capacity=0
+    )
+    # only the running stats are needed, so no equity history is kept
+    return simulate_metrics(result).metrics(initial_balance)
+
+
+def _init_worker(spec, instrument_spec=None, store_spec=None):
+    global _worker_segments, _worker_inputs, _worker_store, _worker_fingerprint
+    _worker_segments, _worker_inputs = attach_arrays(spec)
+    instrument.init_worker(instrument_spec)
+    if store_spec is not None:
+        _worker_store = ResultStore.from_spec(store_spec['store'])
+        _worker_fingerprint = store_spec['fingerprint']
+
+
+def _evaluate_in_worker(point):
+    metrics = evaluate(_worker_inputs, point, **EVALUATION_SETTINGS)
+    # each worker writes its own results, so nothing is lost if the parent dies mid-batch
+    if _worker_store is not None:
+        _worker_store.put(_worker_fingerprint, point, metrics)
+    instrument.flush()
+    return score(metrics)
+
+
+def _evaluate_batch(pool, batch, space, store, data_fingerprint, chunksize=1):
+    # the points as evaluated and their scores, in order, plus how many came from the store. with a
+    # store the points are rounded to their canonical form first, and only points nobody has
+    # evaluated before (and only once each) go to the pool
+    if store is None:
+        return batch, list(pool.map(_evaluate_in_worker, batch, chunksize=chunksize)), 0
+
+    points = [canonical_point(point, space, store.decimals) for point in batch]
+    known = {name: score(metrics) for name, metrics in store.get_many(data_fingerprint, points).items()}
+    pending = {}
+    for point in points:
+        name = key(point)
+        if name not in known:
+            pending.setdefault(name, point)
+    known.update(zip(pending, pool.map(_evaluate_in_worker, pending.values(), chunksize=chunksize)))
+    instrument.count('result_store_hits', len(points) - len(pending))
+    return points, [known[key(point)] for point in points], len(points) - len(pending)
+
+
+def _warm_start(optimizer, store, data_fingerprint):
+    # stored results for these inputs that fall inside the search space, best MAX_WARM_START of them
+    history = [(point, score(metrics)) for point, metrics in store.history(data_fingerprint)]
+    history = [(point, value) for point, value in history if point in optimizer.space]
+    history = sorted(history, key=lambda result: result[1])[:MAX_WARM_START]
+    if history:
+        optimizer.tell([point for point, _ in history], [value for _, value in history])
+    return [point for point, _ in history], [value for _, value in history]
+
+
+def grid_points(space, points_per_dimension=5):
+    # evenly spaced values per dimension. integer dimensions collapse duplicate values
+    axes = []
+    for dimension in space:
+        low, high = dimension.bounds
+        values = np.linspace(low, high, points_per_dimension)
+        if np.issubdtype(type(low), np.integer):
+            values = np.unique(np.round(values).astype(int))
+        axes.append(values.tolist())
+    return [list(point) for point in itertools.product(*axes)]
+
+
+def optimize(inputs, mode='bayes', space=None, n_calls=100, n_points=None, n_jobs=None,
+             random_state=48, points_per_dimension=5, verbose=True, store=None, warm_start=True):
+    # evaluate candidate points in batches on a process pool. the inputs are published to shared
+    # memory once; each task only ships a parameter tuple out and a float back. with a ResultStore,
+    # points evaluated before on the same inputs (in this run or any earlier one) are read back
+    # instead of rerun, and bayes mode starts from the stored results when warm_start is set
+    space = space or default_search_space()
+    n_jobs = n_jobs or os.cpu_count() or 1
+    n_points = n_points or n_jobs
+
+    data_fingerprint = None if store is None else fingerprint(inputs, **EVALUATION_SETTINGS)
+    store_spec = None if store is None else {'store': store.spec(), 'fingerprint': data_fingerprint}
+
+    segments, spec = publish_arrays(inputs)
+    instrument_spec = instrument.worker_spec()
+    xs, ys = [], []
+    hits = 0
+    try:
+        # spawn rather than fork, as in walk-forward: a parent that has already run a parallel sweep
+        # leaves numba's thread pool in a state forked workers can't exit from
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=n_jobs, mp_context=context, initializer=_init_worker,
+                                 initargs=(spec, instrument_spec, store_spec)) as pool:
+            if mode == 'bayes':
+                from skopt import Optimizer
+
+                optimizer = Optimizer(space, base_estimator='GP', random_state=random_state)
+                if store is not None and warm_start:
+                    xs, ys = _warm_start(optimizer, store, data_fingerprint)
+                    if verbose and xs:
+                        print(f"[SYSTEM]: WARM START FROM {len(xs)} STORED RESULTS, BEST {min(ys):.4f}")
+
+                asked = 0
+                while asked < n_calls:
+                    batch = optimizer.ask(n_points=min(n_points, n_calls - asked))
+                    points, values, batch_hits = _evaluate_batch(pool, batch, space, store, data_fingerprint)
+                    optimizer.tell(batch, values)
+                    asked += len(batch)
+                    hits += batch_hits
+                    xs.extend(points)
+                    ys.extend(values)
+                    if verbose:
+                        print(f"[SYSTEM]: EVALUATED {asked}/{n_calls} POINTS, BEST {min(ys):.4f}")
+
+            elif mode in ('random', 'grid'):
+                if mode == 'random':
+                    from skopt.space import Space
+
+                    batch = Space(space).rvs(n_samples=n_calls, random_state=random_state)
+                else:
+                    batch = grid_points(space, points_per_dimension)
+
+                chunksize = max(1, len(batch) // (n_jobs * 4))
+                points, values, hits = _evaluate_batch(pool, batch, space, store, data_fingerprint, chunksize)
+                xs.extend(points)
+                ys.extend(values)
+                if verbose:
+                    print(f"[SYSTEM]: EVALUATED {len(xs)} POINTS, BEST {min(ys):.4f}")
+
+            else:
+                raise ValueError(f"UNKNOWN SEARCH MODE: {mode}")
+    finally:
+        release_arrays(segments)
+        instrument.collect_workers(instrument_spec)
+
+    if verbose and store is not None:
+        print(f"[SYSTEM]: {hits} POINTS SERVED FROM THE RESULT STORE")
+
+    best = int(np.argmin(ys))
+    return {
+        'x': xs[best],
+        'fun': ys[best],
+        'x_iters': xs,
+        'func_vals': np.asarray(ys)
+    }
@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+
+import asyncio
+import math
+import time
+import sqlite3 as sq3
+import numpy as np
+from collections import deque, namedtuple
+from tradingbot.scoring import generate_trade_signal
+from tradingbot.streaming import IndicatorBank
+from tradingbot.utils import calculate_position_size
+
+# one hourly bar as it arrives. timestamp is epoch seconds (the dataloader Timestamp column),
+# received is the perf_counter() reading when the source emitted it
+Bar = namedtuple('Bar', ['ticker', 'timestamp', 'open', 'high', 'low', 'close', 'volume', 'received'])
+
+LATENCY_PERCENTILES = (50, 90, 99)
+
+
+class LatencyHistogram:
+    # latencies (seconds) counted in log-spaced buckets instead of kept one by one, so a daemon
+    # running for weeks over thousands of tickers holds a fixed few kilobytes. percentiles come
+    # out within `precision` (relative) of the exact ones; the count and maximum are exact
+    def __init__(self, smallest=1e-6, largest=100.0, precision=0.01):
+        self.smallest = smallest
+        self.log_ratio = math.log1p(2 * precision)
+        self.counts = np.zeros(int(math.ceil(math.log(largest / smallest) / self.log_ratio)) + 1, dtype=np.int64)
+        self.count = 0
+        self.max = 0.0
+
+    def __len__(self):
+        return self.count
+
+    def add(self, value):
+        bucket = int(math.log(value / self.smallest) / self.log_ratio) if value > self.smallest else 0
+        self.counts[min(bucket, len(self.counts) - 1)] += 1
+        self.count += 1
+        self.max = max(self.max, value)
+
+    def percentiles(self, percentiles):
+        if self.count == 0:
+            return np.full(len(percentiles), np.nan)
+        ranks = np.maximum(np.ceil(np.asarray(percentiles) / 100 * self.count), 1)
+        buckets = np.searchsorted(np.cumsum(self.counts), ranks)
+        # the geometric middle of each bucket, never above the largest latency seen
+        return np.minimum(self.smallest * np.exp((buckets + 0.5) * self.log_ratio), self.max)
+
+
+class BarSource:
+    # a subscription to bar updates. bars() is an async iterator yielding Bar tuples in time order
+    name = "source"
+
+    def bars(self):
+        raise NotImplementedError
+
+
+class SQLiteReplaySource(BarSource):
+    # replays the dataloader table timestamp by timestamp. speed is simulated seconds per real second
+    # (3600 plays one hourly bar per second); None replays as fast as the consumers keep up
+    name = "sqlite-replay"
+
+    def __init__(self, tickers=None, db_path=None, start=None, end=None, speed=None, fetch_size=10000):
+        self.tickers = None if tickers is None else list(tickers)
+        self.db_path = db_path
+        self.start = start
+        self.end = end
+        self.speed = speed
+        self.fetch_size = fetch_size
+
+    def _query(self):
+        from tradingbot.dataloader import MAX_QUERY_TICKERS, to_epoch
+
+        query = "SELECT Ticker, Timestamp, Open, High, Low, Close, Volume FROM dataloader WHERE 1 = 1"
+        params = []
+        # long universes are filtered while reading instead of binding thousands of parameters
+        if self.tickers is not None and len(self.tickers) <= MAX_QUERY_TICKERS:
+            query += f" AND Ticker IN ({','.join('?' * len(self.tickers))})"
+            params += self.tickers
+        if self.start is not None:
+            query += " AND Timestamp >= ?"
+            params.append(int(to_epoch([self.start])[0]))
+        if self.end is not None:
+            query += " AND Timestamp <= ?"
+            params.append(int(to_epoch([self.end])[0]))
+        return query + " ORDER BY Timestamp, Ticker;", params
+
+    async def bars(self):
+        from tradingbot.dataloader import DB_PATH
+
+        # the cursor is read from worker threads so the event loop keeps serving the ticker tasks
+        con = sq3.connect(self.db_path or DB_PATH, check_same_thread=False)
+        wanted = None if self.tickers is None else set(self.tickers)
+        try:
+            cursor = con.execute(*self._query())
+            previous = None
+            while True:
+                rows = await asyncio.to_thread(cursor.fetchmany, self.fetch_size)
+                if not rows:
+                    break
+                for ticker, timestamp, open_, high, low, close, volume in rows:
+                    if wanted is not None and ticker not in wanted:
+                        continue
+                    if timestamp != previous:
+                        if self.speed and previous is not None:
+                            await asyncio.sleep((timestamp - previous) / self.speed)
+                        previous = timestamp
+                    yield Bar(ticker, timestamp, open_, high, low, close, volume, time.perf_counter())
+        finally:
+            con.close()
+
+
+class PaperBroker:
+    # simulated fills with the same slippage, commission, sizing and exit rules as process_ticker_data,
+    # with one position and one cooling off counter per ticker sharing a single balance. like the
+    # backtest kernel, an exit below the entry price (costs included) counts as a loss, and once
+    # max_loss_count losses are taken no new positions are opened (0 disables the limit)
+    def __init__(self, initial_balance=10000, stop_loss_percent=0.1356, take_profit_percent=0.1954,
+                 commission_percent=0.005, slippage_percent=0.002, cooling_off_period=18, risk_percent=0.02,
+                 max_loss_count=15, max_fills=10000, fill_log=None):
+        self.balance = initial_balance
+        self.savings = 0
+        self.stop_loss_percent = stop_loss_percent
+        self.take_profit_percent = take_profit_percent
+        self.commission_percent = commission_percent
+        self.slippage_percent = slippage_percent
+        self.cooling_off_period = cooling_off_period
+        self.risk_percent = risk_percent
+        self.max_loss_count = max_loss_count
+        self.loss_count = 0
+
+        self.positions = {}
+        self.cooling_off_counter = {}
+        self.last_price = {}
+
+        # the most recent max_fills fills stay in memory. with fill_log (a path) every fill is also
+        # appended there as a csv line, so the full record survives without growing the process
+        self.fills = deque(maxlen=max_fills)
+        self.fill_count = 0
+        self.fill_log = fill_log
+
+    def on_bar(self, ticker, timestamp, close, atr, signal):
+        self.last_price[ticker] = close
+
+        # cooling off period logic (no trades for this ticker while it runs)
+        counter = self.cooling_off_counter.get(ticker, 0)
+        if counter > 0:
+            self.cooling_off_counter[ticker] = counter - 1
+            return None
+
+        position = self.positions.get(ticker)
+
+        # buying logic: if no position and signal is "BUY", and the loss limit isn't reached
+        if position is None and signal == "BUY" and (self.max_loss_count <= 0 or self.loss_count < self.max_loss_count):
+            # apply slippage and commission to the position price
+            position_price = close * (1 + self.slippage_percent / 100)
+            position_price = position_price * (1 + self.commission_percent / 100)
+            shares = calculate_position_size(self.balance, position_price, self.stop_loss_percent,
+                                             risk_percent=self.risk_percent)
+
+            self.positions[ticker] = (shares, position_price)
+            self.balance -= shares * position_price
+            self.cooling_off_counter[ticker] = self.cooling_off_period
+            return self._fill(ticker, timestamp, "BUY", shares, position_price)
+
+        # selling logic: take-profit, stop-loss, then SELL signal
+        if position is not None:
+            shares, position_price = position
+            if close >= position_price + (self.take_profit_percent * atr):
+                self.balance += shares * close * 0.5
+                self.savings += shares * close * 0.5
+            elif close <= position_price - (self.stop_loss_percent * atr):
+                self.balance += shares * close * 0.5
+                self.savings += shares * close * 0.5
+            elif signal == "SELL":
+                self.balance += shares * close
+                self.savings += shares * close * 0.5
+            else:
+                return None
+            del self.positions[ticker]
+
+            # an exit below the entry price counts towards the loss limit
+            if close < position_price:
+                self.loss_count += 1
+            return self._fill(ticker, timestamp, "SELL", shares, close)
+
+        return None
+
+    def _fill(self, ticker, timestamp, side, shares, price):
+        fill = (ticker, timestamp, side, int(shares), float(price))
+        self.fills.append(fill)
+        self.fill_count += 1
+        if self.fill_log is not None:
+            with open(self.fill_log, 'a') as file:
+                file.write(",".join(map(str, fill)) + "\n")
+        return fill
+
+    def value(self):
+        held = sum(shares * self.last_price[ticker] for ticker, (shares, _) in self.positions.items())
+        return self.balance + self.savings + held
+
+
+class PaperTrader:
+    # bars fan out from the source to one asyncio task per ticker through bounded queues. a ticker
+    # whose task falls behind fills its queue and stalls the dispatcher (backpressure) instead of
+    # buffering without limit. each task updates that ticker's indicators incrementally, scores the
+    # bar and routes the decision to the broker
+    def __init__(self, source, broker=None, bank=None, queue_size=64, warmup=50, buy_threshold=3, sell_threshold=3):
+        self.source = source
+        self.broker = broker or PaperBroker()
+        self.bank = bank or IndicatorBank()
+        self.queue_size = queue_size
+        self.warmup = warmup
+        self.buy_threshold = buy_threshold
+        self.sell_threshold = sell_threshold
+
+        self.queues = {}
+        self.tasks = {}
+        self.latencies = LatencyHistogram()
+        self.bars = 0
+        self.max_backlog = 0
+
+    async def _consume(self, ticker, queue):
+        while True:
+            bar = await queue.get()
+            if bar is None:
+                break
+
+            indicators = self.bank.update(ticker, bar.high, bar.low, bar.close, bar.volume)
+            if self.bank[ticker].count >= self.warmup:
+                signal = generate_trade_signal(indicators, self.buy_threshold, self.sell_threshold)
+                self.broker.on_bar(ticker, bar.timestamp, bar.close, indicators['atr'], signal)
+            else:
+                self.broker.last_price[ticker] = bar.close
+
+            # bar-to-decision latency, including the time the bar waited in the queue
+            self.latencies.add(time.perf_counter() - bar.received)
+            self.bars += 1
+
+    def _queue_for(self, ticker):
+        queue = self.queues.get(ticker)
+        if queue is None:
+            queue = self.queues[ticker] = asyncio.Queue(maxsize=self.queue_size)
+            self.tasks[ticker] = asyncio.create_task(self._consume(ticker, queue))
+        return queue
+
+    async def run(self):
+        started = time.perf_counter()
+        async for bar in self.source.bars():
+            queue = self._queue_for(bar.ticker)
+            self.max_backlog = max(self.max_backlog, queue.qsize())
+            await queue.put(bar)
+
+        # drain every ticker, then stop its task
+        for queue in self.queues.values():
+            await queue.put(None)
+        await asyncio.gather(*self.tasks.values())
+        return self.report(time.perf_counter() - started)
+
+    def report(self, elapsed):
+        report = {
+            'bars': self.bars,
+            'tickers': len(self.tasks),
+            'elapsed': elapsed,
+            'bars_per_second': self.bars / elapsed if elapsed > 0 else np.nan,
+            'max_backlog': self.max_backlog,
+            'fills': self.broker.fill_count,
+            'final_value': self.broker.value(),
+            'savings': self.broker.savings
+        }
+        percentiles = self.latencies.percentiles(LATENCY_PERCENTILES) * 1000
+        for q, value in zip(LATENCY_PERCENTILES, percentiles):
+            report[f'latency_p{q}_ms'] = float(value)
+        report['latency_max_ms'] = self.latencies.max * 1000 if len(self.latencies) else np.nan
+        return report
+
+
+def run_paper_trading(source, broker=None, bank=None, queue_size=64, warmup=50, verbose=True):
+    trader = PaperTrader(source, broker, bank, queue_size, warmup)
+    report = asyncio.run(trader.run())
+
+    if verbose:
+        print(f"[SYSTEM]: {report['bars']:,} BARS FOR {report['tickers']} TICKERS IN {report['elapsed']:,.2f}s "
+              f"({report['bars_per_second']:,.0f} BARS/s), {report['fills']} FILLS")
+        print(f"[SYSTEM]: BAR-TO-DECISION LATENCY P50 {report['latency_p50_ms']:.3f}ms, "
+              f"P90 {report['latency_p90_ms']:.3f}ms, P99 {report['latency_p99_ms']:.3f}ms, "
+              f"MAX {report['latency_max_ms']:.3f}ms")
+        print(f"[SYSTEM]: FINAL VALUE: ${report['final_value']:,.2f}")
+        print(f"[SYSTEM]: FINAL SAVINGS: ${report['savings']:,.2f}")
+
+    return report, trader
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+
+import numpy as np
+import pandas as pd
+from tradingbot import instrument
+from tradingbot.indicators import precompute_indicators
+from tradingbot.compact import CompactBars
+from tradingbot.recorder import EquityRecorder, MetricsAccumulator
+from tradingbot.risk import RollingCorrelation, CorrelationFilter
+from tradingbot.scoring import generate_trade_signals_batch, BUY, SELL
+
+
+def build_panel(data, indicators=None, indicator_cache=None):
+    # lay the bars out as (timestamp, ticker) arrays so each timestamp is one row for the whole
+    # universe. bars a ticker doesn't have are NaN (close/atr) or HOLD (signals). data is the
+    # multi-index frame or CompactBars, whose rows are already in matrix order
+    compact = isinstance(data, CompactBars)
+    if indicators is None:
+        indicators = data.indicator_matrix(cache=indicator_cache) if compact else precompute_indicators(data, cache=indicator_cache)
+
+    times, time_codes = np.unique(indicators.timestamps, return_inverse=True)
+    ticker_codes = np.repeat(np.arange(len(indicators.tickers)), np.diff(indicators.offsets))
+    shape = (len(times), len(indicators.tickers))
+
+    close = np.full(shape, np.nan)
+    if compact:
+        close[time_codes, ticker_codes] = data.column('Close')
+    else:
+        close[time_codes, ticker_codes] = data['Close'].to_numpy(dtype=np.float64)[indicators.source_index]
+    atr = np.full(shape, np.nan)
+    atr[time_codes, ticker_codes] = indicators.column('atr')
+    signals = np.zeros(shape, dtype=np.int8)
+    signals[time_codes, ticker_codes] = generate_trade_signals_batch(indicators.as_columns())
+
+    return {
+        'timestamps': pd.to_datetime(times),
+        'tickers': list(indicators.tickers),
+        'close': close,
+        'atr': atr,
+        'signals': signals
+    }
+
+
+def run_portfolio(close, atr, signals, initial_balance=10000, stop_loss_percent=0.1356, take_profit_percent=0.1954,
+                  commission_percent=0.005, slippage_percent=0.002, max_loss_count=15, cooling_off_period=18,
+                  risk_percent=0.02, max_shares=100, correlation_threshold=None, correlation_window=120,
+                  correlation_mode='block', timestamps=None, history_capacity=None, spill_path=None):
+    # every array is (timestamps, tickers). each timestamp is handled as one cross-sectional batch:
+    # exits, then entries, then a single mark-to-market of the whole book. the marks go into an
+    # EquityRecorder (bounded by history_capacity/spill_path, as in backtest_rowwise) keyed by
+    # timestamps (int64 ns, default the step number) and a MetricsAccumulator.
+    # with a correlation_threshold, entries that move with current holdings (rolling correlation of
+    # bar returns over correlation_window bars) are blocked or scaled down, see tradingbot.risk
+    steps, count = close.shape
+    balance = float(initial_balance)
+    savings = 0.0
+
+    # per-ticker state
+    shares = np.zeros(count)
+    entry_price = np.zeros(count)
+    holding = np.zeros(count, dtype=np.bool_)
+    cooling_off_counter = np.zeros(count, dtype=np.int64)
+    loss_count = np.zeros(count, dtype=np.int64)
+    last_price = np.full(count, np.nan)
+
+    recorder = EquityRecorder(history_capacity, spill_path)
+    metrics = MetricsAccumulator()
+
+    correlation_filter = None
+    if correlation_threshold is not None:
+        correlation = RollingCorrelation(range(count), correlation_window)
+        correlation_filter = CorrelationFilter(correlation, correlation_threshold, correlation_mode)
+
+    for t in range(steps):
+        price = close[t]
+        if correlation_filter is not None:
+            correlation.update_prices(price)
+        tradable = np.isfinite(price)
+        last_price = np.where(tradable, price, last_price)
+
+        # cooling off period logic (no trades for a ticker while its counter runs)
+        cooling = tradable & (cooling_off_counter > 0)
+        cooling_off_counter[cooling] -= 1
+        active = tradable & ~cooling
+
+        # exits: take-profit, stop-loss, then SELL signal. proceeds are split between balance and savings
+        open_positions = active & holding
+        take_profit = open_positions & (price >= entry_price + take_profit_percent * atr[t])
+        stop_loss = open_positions & (price <= entry_price - stop_loss_percent * atr[t])
+        exits = take_profit | stop_loss | (open_positions & (signals[t] == SELL))
+        if exits.any():
+            proceeds = shares[exits] * price[exits]
+            balance += proceeds.sum() * 0.5
+            savings += proceeds.sum() * 0.5
+            loss_count[exits] += price[exits] < entry_price[exits]
+            shares[exits] = 0.0
+            holding[exits] = False
+            metrics.record_trade(int(exits.sum()))
+
+        # entries: BUY signal on a flat ticker that hasn't hit its loss limit
+        candidates = active & ~holding & (signals[t] == BUY)
+        if max_loss_count > 0:
+            candidates &= loss_count < max_loss_count
+        if candidates.any():
+            index = np.flatnonzero(candidates)
+
+            # apply slippage and commission to the position price
+            cost = price[index] * (1 + slippage_percent / 100) * (1 + commission_percent / 100)
+
+            # size every entry off the balance at the start of the timestamp, like calculate_position_size
+            with np.errstate(divide='ignore', invalid='ignore'):
+                size = np.trunc(balance * risk_percent / (stop_loss_percent * cost))
+            size = np.clip(np.nan_to_num(size, nan=0.0, posinf=max_shares), 0, max_shares)
+
+            # drop or shrink entries correlated with the book
+            if correlation_filter is not None:
+                exposure = correlation_filter.scale_batch(index, np.flatnonzero(holding))
+                keep = exposure > 0
+                index, cost, size = index[keep], cost[keep], np.trunc(size[keep] * exposure[keep])
+
+            # fill in ticker order while the balance covers it
+            affordable = np.cumsum(size * cost) <= balance
+            index, cost, size = index[affordable], cost[affordable], size[affordable]
+
+            shares[index] = size
+            entry_price[index] = cost
+            holding[index] = True
+            balance -= float(np.sum(size * cost))
+            cooling_off_counter[index] = cooling_off_period
+            metrics.record_trade(len(index))
+
+        # mark to market once per timestamp, using each ticker's last known price. at the last
+        # timestamp what is left is liquidated at those prices, so final value and returns are net
+        # of the exit commission
+        held = holding & np.isfinite(last_price)
+        marked = float(np.sum(shares[held] * last_price[held]))
+        if t == steps - 1:
+            marked *= 1 - commission_percent / 100
+        value = balance + savings + marked
+        recorder.append(t if timestamps is None else int(timestamps[t]), balance, savings,
+                        float(shares[held].sum()) if held.any() else None, value)
+        metrics.update(value)
+
+    held = holding & np.isfinite(last_price)
+    liquidation = float(np.sum(shares[held] * last_price[held])) * (1 - commission_percent / 100)
+
+    return {
+        'history': recorder,
+        'metrics': metrics,
+        'balance': balance + liquidation,
+        'savings': savings,
+        'shares': shares,
+        'loss_count': loss_count,
+        'trades': metrics.trades
+    }
+
+
+def backtest_portfolio(tickers, data, initial_balance=10000, stop_loss_percent=0.1356, take_profit_percent=0.1954,
+                       commission_percent=0.005, slippage_percent=0.002, max_loss_count=15, cooling_off_period=18,
+                       correlation_threshold=None, correlation_window=120, correlation_mode='block', plot=False,
+                       indicator_cache=None, history_capacity=None, spill_path=None, return_history=False):
+    # with history_capacity the recorder keeps a bounded history (a ring, or spilled to spill_path)
+    # and the report comes from the running stats; the history is only read back when asked for
+    from tradingbot.backtest import summarize_backtest, summarize_accumulated
+
+    panel = build_panel(data, indicator_cache=indicator_cache)
+    with instrument.stage('portfolio_loop', rows=panel['close'].size):
+        result = run_portfolio(
+            panel['close'],
+            panel['atr'],
+            panel['signals'],
+            initial_balance=initial_balance,
+            stop_loss_percent=stop_loss_percent,
+            take_profit_percent=take_profit_percent,
+            commission_percent=commission_percent,
+            slippage_percent=slippage_percent,
+            max_loss_count=max_loss_count,
+            cooling_off_period=cooling_off_period,
+            correlation_threshold=correlation_threshold,
+            correlation_window=correlation_window,
+            correlation_mode=correlation_mode,
+            timestamps=panel['timestamps'].asi8,
+            history_capacity=history_capacity,
+            spill_path=spill_path
+        )
+
+    print(f"[SYSTEM]: {result['trades']} TRADES ACROSS {len(panel['tickers'])} TICKERS.")
+    if history_capacity is not None:
+        history = result['history'].to_frame()['portfolio_value'] if return_history or plot else None
+        return summarize_accumulated(result['metrics'], result['savings'], initial_balance, history, plot=plot)
+    portfolio_value = result['history'].to_frame()['portfolio_value']
+    return summarize_backtest(portfolio_value, result['savings'], initial_balance, result['metrics'], plot=plot)
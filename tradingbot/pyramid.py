@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+
+import numpy as np
+import pandas as pd
+from tradingbot import instrument
+from tradingbot.compact import CompactBars, PRICE_COLUMNS
+from tradingbot.dataloader import ensure_schema, get_trading_hours, to_epoch, ticker_chunks
+
+# coarser levels built over the hourly bars: (bucket length, offset) in seconds. a bucket is
+# [offset + k * length, offset + (k + 1) * length); weeks are offset to start on monday, the
+# epoch being a thursday
+LEVELS = {
+    '4h': (4 * 3600, 0),
+    '1d': (24 * 3600, 0),
+    '1w': (7 * 24 * 3600, 4 * 24 * 3600),
+}
+
+BASE_LEVEL = '1h'
+
+ROLLUP_SCHEMA = """
+CREATE TABLE IF NOT EXISTS bar_rollups (
+    Level TEXT NOT NULL,
+    Ticker TEXT NOT NULL,
+    Timestamp INTEGER NOT NULL,
+    Open REAL,
+    High REAL,
+    Low REAL,
+    Close REAL,
+    Volume INTEGER,
+    Bars INTEGER NOT NULL,
+    LastTimestamp INTEGER NOT NULL,
+    PRIMARY KEY (Level, Ticker, Timestamp)
+) WITHOUT ROWID;
+"""
+
+# ticker codes and epoch seconds packed into one sortable int64 key
+_CODE_SHIFT = 1 << 40
+
+
+def bucket_start(seconds, level):
+    length, offset = LEVELS[level]
+    return (np.asarray(seconds, dtype=np.int64) - offset) // length * length + offset
+
+
+def rollup(codes, seconds, columns, level):
+    # aggregate ticker-major, time-ascending bars into level buckets: first open, highest high,
+    # lowest low, last close, summed volume, plus how many bars went in and the last one's time
+    seconds = np.asarray(seconds, dtype=np.int64)
+    buckets = bucket_start(seconds, level)
+    n = len(seconds)
+    if n == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return {'codes': empty, 'Timestamp': empty, 'Bars': empty, 'LastTimestamp': empty,
+                **{name: np.empty(0) for name in PRICE_COLUMNS + ('Volume',)}}
+
+    new = np.ones(n, dtype=np.bool_)
+    new[1:] = (codes[1:] != codes[:-1]) | (buckets[1:] != buckets[:-1])
+    starts = np.flatnonzero(new)
+    ends = np.append(starts[1:], n) - 1
+    return {
+        'codes': np.asarray(codes)[starts],
+        'Timestamp': buckets[starts],
+        'Open': np.asarray(columns['Open'])[starts],
+        'High': np.maximum.reduceat(np.asarray(columns['High']), starts),
+        'Low': np.minimum.reduceat(np.asarray(columns['Low']), starts),
+        'Close': np.asarray(columns['Close'])[ends],
+        'Volume': np.add.reduceat(np.asarray(columns['Volume'], dtype=np.float64), starts),
+        'Bars': ends - starts + 1,
+        'LastTimestamp': seconds[ends]
+    }
+
+
+def ensure_rollup_schema(con):
+    ensure_schema(con)
+    exists = con.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'bar_rollups';").fetchone()
+    with con:
+        con.execute(ROLLUP_SCHEMA)
+        if not exists:
+            # first build: everything already loaded counts as pending
+            con.execute("""
+            INSERT INTO rollup_pending (Ticker, First, Last)
+            SELECT Ticker, MIN(Timestamp), MAX(Timestamp) FROM dataloader GROUP BY Ticker;
+            """)
+
+
+def update_rollups(con, levels=tuple(LEVELS)):
+    # rebuild the buckets that bars written since the last update fall in, at every level, and
+    # clear the pending ranges in the same transaction. returns the number of tickers updated
+    ensure_rollup_schema(con)
+    with instrument.stage('update_rollups') as stage, con:
+        con.execute("BEGIN IMMEDIATE;")
+        pending = con.execute("""
+        SELECT Ticker, MIN(First), MAX(Last) FROM rollup_pending GROUP BY Ticker ORDER BY Ticker;
+        """).fetchall()
+        if not pending:
+            return 0
+        print(f"[SYSTEM]: UPDATING BAR ROLLUPS FOR {len(pending)} TICKERS.")
+
+        for ticker, first, last in pending:
+            # whole buckets around the changed range, at the coarsest level that covers them
+            ranges = {level: (int(bucket_start(first, level)), int(bucket_start(last, level)) + LEVELS[level][0])
+                      for level in levels}
+            low = min(start for start, _ in ranges.values())
+            high = max(end for _, end in ranges.values())
+            rows = con.execute("""
+            SELECT Timestamp, Open, High, Low, Close, Volume FROM dataloader
+            WHERE Ticker = ? AND Timestamp >= ? AND Timestamp < ?
+            ORDER BY Timestamp;
+            """, (ticker, low, high)).fetchall()
+            stage.add(len(rows))
+            if rows:
+                seconds, *values = (np.asarray(column, dtype=np.float64) for column in zip(*rows))
+                seconds = seconds.astype(np.int64)
+                columns = dict(zip(PRICE_COLUMNS + ('Volume',), values))
+            else:
+                seconds, columns = np.empty(0, dtype=np.int64), {}
+
+            for level, (start, end) in ranges.items():
+                con.execute("""
+                DELETE FROM bar_rollups WHERE Level = ? AND Ticker = ? AND Timestamp >= ? AND Timestamp < ?;
+                """, (level, ticker, start, end))
+                if not len(seconds):
+                    continue
+                bars = rollup(np.zeros(len(seconds), dtype=np.int64), seconds, columns, level)
+                keep = (bars['Timestamp'] >= start) & (bars['Timestamp'] < end)
+                con.executemany("""
+                INSERT INTO bar_rollups (Level, Ticker, Timestamp, Open, High, Low, Close, Volume, Bars, LastTimestamp)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
+                """, zip(
+                    [level] * int(keep.sum()), [ticker] * int(keep.sum()),
+                    bars['Timestamp'][keep].tolist(),
+                    *(bars[name][keep].tolist() for name in PRICE_COLUMNS),
+                    np.round(bars['Volume'][keep]).astype(np.int64).tolist(),
+                    bars['Bars'][keep].tolist(),
+                    bars['LastTimestamp'][keep].tolist()
+                ))
+
+        con.execute("DELETE FROM rollup_pending;")
+    return len(pending)
+
+
+def _level_bars(codes, seconds, columns, tickers):
+    # rollup output -> CompactBars with the tickers that have any buckets
+    counts = np.bincount(codes, minlength=len(tickers)) if len(codes) else np.zeros(len(tickers), dtype=np.int64)
+    present = [ticker for ticker, count in zip(tickers, counts) if count > 0]
+    return CompactBars(
+        present,
+        np.concatenate(([0], np.cumsum(counts[counts > 0]))),
+        np.asarray(seconds, dtype=np.int64) // 3600,
+        columns,
+        columns['Volume']
+    )
+
+
+class BarPyramid:
+    # the hourly bars plus coarser rollups of them, every level a CompactBars (ticker-major,
+    # time-ascending), so anything that takes CompactBars, the indicators included, runs on any level.
+    # completed_index() maps each hourly bar to the latest coarse bar that had fully closed by then.
+    # last holds, per level, the epoch seconds of the last hourly bar in each coarse row
+    def __init__(self, hourly, levels, last):
+        self.levels = {BASE_LEVEL: hourly, **levels}
+        self.last = dict(last)
+        self._completed = {}
+
+    @property
+    def hourly(self):
+        return self.levels[BASE_LEVEL]
+
+    def __getitem__(self, level):
+        return self.levels[level]
+
+    def bucket_closes(self, level):
+        # bucket starts and the time of each bucket's last hourly bar, from the trading calendar
+        # merged with the bars actually present. a bar off the calendar only ever pushes a close
+        # later, never earlier, so a bucket is never taken as finished while it can still change
+        hours = self.hourly.hours * 3600
+        if len(hours) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        first = pd.Timestamp(int(hours.min()), unit='s').normalize()
+        last = pd.Timestamp(int(hours.max()), unit='s').normalize() + pd.Timedelta(days=8)
+        schedule = to_epoch(get_trading_hours(first, last))
+        hours = np.union1d(schedule, hours)
+
+        buckets = bucket_start(hours, level)
+        ends = np.append(np.flatnonzero(buckets[1:] != buckets[:-1]), len(hours) - 1)
+        return buckets[ends], hours[ends]
+
+    def completed_index(self, level):
+        # for every hourly row (compact order), the row in level of the latest bucket whose last
+        # scheduled hour is at or before that bar, -1 where there is none. acting on an hourly bar's
+        # close, that coarse bar is already final, so reading it is free of look-ahead
+        if level in self._completed:
+            return self._completed[level]
+
+        hourly, coarse = self.hourly, self.levels[level]
+        seconds = hourly.hours * 3600
+        bucket_starts, closes = self.bucket_closes(level)
+        finished = np.searchsorted(closes, seconds, side='right') - 1
+        completed = np.where(finished >= 0, bucket_starts[np.maximum(finished, 0)], -1)
+
+        # latest bucket of the same ticker at or before the completed one, through packed (code, time) keys
+        codes = hourly.ticker_codes().astype(np.int64)
+        coarse_codes = np.asarray([hourly.ticker_index[ticker] for ticker in coarse.tickers], dtype=np.int64)
+        coarse_codes = np.repeat(coarse_codes, np.diff(coarse.offsets))
+        keys = coarse_codes * _CODE_SHIFT + coarse.hours * 3600
+        index = np.searchsorted(keys, codes * _CODE_SHIFT + completed, side='right') - 1
+
+        # a stored row can hold bars from past the loaded range (the bucket straddles its end);
+        # it only counts once its own last bar is in, otherwise the ticker's previous bucket is used
+        late = (index >= 0) & (self.last[level][np.maximum(index, 0)] > seconds)
+        index[late] -= 1
+
+        valid = (index >= 0) & (completed >= 0)
+        valid[valid] = coarse_codes[index[valid]] == codes[valid]
+        index = np.where(valid, index, -1)
+
+        self._completed[level] = index
+        return index
+
+    def align(self, level, values):
+        # per-row values of level (1-D or 2-D) laid onto the hourly rows, NaN before a ticker's
+        # first completed coarse bar
+        index = self.completed_index(level)
+        values = np.asarray(values, dtype=np.float64)
+        aligned = values[np.maximum(index, 0)]
+        aligned[index < 0] = np.nan
+        return aligned
+
+    def indicator_matrix(self, level=BASE_LEVEL, dtype=np.float64):
+        return self.levels[level].indicator_matrix(dtype=dtype)
+
+    def aligned_indicators(self, level, dtype=np.float64):
+        # the level's indicator matrix, one row per hourly bar in hourly compact order
+        return self.align(level, self.indicator_matrix(level, dtype).values)
+
+
+def build_pyramid(data, levels=tuple(LEVELS)):
+    # a pyramid from bars already in memory (a multi-index frame or CompactBars), without the database
+    hourly = data if isinstance(data, CompactBars) else CompactBars.from_frame(data)
+    codes = hourly.ticker_codes()
+    seconds = hourly.hours * 3600
+    built, last = {}, {}
+    for level in levels:
+        bars = rollup(codes, seconds, hourly.columns, level)
+        built[level] = _level_bars(bars['codes'], bars['Timestamp'], bars, hourly.tickers)
+        last[level] = bars['LastTimestamp']
+    return BarPyramid(hourly, built, last)
+
+
+def load_pyramid(con, tickers, start, end, levels=tuple(LEVELS)):
+    # hourly bars in [start, end] and the stored rollups of every bucket that overlaps them,
+    # after applying any pending updates. reading is per row, so with the hourly bars already in
+    # memory build_pyramid() is quicker; the stored rollups are for whole buckets at the range edges
+    # and for reading a coarse level on its own
+    update_rollups(con)
+    hourly = CompactBars.from_db(con, tickers, start, end)
+    start, end = to_epoch([start, end])
+    # only tickers with hourly bars in range, every coarse row has to map back to one
+    tickers = hourly.tickers
+
+    built, last = {}, {}
+    for level in levels:
+        rows = []
+        for chunk in ticker_chunks(tickers):
+            placeholders = ",".join("?" * len(chunk))
+            rows.extend(con.execute(f"""
+            SELECT Ticker, Timestamp, Open, High, Low, Close, Volume, LastTimestamp FROM bar_rollups
+            WHERE Level = ? AND Ticker IN ({placeholders}) AND Timestamp BETWEEN ? AND ?
+            ORDER BY Ticker, Timestamp;
+            """, [level, *chunk, int(bucket_start(start, level)), int(end)]).fetchall())
+
+        index = {ticker: i for i, ticker in enumerate(tickers)}
+        ticker_column, seconds, *values, last_seconds = zip(*rows) if rows else ((),) * 8
+        codes = np.fromiter((index[ticker] for ticker in ticker_column), dtype=np.int64, count=len(rows))
+        columns = {name: np.asarray(column, dtype=np.float64) for name, column in zip(PRICE_COLUMNS + ('Volume',), values)}
+        built[level] = _level_bars(codes, seconds, columns, tickers)
+        last[level] = np.asarray(last_seconds, dtype=np.int64)
+    return BarPyramid(hourly, built, last)
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+
+import math
+import os
+import numpy as np
+import pandas as pd
+
+# one row of portfolio history. position is NaN while flat
+HISTORY_DTYPE = np.dtype([
+    ('timestamp', 'i8'),
+    ('balance', 'f8'),
+    ('savings', 'f8'),
+    ('position', 'f8'),
+    ('portfolio_value', 'f8')
+])
+
+
+class EquityRecorder:
+    # portfolio history in a preallocated structured array. with no capacity the buffer grows;
+    # with a capacity it either spills full buffers to spill_path, or (without a spill path)
+    # keeps only the most recent `capacity` rows as a ring, so memory stays bounded either way
+    __slots__ = ('capacity', 'spill_path', 'buffer', 'size', 'total', 'spilled')
+
+    def __init__(self, capacity=None, spill_path=None):
+        self.capacity = capacity
+        self.spill_path = spill_path
+        self.buffer = np.empty(capacity or 4096, dtype=HISTORY_DTYPE)
+        self.size = 0
+        self.total = 0
+        self.spilled = 0
+        if spill_path is not None and os.path.exists(spill_path):
+            os.remove(spill_path)
+
+    def __len__(self):
+        if self.capacity is not None and self.spill_path is None:
+            return min(self.total, self.capacity)
+        return self.total
+
+    def append(self, timestamp, balance, savings, position, portfolio_value):
+        if self.size == len(self.buffer):
+            if self.capacity is None:
+                self.buffer = np.resize(self.buffer, 2 * len(self.buffer))
+            elif self.spill_path is not None:
+                with open(self.spill_path, 'ab') as file:
+                    self.buffer.tofile(file)
+                self.spilled += self.size
+                self.size = 0
+
+        slot = self.size if self.capacity is None or self.spill_path is not None else self.total % len(self.buffer)
+        self.buffer[slot] = (timestamp, balance, savings, math.nan if position is None else position, portfolio_value)
+        self.size = min(self.size + 1, len(self.buffer))
+        self.total += 1
+
+    def to_array(self):
+        # every kept row in time order, as one in-memory array. with a spill file this reads the whole
+        # history back, so bounded backtests only call it when the caller asks for the history
+        if self.capacity is not None and self.spill_path is None and self.total > len(self.buffer):
+            start = self.total % len(self.buffer)
+            return np.concatenate((self.buffer[start:], self.buffer[:start]))
+
+        recent = self.buffer[:self.size]
+        if self.spilled:
+            spilled = np.memmap(self.spill_path, dtype=HISTORY_DTYPE, mode='r', shape=(self.spilled,))
+            return np.concatenate((spilled, recent))
+        return recent.copy()
+
+    def to_frame(self):
+        history = self.to_array()
+        frame = pd.DataFrame({name: history[name] for name in HISTORY_DTYPE.names if name != 'timestamp'})
+        frame.index = pd.to_datetime(history['timestamp']).rename('timestamp')
+        return frame
+
+
+class MetricsAccumulator:
+    # the stats equity_metrics reports, plus max drawdown and trade count, updated one
+    # portfolio value at a time without keeping the history
+    __slots__ = ('count', 'mean', 'm2', 'last_value', 'peak', 'max_drawdown', 'trades')
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.last_value = math.nan
+        self.peak = -math.inf
+        self.max_drawdown = 0.0
+        self.trades = 0
+
+    @classmethod
+    def from_state(cls, count, mean, m2, last_value, peak, max_drawdown, trades):
+        # an accumulator that has already seen a run, from stats kept elsewhere (the kernel's)
+        metrics = cls()
+        metrics.count = int(count)
+        metrics.mean = float(mean)
+        metrics.m2 = float(m2)
+        metrics.last_value = float(last_value)
+        metrics.peak = float(peak)
+        metrics.max_drawdown = float(max_drawdown)
+        metrics.trades = int(trades)
+        return metrics
+
+    def update(self, portfolio_value):
+        # returns are pct_change().dropna() over the recorded values
+        if not math.isnan(self.last_value) and self.last_value != 0:
+            change = portfolio_value / self.last_value - 1
+            if not math.isnan(change):
+                self.count += 1
+                delta = change - self.mean
+                self.mean += delta / self.count
+                self.m2 += delta * (change - self.mean)
+        self.last_value = portfolio_value
+
+        self.peak = max(self.peak, portfolio_value)
+        if self.peak > 0:
+            self.max_drawdown = max(self.max_drawdown, 1 - portfolio_value / self.peak)
+
+    def record_trade(self, count=1):
+        self.trades += count
+
+    def metrics(self, initial_balance=10000):
+        if self.count == 0:
+            return None
+
+        avg_return = self.mean
+        volatility = math.sqrt(self.m2 / self.count) / avg_return if avg_return != 0 else math.nan
+        sharpe = (avg_return - 0.005) / volatility if volatility > 0 else 0.0
+
+        return {
+            'final_value': self.last_value,
+            'total_return': self.last_value / initial_balance - 1,
+            'sharpe_ratio': sharpe,
+            'avg_return': avg_return,
+            'volatility': volatility,
+            'max_drawdown': self.max_drawdown,
+            'trades': self.trades
+        }
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+import hashlib
+import json
+import os
+import sqlite3 as sq3
+import time
+import numpy as np
+from tradingbot.kernel import STRATEGY_VERSION
+
+# one row per evaluated parameter vector. metrics is the JSON of the dict evaluate() returns
+# (null when the run recorded nothing); the score is derived from it on read, so changing the
+# objective doesn't invalidate anything
+RESULTS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS backtest_results (
+    fingerprint TEXT NOT NULL,
+    strategy_version INTEGER NOT NULL,
+    parameters TEXT NOT NULL,
+    metrics TEXT,
+    created REAL NOT NULL,
+    PRIMARY KEY (fingerprint, strategy_version, parameters)
+) WITHOUT ROWID;
+"""
+
+# SQLite caps the number of bound parameters, so long key lists are looked up in chunks
+MAX_QUERY_KEYS = 900
+
+# real-valued parameters are rounded to this many decimals before they're evaluated and keyed
+DEFAULT_DECIMALS = 4
+
+
+def results_path(db_path=None):
+    # a separate file beside the bar database, so optimizer writes never wait on the dataloader.
+    # imported here so optimizer workers opening the store don't load pandas with the dataloader
+    from tradingbot.dataloader import DB_PATH
+    return os.path.join(os.path.dirname(db_path or DB_PATH), 'results.db')
+
+
+def fingerprint(inputs, **settings):
+    # hash of the arrays a backtest reads plus the settings it runs with (initial balance, first
+    # bar, ...). any change to the bars, indicators or signals gives a new fingerprint
+    digest = hashlib.sha256()
+    for name in sorted(inputs):
+        values = np.ascontiguousarray(inputs[name])
+        digest.update(f'{name}:{values.dtype.str}:{values.shape};'.encode())
+        digest.update(memoryview(values).cast('B'))
+    digest.update(json.dumps(settings, sort_keys=True).encode())
+    return digest.hexdigest()[:32]
+
+
+def canonical_point(point, space, decimals=DEFAULT_DECIMALS):
+    # integer dimensions as ints, real ones rounded, so proposals that only differ below the
+    # rounding are the same configuration
+    canonical = []
+    for dimension, value in zip(space, point):
+        if np.issubdtype(type(dimension.bounds[0]), np.integer):
+            canonical.append(int(round(value)))
+        else:
+            canonical.append(round(float(value), decimals))
+    return canonical
+
+
+def key(point):
+    # the parameters column value for a (canonical) point
+    return json.dumps([int(value) if isinstance(value, (int, np.integer)) else float(value) for value in point])
+
+
+def _encode(metrics):
+    if metrics is None:
+        return None
+    return json.dumps({name: float(value) for name, value in metrics.items()})
+
+
+class ResultStore:
+    # memoized backtest metrics keyed by (data fingerprint, strategy version, parameters). every
+    # process opens its own connection; WAL lets readers run during writes, and each write is one
+    # short BEGIN IMMEDIATE transaction of INSERT OR IGNOREs, so workers racing on the same point
+    # queue for the lock and the first row written is kept
+    def __init__(self, path=None, version=STRATEGY_VERSION, decimals=DEFAULT_DECIMALS, timeout=60):
+        self.path = path or results_path()
+        self.version = version
+        self.decimals = decimals
+        self.timeout = timeout
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # autocommit: every statement is its own transaction and waits up to timeout for the write lock
+        self.con = sq3.connect(self.path, timeout=timeout, isolation_level=None)
+        self.con.execute("PRAGMA journal_mode=WAL;")
+        self.con.execute("PRAGMA synchronous=NORMAL;")
+        self.con.execute(RESULTS_SCHEMA)
+
+    def spec(self):
+        # enough to reopen the store in a worker process
+        return {'path': self.path, 'version': self.version, 'decimals': self.decimals, 'timeout': self.timeout}
+
+    @classmethod
+    def from_spec(cls, spec):
+        return cls(**spec)
+
+    def close(self):
+        self.con.close()
+
+    def get_many(self, fingerprint, points):
+        # {key(point): metrics} for the points already stored
+        keys = list({key(point) for point in points})
+        found = {}
+        for start in range(0, len(keys), MAX_QUERY_KEYS):
+            chunk = keys[start:start + MAX_QUERY_KEYS]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self.con.execute(f"""
+            SELECT parameters, metrics FROM backtest_results
+            WHERE fingerprint = ? AND strategy_version = ? AND parameters IN ({placeholders});
+            """, [fingerprint, self.version, *chunk])
+            for parameters, metrics in rows:
+                found[parameters] = None if metrics is None else json.loads(metrics)
+        return found
+
+    def put(self, fingerprint, point, metrics):
+        self.put_many(fingerprint, [(point, metrics)])
+
+    def put_many(self, fingerprint, results):
+        # results is [(point, metrics)]. one transaction; an already stored point keeps its row
+        rows = [(fingerprint, self.version, key(point), _encode(metrics), time.time()) for point, metrics in results]
+        with self.con:
+            self.con.execute("BEGIN IMMEDIATE;")
+            self.con.executemany("""
+            INSERT OR IGNORE INTO backtest_results (fingerprint, strategy_version, parameters, metrics, created)
+            VALUES (?, ?, ?, ?, ?);
+            """, rows)
+
+    def history(self, fingerprint, limit=None):
+        # [(point, metrics)] stored for fingerprint under this strategy version, oldest first
+        rows = self.con.execute("""
+        SELECT parameters, metrics FROM backtest_results
+        WHERE fingerprint = ? AND strategy_version = ?
+        ORDER BY created;
+        """, (fingerprint, self.version)).fetchall()
+        if limit is not None:
+            rows = rows[-limit:]
+        return [(json.loads(parameters), None if metrics is None else json.loads(metrics)) for parameters, metrics in rows]
+
+    def count(self, fingerprint=None):
+        if fingerprint is None:
+            return self.con.execute("SELECT COUNT(*) FROM backtest_results;").fetchone()[0]
+        return self.con.execute("""
+        SELECT COUNT(*) FROM backtest_results WHERE fingerprint = ? AND strategy_version = ?;
+        """, (fingerprint, self.version)).fetchone()[0]
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+import numpy as np
+
+# recompute the running cross products from the ring buffer every this many bars to stop rounding drift
+RESYNC_INTERVAL = 1024
+
+CORRELATION_MODES = ('block', 'scale')
+
+
+class RollingCorrelation:
+    # correlation of the last `window` bar returns for a whole universe of tickers. each update()
+    # folds the new return vector in and the oldest one out of running sums and a running cross
+    # product matrix, a rank-2 update costing O(N^2) instead of O(N^2 * window) for a recompute.
+    # a ticker without a bar (or without a previous price) counts as a zero return for that bar
+    __slots__ = ('tickers', 'index', 'window', 'min_periods', 'count', 'buffer', 'sums', 'products', 'last_price')
+
+    def __init__(self, tickers, window=120, min_periods=None):
+        self.tickers = list(tickers)
+        self.index = {ticker: i for i, ticker in enumerate(self.tickers)}
+        self.window = window
+        self.min_periods = min_periods or window
+        self.count = 0
+
+        size = len(self.tickers)
+        self.buffer = np.zeros((window, size))
+        self.sums = np.zeros(size)
+        self.products = np.zeros((size, size))
+        self.last_price = np.full(size, np.nan)
+
+    @property
+    def ready(self):
+        return min(self.count, self.window) >= self.min_periods
+
+    def _resync(self):
+        self.sums = self.buffer.sum(axis=0)
+        self.products = self.buffer.T @ self.buffer
+
+    def update(self, returns):
+        returns = np.nan_to_num(np.asarray(returns, dtype=np.float64), nan=0.0, posinf=0.0, neginf=0.0)
+        slot = self.count % self.window
+        oldest = self.buffer[slot].copy()
+        self.buffer[slot] = returns
+        self.count += 1
+
+        if self.count % RESYNC_INTERVAL == 0:
+            self._resync()
+            return
+
+        # products += new new^T - old old^T as one (N, 2) x (2, N) product
+        self.sums += returns - oldest
+        pair = np.stack([returns, oldest])
+        self.products += pair.T @ (pair * np.array([[1.0], [-1.0]]))
+
+    def update_prices(self, prices):
+        # prices is one bar of closes for the universe, NaN where a ticker has no bar
+        prices = np.asarray(prices, dtype=np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            returns = prices / self.last_price - 1
+        self.last_price = np.where(np.isfinite(prices), prices, self.last_price)
+        self.update(returns)
+
+    def _positions(self, tickers):
+        if tickers is None:
+            return np.arange(len(self.tickers))
+        return np.array([self.index[ticker] for ticker in tickers], dtype=np.int64)
+
+    def correlation(self, rows=None, columns=None):
+        # (rows, columns) block of the correlation matrix, the full matrix by default. tickers with no
+        # variance in the window have NaN correlation. NaN everywhere until min_periods bars are in
+        rows = self._positions(rows)
+        columns = self._positions(columns)
+        n = min(self.count, self.window)
+        if not self.ready:
+            return np.full((len(rows), len(columns)), np.nan)
+
+        mean = self.sums / n
+        variance = np.clip(np.diagonal(self.products) / n - mean ** 2, 0.0, None)
+        std = np.sqrt(variance)
+        covariance = self.products[np.ix_(rows, columns)] / n - np.outer(mean[rows], mean[columns])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            correlation = covariance / np.outer(std[rows], std[columns])
+        return np.clip(np.where(np.isfinite(correlation), correlation, np.nan), -1.0, 1.0)
+
+
+def exposure_scale(correlation, threshold=0.7, mode='block'):
+    # correlation is a (candidates, holdings) block. a candidate whose highest positive correlation
+    # with any holding is above threshold gets 0 in block mode, or a size multiplier falling linearly
+    # from 1 at the threshold to 0 at perfect correlation in scale mode. everything else gets 1
+    if mode not in CORRELATION_MODES:
+        raise ValueError(f"UNKNOWN CORRELATION MODE {mode}, EXPECTED ONE OF {CORRELATION_MODES}")
+
+    correlation = np.asarray(correlation, dtype=np.float64)
+    if correlation.size == 0:
+        return np.ones(correlation.shape[0])
+
+    highest = np.nan_to_num(correlation, nan=0.0).max(axis=1)
+    if mode == 'block':
+        return np.where(highest > threshold, 0.0, 1.0)
+    return np.clip((1 - highest) / (1 - threshold), 0.0, 1.0)
+
+
+class CorrelationFilter:
+    # entry gate for the backtesters: how much of a new position to take given what is already held
+    def __init__(self, correlation, threshold=0.7, mode='block'):
+        self.correlation = correlation
+        self.threshold = threshold
+        self.mode = mode
+
+    def scale(self, candidates, holdings):
+        if len(holdings) == 0 or not self.correlation.ready:
+            return np.ones(len(candidates))
+        block = self.correlation.correlation(candidates, holdings)
+        return exposure_scale(block, self.threshold, self.mode)
+
+    def scale_batch(self, candidates, holdings):
+        # candidates entering on the same bar are screened in order, each one against the holdings
+        # plus the candidates already let in, so two correlated tickers can't slip in together
+        holdings = list(holdings)
+        scales = np.ones(len(candidates))
+        for i, candidate in enumerate(candidates):
+            scales[i] = self.scale([candidate], holdings)[0]
+            if scales[i] > 0:
+                holdings.append(candidate)
+        return scales
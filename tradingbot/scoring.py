@@ -1,16 +1,31 @@
 #!/usr/bin/env python
 
-import pandas as pd
+import numpy as np
+from tradingbot import instrument
+
+# integer signal codes used by the array-based backtest
+HOLD = 0
+BUY = 1
+SELL = 2
+
+SIGNAL_NAMES = {HOLD: "HOLD", BUY: "BUY", SELL: "SELL"}
 
-# store the last trade timestamp globally
-last_trade_timestamp = None
 cooldown_period = 50  # Cooldown period (in data points, e.g., 50 periods)
 
-def evaluate_buy_signal(indicators):
+# marks a ticker that hasn't traded yet in a cooldown state array
+NO_TRADE = np.iinfo(np.int64).min
+
+
+def new_cooldown_state(ticker_count):
+    # per-ticker timestamp of the last BUY/SELL. callers own this array, so nothing is shared between workers
+    return np.full(ticker_count, NO_TRADE, dtype=np.int64)
+
+
+def evaluate_buy_signal(indicators, rsi_buy=30, bb_width_min=0.2, zscore_band=1, relative_volume_min=1.5):
     buy_score = 0
 
     # rsi condition (buy when RSI is under 30, oversold)
-    if indicators.get('rsi_14', 0) < 30:
+    if indicators.get('rsi_14', 0) < rsi_buy:
         buy_score += 1
 
     # moving average condition (short-term average above long-term average)
@@ -18,7 +33,7 @@ def evaluate_buy_signal(indicators):
         buy_score += 1
 
     # bollinger bands condition (price near lower band, possible rebound)
-    if indicators.get('bb_width_20', 0) > 0.2 and indicators.get('zscore_20', 0) < -1:
+    if indicators.get('bb_width_20', 0) > bb_width_min and indicators.get('zscore_20', 0) < -zscore_band:
         buy_score += 1
 
     # macd condition (macd crossing above signal line)
@@ -26,17 +41,17 @@ def evaluate_buy_signal(indicators):
         buy_score += 1
 
     # relative volume condition (higher volume than average)
-    if indicators.get('relative_volume_20', 0) > 1.5:
+    if indicators.get('relative_volume_20', 0) > relative_volume_min:
         buy_score += 1
 
     return buy_score
 
 
-def evaluate_sell_signal(indicators):
+def evaluate_sell_signal(indicators, rsi_sell=70, bb_width_min=0.2, zscore_band=1):
     sell_score = 0
 
     # rsi condition (sell when rsi is above 70, overbought)
-    if indicators.get('rsi_14', 0) > 70:
+    if indicators.get('rsi_14', 0) > rsi_sell:
         sell_score += 1
 
     # moving average condition (short-term average below long-term average)
@@ -44,7 +59,7 @@ def evaluate_sell_signal(indicators):
         sell_score += 1
 
     # bollinger bands condition (price near upper band, possible reversal)
-    if indicators.get('bb_width_20', 0) > 0.2 and indicators.get('zscore_20', 0) > 1:
+    if indicators.get('bb_width_20', 0) > bb_width_min and indicators.get('zscore_20', 0) > zscore_band:
         sell_score += 1
 
     # macd condition (macd crossing below signal line)
@@ -54,24 +69,80 @@ def evaluate_sell_signal(indicators):
     return sell_score
 
 
-def generate_trade_signal(indicators, buy_threshold=3, sell_threshold=3, current_timestamp=None):
-    global last_trade_timestamp
-
-    # check if down period has passed since last trade
-    if last_trade_timestamp is not None and current_timestamp - last_trade_timestamp < cooldown_period:
-        return "HOLD"  # prevent trade if cooldown period is not over
+@instrument.timed('generate_trade_signal')
+def generate_trade_signal(indicators, buy_threshold=3, sell_threshold=3, current_timestamp=None,
+                          cooldown_state=None, ticker_code=None):
+    # the cooldown only applies when the caller passes its own state array and a timestamp
+    use_cooldown = cooldown_state is not None and current_timestamp is not None
+    if use_cooldown:
+        last_trade_timestamp = cooldown_state[ticker_code]
+        # check if down period has passed since last trade
+        if last_trade_timestamp != NO_TRADE and current_timestamp - last_trade_timestamp < cooldown_period:
+            return "HOLD"  # prevent trade if cooldown period is not over
 
     buy_score = evaluate_buy_signal(indicators)
     sell_score = evaluate_sell_signal(indicators)
 
     # buy if score reaches threshold
     if buy_score >= buy_threshold:
-        last_trade_timestamp = current_timestamp
-        return "BUY"
+        signal = "BUY"
     # sell if score reaches threshold
     elif sell_score >= sell_threshold:
-        last_trade_timestamp = current_timestamp 
-        return "SELL"
+        signal = "SELL"
     # else, Hold
     else:
-        return "HOLD"
\ No newline at end of file
+        return "HOLD"
+
+    if use_cooldown:
+        cooldown_state[ticker_code] = current_timestamp
+    return signal
+
+
+def evaluate_buy_signals(indicators, rsi_buy=30, bb_width_min=0.2, zscore_band=1, relative_volume_min=1.5):
+    # vectorized evaluate_buy_signal. indicators maps column name -> array, NaN counts as False
+    buy_score = (indicators['rsi_14'] < rsi_buy).astype(np.int8)
+    buy_score += indicators['sma_10'] > indicators['sma_50']
+    buy_score += (indicators['bb_width_20'] > bb_width_min) & (indicators['zscore_20'] < -zscore_band)
+    buy_score += indicators['macd'] > indicators['macd_signal']
+    buy_score += indicators['relative_volume_20'] > relative_volume_min
+    return buy_score
+
+
+def evaluate_sell_signals(indicators, rsi_sell=70, bb_width_min=0.2, zscore_band=1):
+    # vectorized evaluate_sell_signal
+    sell_score = (indicators['rsi_14'] > rsi_sell).astype(np.int8)
+    sell_score += indicators['sma_10'] < indicators['sma_50']
+    sell_score += (indicators['bb_width_20'] > bb_width_min) & (indicators['zscore_20'] > zscore_band)
+    sell_score += indicators['macd'] < indicators['macd_signal']
+    return sell_score
+
+
+def apply_cooldown(signals, ticker_codes, timestamps, cooldown_state, period=cooldown_period):
+    # walk only the rows that fired, in order. a suppressed signal doesn't restart the cooldown,
+    # and cooldown_state is updated in place so the next batch carries on where this one ended
+    for i in np.flatnonzero(signals):
+        code = ticker_codes[i]
+        last_trade_timestamp = cooldown_state[code]
+        if last_trade_timestamp != NO_TRADE and timestamps[i] - last_trade_timestamp < period:
+            signals[i] = HOLD
+        else:
+            cooldown_state[code] = timestamps[i]
+    return signals
+
+
+@instrument.timed('generate_trade_signals_batch', rows=len)
+def generate_trade_signals_batch(indicators, buy_threshold=3, sell_threshold=3, rsi_buy=30, rsi_sell=70,
+                                 bb_width_min=0.2, zscore_band=1, relative_volume_min=1.5,
+                                 ticker_codes=None, timestamps=None, cooldown_state=None,
+                                 period=cooldown_period):
+    buy_score = evaluate_buy_signals(indicators, rsi_buy, bb_width_min, zscore_band, relative_volume_min)
+    sell_score = evaluate_sell_signals(indicators, rsi_sell, bb_width_min, zscore_band)
+
+    # buy wins over sell when both reach their thresholds, same as generate_trade_signal
+    signals = np.where(buy_score >= buy_threshold, BUY, np.where(sell_score >= sell_threshold, SELL, HOLD)).astype(np.int8)
+
+    # per-ticker cooldown, only when the caller provides rows' tickers, timestamps and a state array
+    if cooldown_state is not None:
+        apply_cooldown(signals, ticker_codes, timestamps, cooldown_state, period)
+
+    return signals
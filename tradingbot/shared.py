@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+
+import sys
+import numpy as np
+from multiprocessing import shared_memory
+
+
+# copy named arrays into shared memory once so worker processes can map them without pickling.
+# returns the segments (keep them alive, then release_arrays) and a small picklable spec
+def publish_arrays(arrays):
+    segments = []
+    spec = {}
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        segment = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        view = np.ndarray(array.shape, dtype=array.dtype, buffer=segment.buf)
+        view[...] = array
+        segments.append(segment)
+        spec[name] = (segment.name, array.shape, array.dtype.str)
+    return segments, spec
+
+
+# map the arrays described by a spec from publish_arrays. the arrays are only valid while
+# the returned segments stay open
+def attach_arrays(spec):
+    segments = []
+    arrays = {}
+    for name, (segment_name, shape, dtype) in spec.items():
+        if sys.version_info >= (3, 13):
+            segment = shared_memory.SharedMemory(name=segment_name, track=False)
+        else:
+            segment = shared_memory.SharedMemory(name=segment_name)
+        segments.append(segment)
+        arrays[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=segment.buf)
+    return segments, arrays
+
+
+def release_arrays(segments, unlink=True):
+    for segment in segments:
+        segment.close()
+        if unlink:
+            segment.unlink()
@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+
+import math
+import sqlite3 as sq3
+from tradingbot.indicators import INDICATOR_COLUMNS
+
+# recompute the running sums from the ring buffers every this many bars to stop rounding drift
+RESYNC_INTERVAL = 1024
+
+# talib.MACD(12, 26, 9) seeds both EMAs on the bar where the slow one fills up, and the signal
+# line once it has 9 MACD values
+MACD_FAST = 12
+MACD_SLOW = 26
+MACD_SIGNAL = 9
+
+
+class IncrementalIndicators:
+    # O(1) per bar version of compute_indicator_matrix for a single ticker, using ring buffers
+    # and running sums. update() returns the same values the batch engine gives for that bar
+    __slots__ = (
+        'count', 'reference', 'previous_close',
+        'closes', 'volumes', 'gains', 'losses', 'true_ranges',
+        'sum_10', 'sum_50', 'sum_20', 'sumsq_20', 'sum_volume', 'sum_gain', 'sum_loss', 'sum_true_range',
+        'ema_fast', 'ema_slow', 'macd_seed', 'macd_signal', 'latest'
+    )
+
+    def __init__(self):
+        self.count = 0
+        self.reference = 0.0
+        self.previous_close = math.nan
+
+        # ring buffers, slot = bar number modulo size
+        self.closes = [0.0] * 50
+        self.volumes = [0.0] * 20
+        self.gains = [0.0] * 14
+        self.losses = [0.0] * 14
+        self.true_ranges = [0.0] * 14
+
+        self.sum_10 = 0.0
+        self.sum_50 = 0.0
+        # closes in the 20-bar window are shifted by the first close, same as the batch engine
+        self.sum_20 = 0.0
+        self.sumsq_20 = 0.0
+        self.sum_volume = 0.0
+        self.sum_gain = 0.0
+        self.sum_loss = 0.0
+        self.sum_true_range = 0.0
+
+        self.ema_fast = math.nan
+        self.ema_slow = math.nan
+        self.macd_seed = 0.0
+        self.macd_signal = math.nan
+        self.latest = dict.fromkeys(INDICATOR_COLUMNS, math.nan)
+
+    @classmethod
+    def from_history(cls, high, low, close, volume):
+        # warm start by replaying past bars
+        state = cls()
+        for bar in zip(high, low, close, volume):
+            state.update(*bar)
+        return state
+
+    def _resync(self):
+        n = self.count
+        closes = self.closes
+        window = [closes[i % 50] for i in range(n - 20, n)]
+        self.sum_10 = math.fsum(closes[i % 50] for i in range(n - 10, n))
+        self.sum_50 = math.fsum(closes)
+        self.sum_20 = math.fsum(c - self.reference for c in window)
+        self.sumsq_20 = math.fsum((c - self.reference) ** 2 for c in window)
+        self.sum_volume = math.fsum(self.volumes)
+        self.sum_gain = math.fsum(self.gains)
+        self.sum_loss = math.fsum(self.losses)
+        self.sum_true_range = math.fsum(self.true_ranges)
+
+    def update(self, high, low, close, volume):
+        n = self.count
+        high = float(high)
+        low = float(low)
+        close = float(close)
+        volume = float(volume)
+        previous_close = self.previous_close
+        if n == 0:
+            self.reference = close
+        reference = self.reference
+
+        # closes leaving the 10, 20 and 50 bar windows, read before the new close overwrites its slot
+        closes = self.closes
+        slot = n % 50
+        if n >= 10:
+            self.sum_10 -= closes[(n - 10) % 50]
+        if n >= 20:
+            leaving = closes[(n - 20) % 50] - reference
+            self.sum_20 -= leaving
+            self.sumsq_20 -= leaving * leaving
+        if n >= 50:
+            self.sum_50 -= closes[slot]
+        closes[slot] = close
+        shifted = close - reference
+        self.sum_10 += close
+        self.sum_20 += shifted
+        self.sumsq_20 += shifted * shifted
+        self.sum_50 += close
+
+        # volume
+        slot = n % 20
+        self.sum_volume += volume - self.volumes[slot]
+        self.volumes[slot] = volume
+
+        # gains and losses exist from the second bar on
+        if n >= 1:
+            delta = close - previous_close
+            slot = (n - 1) % 14
+            gain = delta if delta > 0 else 0.0
+            loss = -delta if delta < 0 else 0.0
+            self.sum_gain += gain - self.gains[slot]
+            self.sum_loss += loss - self.losses[slot]
+            self.gains[slot] = gain
+            self.losses[slot] = loss
+
+        # true range, just high - low on the first bar
+        if n == 0:
+            true_range = high - low
+        else:
+            true_range = max(high - low, abs(high - previous_close), abs(low - previous_close))
+        slot = n % 14
+        self.sum_true_range += true_range - self.true_ranges[slot]
+        self.true_ranges[slot] = true_range
+
+        # macd (12, 26, 9)
+        seed_bar = MACD_SLOW - 1
+        if n == seed_bar:
+            self.ema_slow = math.fsum(closes[i % 50] for i in range(0, n + 1)) / MACD_SLOW
+            self.ema_fast = math.fsum(closes[i % 50] for i in range(n + 1 - MACD_FAST, n + 1)) / MACD_FAST
+        elif n > seed_bar:
+            self.ema_fast += (close - self.ema_fast) * (2.0 / (MACD_FAST + 1))
+            self.ema_slow += (close - self.ema_slow) * (2.0 / (MACD_SLOW + 1))
+        macd = self.ema_fast - self.ema_slow
+        if seed_bar <= n < seed_bar + MACD_SIGNAL:
+            self.macd_seed += macd
+            if n == seed_bar + MACD_SIGNAL - 1:
+                self.macd_signal = self.macd_seed / MACD_SIGNAL
+        elif n >= seed_bar + MACD_SIGNAL:
+            self.macd_signal += (macd - self.macd_signal) * (2.0 / (MACD_SIGNAL + 1))
+
+        self.previous_close = close
+        self.count = n + 1
+        if self.count % RESYNC_INTERVAL == 0:
+            self._resync()
+
+        latest = self.latest
+
+        # relative volume (20), bollinger bands (20) and z-score (20)
+        if n >= 19:
+            average_volume = self.sum_volume / 20
+            latest['relative_volume_20'] = volume / average_volume if average_volume else math.nan
+
+            mean = self.sum_20 / 20
+            variance = max(self.sumsq_20 / 20 - mean * mean, 0.0)
+            std = math.sqrt(variance)
+            sample_std = math.sqrt(variance * 20 / 19)
+            middleband = mean + reference
+            latest['upperband'] = middleband + 2 * std
+            latest['middleband'] = middleband
+            latest['lowerband'] = middleband - 2 * std
+            latest['bb_width_20'] = 4 * std / middleband if middleband else math.nan
+            latest['zscore_20'] = (shifted - mean) / sample_std if sample_std != 0 else 0.0
+
+        # rsi (14)
+        if n >= 14:
+            if self.sum_loss == 0:
+                latest['rsi_14'] = 100.0
+            else:
+                latest['rsi_14'] = 100 - (100 / (1 + (self.sum_gain / 14) / (self.sum_loss / 14)))
+
+        # macd
+        if n >= seed_bar + MACD_SIGNAL - 1:
+            latest['macd'] = macd
+            latest['macd_signal'] = self.macd_signal
+            latest['macd_hist'] = macd - self.macd_signal
+
+        # sma 10 and 50
+        if n >= 9:
+            latest['sma_10'] = self.sum_10 / 10
+        if n >= 49:
+            latest['sma_50'] = self.sum_50 / 50
+
+        # atr (14)
+        if n >= 13:
+            latest['atr'] = self.sum_true_range / 14
+
+        return latest
+
+
+class IndicatorBank:
+    # one IncrementalIndicators per ticker
+    def __init__(self):
+        self.states = {}
+
+    def __contains__(self, ticker):
+        return ticker in self.states
+
+    def __getitem__(self, ticker):
+        return self.states[ticker]
+
+    def update(self, ticker, high, low, close, volume):
+        state = self.states.get(ticker)
+        if state is None:
+            state = self.states[ticker] = IncrementalIndicators()
+        return state.update(high, low, close, volume)
+
+    def latest(self, ticker):
+        return self.states[ticker].latest
+
+
+def warm_start_from_db(tickers, db_path=None, start_date=None, end_date=None):
+    # replay each ticker's stored bars from the dataloader table into a fresh bank.
+    # end_date is exclusive, so a live feed can pick up from that bar
+    from tradingbot.dataloader import DB_PATH, to_epoch, ticker_chunks
+    if db_path is None:
+        db_path = DB_PATH
+
+    bounds = ""
+    params = []
+    if start_date is not None:
+        bounds += " AND Timestamp >= ?"
+        params.append(int(to_epoch([start_date])[0]))
+    if end_date is not None:
+        bounds += " AND Timestamp < ?"
+        params.append(int(to_epoch([end_date])[0]))
+
+    # tickers in chunks that stay under SQLite's bound parameter limit, like the dataloader's queries
+    bank = IndicatorBank()
+    con = sq3.connect(db_path)
+    try:
+        for chunk in ticker_chunks(sorted(tickers)):
+            placeholders = ",".join("?" * len(chunk))
+            query = f"""
+            SELECT Ticker, High, Low, Close, Volume FROM dataloader
+            WHERE Ticker IN ({placeholders}){bounds}
+            ORDER BY Ticker, Timestamp;
+            """
+            for ticker, high, low, close, volume in con.execute(query, [*chunk, *params]):
+                bank.update(ticker, high, low, close, volume)
+    finally:
+        con.close()
+    return bank
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+
+import itertools
+import numpy as np
+import pandas as pd
+from tradingbot.kernel import sweep_stats
+from tradingbot.optimizer import PARAMETER_NAMES
+
+
+def parameter_grid(stop_loss_percent, take_profit_percent, cooling_off_period, max_loss_count=(15,)):
+    # every combination of the given values, one row per parameter set
+    points = itertools.product(stop_loss_percent, take_profit_percent, cooling_off_period, max_loss_count)
+    return pd.DataFrame(list(points), columns=list(PARAMETER_NAMES))
+
+
+def sweep(inputs, points, initial_balance=10000, commission_percent=0.005, slippage_percent=0.002, start=50):
+    # evaluate every parameter set in one pass over the shared close/ATR/signal arrays.
+    # points is a DataFrame from parameter_grid or a list of (stop loss, take profit, cooling off, max loss) tuples
+    if not isinstance(points, pd.DataFrame):
+        points = pd.DataFrame([list(point) for point in points], columns=list(PARAMETER_NAMES))
+
+    stats = sweep_stats(
+        inputs['close'],
+        inputs['atr'],
+        inputs['signals'],
+        points['stop_loss_percent'].to_numpy(),
+        points['take_profit_percent'].to_numpy(),
+        points['cooling_off_period'].to_numpy(),
+        points['max_loss_count'].to_numpy(),
+        start=start,
+        initial_balance=initial_balance,
+        commission_percent=commission_percent,
+        slippage_percent=slippage_percent
+    )
+
+    # the same definitions MetricsAccumulator.metrics uses, so a point's numbers don't depend on the mode
+    final_value, return_count, avg_return, return_m2 = stats.T
+    with np.errstate(divide='ignore', invalid='ignore'):
+        avg_return = np.where(return_count > 0, avg_return, np.nan)
+        volatility = np.where(avg_return != 0, np.sqrt(return_m2 / return_count) / avg_return, np.nan)
+        sharpe = np.where(volatility > 0, (avg_return - 0.005) / volatility, 0.0)
+
+    results = points.reset_index(drop=True).copy()
+    results['final_value'] = final_value
+    results['total_return'] = final_value / initial_balance - 1
+    results['sharpe_ratio'] = np.where(return_count > 0, sharpe, np.nan)
+    results['avg_return'] = avg_return
+    results['volatility'] = volatility
+    results['return_count'] = return_count.astype(np.int64)
+
+    # same objective as the optimizer, lower is better. a point that recorded no returns scores 0.0,
+    # as optimizer.score gives it for metrics of None
+    score = -(results['sharpe_ratio'] + 0.5 * results['final_value'] - 0.5 * results['volatility'])
+    results['score'] = np.where(return_count > 0, score, 0.0)
+    return results
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+import numpy as np
+import pandas as pd
+from tradingbot.dataloader import BAR_FIELDS, get_trading_hours, connect, ensure_schema, insert_data
+
+# volume multipliers for the quiet / normal / busy regimes a ticker drifts between
+VOLUME_REGIMES = (0.5, 1.0, 3.0)
+
+
+def synthetic_tickers(count):
+    return [f"SYN{i:04d}" for i in range(count)]
+
+
+def synthetic_timestamps(bar_count, start='2024-01-02'):
+    # the first bar_count trading hours from start, on the same grid get_trading_hours builds
+    # (about seven bars a trading day, so ask for enough calendar days and cut)
+    end = pd.Timestamp(start) + pd.Timedelta(days=int(bar_count / 7 * 1.6) + 14)
+    hours = get_trading_hours(start, end)
+    if len(hours) < bar_count:
+        raise ValueError(f"ONLY {len(hours)} TRADING HOURS BETWEEN {start} AND {end}")
+    return pd.DatetimeIndex(pd.to_datetime(hours[:bar_count]))
+
+
+def generate_bars(ticker_count=10, bar_count=1750, start='2024-01-02', seed=0, volatility=0.01, market_beta=0.5,
+                  regimes=VOLUME_REGIMES, regime_persistence=0.98, gap_rate=0.0, gap_length=3):
+    # deterministic hourly OHLCV for ticker_count tickers, as a (Timestamp, Ticker) frame shaped like
+    # load_bars output. returns share a market factor (market_beta) so tickers are correlated, each
+    # ticker has its own volatility, and volume switches between regimes with the given persistence.
+    # gap_rate is the fraction of bars dropped, in runs of gap_length bars. prices and volumes depend
+    # only on seed, so the same seed with and without gaps gives the same bars around the holes
+    rng = np.random.default_rng(seed)
+    tickers = synthetic_tickers(ticker_count)
+    timestamps = synthetic_timestamps(bar_count, start)
+    shape = (bar_count, ticker_count)
+
+    # log returns: common market factor plus idiosyncratic noise, scaled per ticker
+    scale = rng.uniform(0.5, 2.0, ticker_count)
+    market = rng.normal(0, volatility, (bar_count, 1))
+    noise = rng.normal(0, volatility, shape)
+    returns = scale * (market_beta * market + np.sqrt(1 - market_beta ** 2) * noise)
+    close = rng.uniform(5, 200, ticker_count) * np.exp(np.cumsum(returns, axis=0))
+
+    # open near the previous close, high/low bracketing open and close
+    previous = np.vstack([close[:1], close[:-1]])
+    open_ = previous * (1 + rng.normal(0, volatility / 4, shape))
+    high = np.maximum(open_, close) * (1 + np.abs(rng.normal(0, volatility / 2, shape)))
+    low = np.minimum(open_, close) * (1 - np.abs(rng.normal(0, volatility / 2, shape)))
+
+    # markov chain over volume regimes, one step per bar for every ticker at once
+    regimes = np.asarray(regimes, dtype=np.float64)
+    switch = rng.random(shape) > regime_persistence
+    draws = rng.integers(0, len(regimes), shape)
+    state = np.empty(shape, dtype=np.int64)
+    state[0] = draws[0]
+    for i in range(1, bar_count):
+        state[i] = np.where(switch[i], draws[i], state[i - 1])
+    base_volume = rng.lognormal(11, 1, ticker_count)
+    volume = np.round(base_volume * regimes[state] * rng.lognormal(0, 0.3, shape))
+
+    # gaps are drawn last so they don't shift the bars above
+    present = np.ones(shape, dtype=np.bool_)
+    if gap_rate > 0:
+        starts = np.flatnonzero(rng.random(bar_count * ticker_count) < gap_rate / gap_length)
+        for offset in range(gap_length):
+            rows, columns = np.divmod(starts, ticker_count)
+            rows = rows + offset
+            keep = rows < bar_count
+            present[rows[keep], columns[keep]] = False
+
+    fields = {'Open': open_, 'High': high, 'Low': low, 'Close': close, 'Volume': volume}
+    rows, columns = np.nonzero(present)
+    data = pd.DataFrame({field: fields[field][rows, columns] for field in BAR_FIELDS},
+                        index=pd.MultiIndex.from_arrays([timestamps[rows], np.asarray(tickers)[columns]],
+                                                        names=['Timestamp', 'Ticker']))
+    data['Volume'] = data['Volume'].astype(np.int64)
+    return data
+
+
+def frames_by_ticker(data):
+    # {ticker: frame indexed by timestamp}, the layout insert_data and preprocess_batch take
+    return {ticker: frame.droplevel('Ticker') for ticker, frame in data.groupby(level='Ticker', sort=False)}
+
+
+def write_synthetic_db(db_path, **kwargs):
+    # generate bars and upsert them into the dataloader table at db_path. returns the bars written
+    data = generate_bars(**kwargs)
+    con = connect(db_path)
+    try:
+        ensure_schema(con)
+        insert_data(con, frames_by_ticker(data))
+    finally:
+        con.close()
+    return data
@@ -1,18 +1,20 @@
 #!/usr/bin/env python
 
-import pandas as pd
 import numpy as np
 
+# whitespace-separated tickers read when no other list is given
+TICKER_FILE = 'tradingbot-tickers-2025-04-04.txt'
 
-def get_tickers_from_file():
-    with open('tradingbot-tickers-2025-04-04.txt', 'r') as file:
+
+def get_tickers_from_file(path=TICKER_FILE):
+    with open(path, 'r') as file:
         tickers = file.read().split()
     return tickers
 
 
-def calculate_position_size(balance, position_price, atr, risk_percent=0.02):
-    # calculate the dollar amount you're willing to risk
-    risk_amount = balance * risk_percent
+def calculate_position_size(balance, position_price, atr, risk_percent=0.02, exposure=1.0):
+    # calculate the dollar amount you're willing to risk, scaled down by the correlation filter
+    risk_amount = balance * risk_percent * exposure
 
     # calculate stop loss distance as a multiple of ATR (e.g., 1 ATR)
     stop_loss_distance = atr
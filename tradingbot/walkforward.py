@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+
+import os
+import multiprocessing
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from tradingbot import instrument
+from tradingbot.optimizer import PARAMETER_NAMES, evaluate, score
+from tradingbot.shared import publish_arrays, attach_arrays, release_arrays
+from tradingbot.sweep import sweep
+
+# arrays mapped by each worker process, set once by _init_worker
+_worker_segments = None
+_worker_inputs = None
+
+
+def make_folds(timestamps, train_bars, test_bars, step=None, expanding=False):
+    # split the distinct timestamps into consecutive train/test windows. each test window starts
+    # right after its train window; rolling folds slide both forward by `step` (default: one
+    # test window), expanding folds keep the train window anchored at the first bar
+    times = np.unique(timestamps)
+    step = step or test_bars
+    folds = []
+    train_start, train_end = 0, train_bars
+    while train_end + test_bars <= len(times):
+        folds.append({
+            'fold': len(folds),
+            'train_start': int(times[train_start]),
+            'train_end': int(times[train_end - 1]),
+            'test_start': int(times[train_end]),
+            'test_end': int(times[train_end + test_bars - 1])
+        })
+        train_end += step
+        if not expanding:
+            train_start += step
+    return folds
+
+
+def _rows(timestamps, first, last):
+    # the frame is sorted by timestamp, so a time window is one contiguous block of rows
+    return slice(int(np.searchsorted(timestamps, first, 'left')), int(np.searchsorted(timestamps, last, 'right')))
+
+
+def run_fold(inputs, fold, grid, initial_balance=10000):
+    # optimize on the train window with one vectorized sweep, then score the winner out of sample.
+    # indicators were computed over the whole history, so the warm-up before each window is real data
+    names = ('close', 'atr', 'signals')
+    train = _rows(inputs['timestamps'], fold['train_start'], fold['train_end'])
+    test = _rows(inputs['timestamps'], fold['test_start'], fold['test_end'])
+
+    results = sweep({name: inputs[name][train] for name in names}, grid, initial_balance=initial_balance, start=0)
+    best = results.sort_values('score').iloc[0]
+    point = [best[name] for name in PARAMETER_NAMES]
+    point[2], point[3] = int(point[2]), int(point[3])
+
+    metrics = evaluate({name: inputs[name][test] for name in names}, point, initial_balance=initial_balance, start=0)
+
+    report = dict(fold)
+    report.update(zip(PARAMETER_NAMES, point))
+    report['train_score'] = best['score']
+    report['test_score'] = score(metrics)
+    for key in ('final_value', 'total_return', 'sharpe_ratio', 'volatility'):
+        report[f'test_{key}'] = np.nan if metrics is None else metrics[key]
+    return report
+
+
+def _init_worker(spec, instrument_spec=None):
+    global _worker_segments, _worker_inputs
+    _worker_segments, _worker_inputs = attach_arrays(spec)
+    instrument.init_worker(instrument_spec)
+
+    # folds already run in parallel, so keep numba to one thread per process
+    from tradingbot.kernel import HAS_NUMBA
+    if HAS_NUMBA:
+        import numba
+        numba.set_num_threads(1)
+
+
+def _run_fold_in_worker(args):
+    fold, grid, initial_balance = args
+    report = run_fold(_worker_inputs, fold, grid, initial_balance)
+    instrument.flush()
+    return report
+
+
+def summarize_folds(folds):
+    returns = folds['test_total_return'].dropna()
+    return {
+        'folds': len(folds),
+        'mean_test_return': returns.mean(),
+        'median_test_return': returns.median(),
+        'compounded_test_return': float(np.prod(1 + returns) - 1),
+        'positive_folds': float((returns > 0).mean()) if len(returns) else np.nan,
+        'mean_test_sharpe': folds['test_sharpe_ratio'].mean()
+    }
+
+
+def walk_forward(inputs, grid, train_bars, test_bars, step=None, expanding=False, n_jobs=None,
+                 initial_balance=10000, verbose=True):
+    # inputs come from optimizer.prepare_inputs and are published once to shared memory;
+    # each fold is an independent task
+    folds = make_folds(inputs['timestamps'], train_bars, test_bars, step, expanding)
+    if not folds:
+        raise ValueError("NOT ENOUGH BARS FOR A SINGLE TRAIN/TEST FOLD")
+
+    n_jobs = min(n_jobs or os.cpu_count() or 1, len(folds))
+    tasks = [(fold, grid, initial_balance) for fold in folds]
+
+    if n_jobs == 1:
+        reports = [run_fold(inputs, *task) for task in tasks]
+    else:
+        segments, spec = publish_arrays({name: inputs[name] for name in ('timestamps', 'close', 'atr', 'signals')})
+        # spawn rather than fork: numba's default thread pool is not fork-safe once the parent has run
+        # a parallel sweep, and forked workers would deadlock on its locks
+        context = multiprocessing.get_context('spawn')
+        instrument_spec = instrument.worker_spec()
+        try:
+            with ProcessPoolExecutor(max_workers=n_jobs, mp_context=context, initializer=_init_worker,
+                                     initargs=(spec, instrument_spec)) as pool:
+                reports = list(pool.map(_run_fold_in_worker, tasks))
+        finally:
+            release_arrays(segments)
+            instrument.collect_workers(instrument_spec)
+
+    folds = pd.DataFrame(reports)
+    for column in ('train_start', 'train_end', 'test_start', 'test_end'):
+        folds[column] = pd.to_datetime(folds[column])
+    summary = summarize_folds(folds)
+
+    if verbose:
+        print(f"[SYSTEM]: WALK-FORWARD OVER {summary['folds']} FOLDS. "
+              f"MEAN OUT-OF-SAMPLE RETURN {summary['mean_test_return'] * 100:,.2f}%, "
+              f"COMPOUNDED {summary['compounded_test_return'] * 100:,.2f}%")
+
+    return {'folds': folds, 'summary': summary}